@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache for the analyzer
+Level 1 ('notes') maps a MIDI file hash to its extracted note events;
+level 2 ('results') maps MIDI hash + .ly hash + rule/code fingerprint to the
+finished log messages. 'snapshots' keeps each song's previous-run state for
+incremental re-analysis, and 'builds' the PDF/MIDI files LilyPond produced
+for a source (see compile_orchestrator.py). 'ranges' holds per-file pitch
+counts for analyze_ranges.py's corpus mode. Entries are pickles, evicted
+least-recently-used once the cache grows past its size limit.
+
+pickle and tempfile are imported on first use so importing the analyzer
+(e.g. for --help) doesn't pay for them.
+"""
+
+import hashlib
+import os
+
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.environ.get('SHAPENOTE_CACHE_DIR', os.path.join(ANALYSIS_DIR, '.cache'))
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+
+CACHE_LEVELS = ('notes', 'results', 'snapshots', 'builds', 'ranges')
+
+# Puts between full scans of the cache directory. In between, the size is
+# tracked from what this process writes; a scan also counts other processes'
+RESCAN_INTERVAL = 100
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file's contents, or None if it can't be read"""
+    if not path:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def fingerprint(*parts):
+    """SHA-256 hex digest of the repr of each part (for composite cache keys)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def source_fingerprint(*module_files):
+    """Fingerprint of source files, so cached results expire when the code changes"""
+    return fingerprint(*(file_digest(path) for path in module_files))
+
+
+class AnalysisCache:
+    """Two-level pickle cache in a local directory with LRU eviction"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.known_bytes = None  # Cache size as of the last scan plus our writes since
+        self.puts_since_scan = 0
+
+    def entry_path(self, level, key):
+        return os.path.join(self.cache_dir, level, f"{key}.pickle")
+
+    def get(self, level, key):
+        """Cached value, or None on a miss (or an unreadable entry)"""
+        import pickle
+
+        path = self.entry_path(level, key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+
+        # Touch the entry so eviction sees it as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, level, key, value):
+        """Store a value, then evict old entries if the cache is over its limit"""
+        import pickle
+        import tempfile
+
+        directory = os.path.join(self.cache_dir, level)
+        path = self.entry_path(level, key)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            # Write to a temp file and rename so readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+            written = os.path.getsize(path)
+        except OSError:
+            return  # A read-only or full disk just means no caching
+
+        self.puts_since_scan += 1
+        if self.known_bytes is None or self.puts_since_scan >= RESCAN_INTERVAL:
+            self.evict()
+            return
+        self.known_bytes += written - replaced
+        if self.known_bytes > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """(last used time, size, path) for every entry, oldest first"""
+        found = []
+        for level in CACHE_LEVELS:
+            directory = os.path.join(self.cache_dir, level)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith('.pickle'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, path))
+        return sorted(found)
+
+    def evict(self):
+        """Remove least-recently-used entries until the cache fits in max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self.known_bytes = total
+        self.puts_since_scan = 0
+
+    def clear(self):
+        """Delete every cache entry; returns the number removed"""
+        removed = 0
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        self.known_bytes = None
+        return removed
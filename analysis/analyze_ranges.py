@@ -1,12 +1,35 @@
 #!/usr/bin/env python3
 """
 Analyze Sacred Harp MusicXML files to extract actual vocal ranges
+Files are streamed with iterparse into per-voice VoiceRange accumulators, so
+memory stays flat however large the score (e.g. a whole tunebook export).
+Each accumulator is a fixed 128-bin pitch histogram (optionally weighted by
+note duration) that merges across files and workers in constant memory.
+
+--write-table turns the corpus histograms into range_tables.py, the range
+table the analyzer loads at startup.
 """
 
 import xml.etree.ElementTree as ET
 from collections import defaultdict
+import os
+import re
 import sys
 
+MUSICXML_EXTENSIONS = ('.mxl', '.xml', '.musicxml')
+
+# One histogram bin per MIDI pitch
+PITCH_BINS = 128
+
+# Voices of the analyzer's range table, matched against part names
+TABLE_VOICES = ('treble', 'alto', 'tenor', 'bass')
+
+# Bass notes at or below this are too low to sing (G2). A singing limit, not a
+# corpus statistic, so it stays fixed when the table is regenerated
+BASS_CRITICAL_LOW = 43
+
+RANGE_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'range_tables.py')
+
 def note_to_midi(step, octave, alter=0):
     """Convert step, octave, alter to MIDI note number"""
     note_values = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
@@ -19,35 +42,83 @@ def midi_to_note_name(midi):
     note = notes[midi % 12]
     return f"{note}{octave}"
 
-def analyze_musicxml_ranges(xml_file):
-    """Analyze vocal ranges from MusicXML file"""
+class VoiceRange:
+    """Pitch histogram for one voice
+    
+    bins[midi] holds the number of notes at that pitch, or their total
+    length in quarter notes when duration-weighted. Percentiles come from
+    the cumulative weights; unweighted, they match indexing the sorted list
+    of pitches.
+    """
+    
+    def __init__(self, bins=None, count=0):
+        self.bins = list(bins) if bins else [0] * PITCH_BINS
+        self.count = count  # Notes added, whatever the weighting
+    
+    def add(self, midi, weight=1):
+        if 0 <= midi < PITCH_BINS:
+            self.bins[midi] += weight
+            self.count += 1
+    
+    def merge(self, other):
+        """Fold another voice's histogram into this one"""
+        self.bins = [mine + theirs for mine, theirs in zip(self.bins, other.bins)]
+        self.count += other.count
+    
+    @property
+    def min(self):
+        return next((midi for midi, weight in enumerate(self.bins) if weight), None)
+    
+    @property
+    def max(self):
+        return next((midi for midi in range(PITCH_BINS - 1, -1, -1) if self.bins[midi]), None)
+    
+    def weight(self):
+        return sum(self.bins)
+    
+    def mean(self):
+        return sum(midi * weight for midi, weight in enumerate(self.bins)) / self.weight()
+    
+    def percentile(self, fraction):
+        """Lowest pitch whose cumulative weight passes fraction of the total"""
+        rank = fraction * self.weight()
+        seen = 0
+        for midi, weight in enumerate(self.bins):
+            seen += weight
+            if weight and seen > rank:
+                return midi
+        return self.max
+
+def analyze_musicxml_ranges(xml_file, duration_weighted=False):
+    """Analyze vocal ranges from a MusicXML file (path or binary file object)
+    
+    Returns (title, {voice name: VoiceRange}). The file is read with
+    iterparse and each measure is dropped once its pitches are counted.
+    Duration-weighted histograms skip grace notes, which have no duration.
+    """
+    title = None
+    part_names = {}
+    voice_ranges = defaultdict(VoiceRange)
+    voice_range = None
+    divisions = 1  # <duration> units per quarter note in the current part
+    path = []  # Open elements, outermost first
+    
     try:
-        tree = ET.parse(xml_file)
-        root = tree.getroot()
-        
-        # Extract title
-        title_elem = root.find('.//work-title')
-        title = title_elem.text if title_elem is not None else "Unknown"
-        
-        # Get part names and their pitch ranges
-        voice_ranges = defaultdict(list)
-        
-        # Find all parts
-        parts = root.findall('.//score-part')
-        part_names = {}
-        for part in parts:
-            part_id = part.get('id')
-            name_elem = part.find('part-name')
-            if name_elem is not None:
-                part_names[part_id] = name_elem.text.lower()
-        
-        # Analyze pitches in each part
-        for part in root.findall('.//part'):
-            part_id = part.get('id')
-            voice_name = part_names.get(part_id, f"part_{part_id}")
+        for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+            if event == 'start':
+                path.append(elem)
+                if elem.tag == 'part':
+                    part_id = elem.get('id')
+                    voice_range = voice_ranges[part_names.get(part_id, f"part_{part_id}")]
+                    divisions = 1
+                continue
             
-            # Find all pitches in this part
-            for pitch_elem in part.findall('.//pitch'):
+            path.pop()
+            tag = elem.tag
+            if tag == 'note':
+                pitch_elem = elem.find('pitch')
+                if pitch_elem is None or voice_range is None:
+                    continue
                 step_elem = pitch_elem.find('step')
                 octave_elem = pitch_elem.find('octave')
                 alter_elem = pitch_elem.find('alter')
@@ -56,72 +127,127 @@ def analyze_musicxml_ranges(xml_file):
                     step = step_elem.text
                     octave = int(octave_elem.text)
                     alter = int(alter_elem.text) if alter_elem is not None else 0
-                    
                     midi_note = note_to_midi(step, octave, alter)
-                    voice_ranges[voice_name].append(midi_note)
+                    
+                    if not duration_weighted:
+                        voice_range.add(midi_note)
+                    else:
+                        duration_elem = elem.find('duration')
+                        if duration_elem is not None:
+                            voice_range.add(midi_note, int(duration_elem.text) / divisions)
+            elif tag == 'divisions':
+                divisions = int(elem.text)
+            elif tag == 'measure':
+                # Processed: detach it so the tree never holds more than one measure
+                elem.clear()
+                if path:
+                    path[-1].remove(elem)
+            elif tag == 'score-part':
+                name_elem = elem.find('part-name')
+                if name_elem is not None:
+                    part_names[elem.get('id')] = name_elem.text.lower()
+            elif tag == 'work-title' and title is None:
+                title = elem.text
+            elif tag == 'part':
+                voice_range = None
         
-        return title, voice_ranges
+        return title or "Unknown", dict(voice_ranges)
         
     except Exception as e:
         print(f"Error analyzing {xml_file}: {e}")
         return None, {}
 
-def download_and_analyze_files(urls):
-    """Download and analyze multiple MusicXML files"""
-    import urllib.request
+def open_musicxml(data):
+    """Binary file object for the score in a MusicXML file's bytes
+    
+    Compressed .mxl files are read in memory: the score named by
+    META-INF/container.xml (or the first .xml file) is streamed straight
+    out of the archive, without extracting anything.
+    """
+    import io
     import zipfile
-    import os
     
-    all_ranges = defaultdict(list)
+    if not data.startswith(b'PK'):
+        return io.BytesIO(data)
+    
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    names = archive.namelist()
+    score_name = None
+    if 'META-INF/container.xml' in names:
+        container = ET.fromstring(archive.read('META-INF/container.xml'))
+        rootfile = next((elem for elem in container.iter() if elem.tag.endswith('rootfile')), None)
+        if rootfile is not None and rootfile.get('full-path') in names:
+            score_name = rootfile.get('full-path')
+    if score_name is None:
+        xml_files = [name for name in names if name.endswith(('.xml', '.musicxml'))
+                     and not name.startswith('META-INF')]
+        if not xml_files:
+            raise ValueError("no MusicXML score in archive")
+        score_name = xml_files[0]
+    return archive.open(score_name)
+
+def ranges_to_data(voice_ranges):
+    """{voice: (count, bins)}: a VoiceRange dict as plain data (for pickling and the cache)"""
+    return {voice: (voice_range.count, voice_range.bins) for voice, voice_range in voice_ranges.items()}
+
+def ranges_from_data(data):
+    """Inverse of ranges_to_data"""
+    return {voice: VoiceRange(bins, count) for voice, (count, bins) in data.items()}
+
+def analyze_musicxml_data(data, name, duration_weighted=False):
+    """(title, {voice: (count, bins)}) for one file's bytes; title is None on failure"""
+    try:
+        source = open_musicxml(data)
+    except Exception as e:
+        print(f"Error analyzing {name}: {e}")
+        return None, {}
+    with source:
+        title, voice_ranges = analyze_musicxml_ranges(source, duration_weighted)
+    return title, ranges_to_data(voice_ranges)
+
+def analyze_corpus_file(path, duration_weighted=False):
+    """Pool worker: analyze one local .mxl/.xml file"""
+    with open(path, 'rb') as f:
+        return analyze_musicxml_data(f.read(), path, duration_weighted)
+
+def add_song(title, voice_ranges, all_ranges, song_data):
+    """Add a song to the report and merge its voices into all_ranges"""
+    song_info = {'title': title, 'ranges': {}}
+    
+    for voice, voice_range in voice_ranges.items():
+        if voice_range.count:
+            min_pitch = voice_range.min
+            max_pitch = voice_range.max
+            all_ranges[voice].merge(voice_range)
+            
+            song_info['ranges'][voice] = {
+                'min_midi': min_pitch,
+                'max_midi': max_pitch,
+                'min_note': midi_to_note_name(min_pitch),
+                'max_note': midi_to_note_name(max_pitch),
+                'range_semitones': max_pitch - min_pitch
+            }
+    
+    song_data.append(song_info)
+
+def download_and_analyze_files(urls, duration_weighted=False):
+    """Download and analyze multiple MusicXML files (in memory, one at a time)"""
+    import urllib.request
+    
+    all_ranges = defaultdict(VoiceRange)
     song_data = []
     
-    for i, url in enumerate(urls):
+    for url in urls:
         try:
-            # Download file
-            filename = f"song_{i+1}.mxl"
-            urllib.request.urlretrieve(url, filename)
-            
-            # Extract if it's a zip
-            if zipfile.is_zipfile(filename):
-                with zipfile.ZipFile(filename, 'r') as zip_ref:
-                    # Find the main XML file
-                    xml_files = [f for f in zip_ref.namelist() if f.endswith('.xml') and not f.startswith('META-INF')]
-                    if xml_files:
-                        zip_ref.extract(xml_files[0])
-                        xml_filename = xml_files[0]
-                    else:
-                        continue
-            else:
-                xml_filename = filename
+            with urllib.request.urlopen(url) as response:
+                data = response.read()
             
-            # Analyze the XML file
-            title, voice_ranges = analyze_musicxml_ranges(xml_filename)
+            title, ranges_data = analyze_musicxml_data(data, url, duration_weighted)
+            voice_ranges = ranges_from_data(ranges_data)
             
             if voice_ranges:
-                song_info = {'title': title, 'ranges': {}}
-                
-                for voice, pitches in voice_ranges.items():
-                    if pitches:
-                        min_pitch = min(pitches)
-                        max_pitch = max(pitches)
-                        all_ranges[voice].extend(pitches)
-                        
-                        song_info['ranges'][voice] = {
-                            'min_midi': min_pitch,
-                            'max_midi': max_pitch,
-                            'min_note': midi_to_note_name(min_pitch),
-                            'max_note': midi_to_note_name(max_pitch),
-                            'range_semitones': max_pitch - min_pitch
-                        }
-                
-                song_data.append(song_info)
+                add_song(title, voice_ranges, all_ranges, song_data)
                 print(f"✓ Analyzed: {title}")
-            
-            # Cleanup
-            if os.path.exists(xml_filename):
-                os.remove(xml_filename)
-            if os.path.exists(filename):
-                os.remove(filename)
                 
         except Exception as e:
             print(f"Error with {url}: {e}")
@@ -129,25 +255,184 @@ def download_and_analyze_files(urls):
     
     return all_ranges, song_data
 
-if __name__ == "__main__":
-    # Sacred Harp URLs from user
-    urls = [
-        "https://shapenote.net/musicxml/33b.mxl",
-        "https://shapenote.net/musicxml/45t.mxl", 
-        "https://shapenote.net/musicxml/99.mxl",
-        "https://shapenote.net/musicxml/197d.mxl",
-        "https://shapenote.net/musicxml/229.mxl",
-        "https://shapenote.net/musicxml/528.mxl",
-        "https://shapenote.net/musicxml/CHN-121t.mxl",
-        "https://shapenote.net/musicxml/CHA-172.mxl",
-        "https://shapenote.net/musicxml/309.mxl",
-        "https://shapenote.net/musicxml/C-196d.mxl",
-        "https://shapenote.net/musicxml/SH-254.mxl",
-        "https://shapenote.net/musicxml/CHA-110.mxl"
+def find_corpus_files(patterns):
+    """.mxl/.xml/.musicxml files in the given directories (recursively) or glob patterns, sorted"""
+    import glob
+    
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                found.update(os.path.join(root, name) for name in files
+                             if name.lower().endswith(MUSICXML_EXTENSIONS))
+        else:
+            found.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(found)
+
+def analyze_corpus(patterns, workers=None, use_cache=True, duration_weighted=False):
+    """Analyze a local corpus offline, parsing files in parallel across processes
+    
+    Per-file results are cached by content hash (plus this module's code),
+    so after adding songs to a corpus only the new files are parsed.
+    """
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from analysis_cache import AnalysisCache, file_digest, fingerprint, source_fingerprint
+    
+    start = time.perf_counter()
+    files = find_corpus_files(patterns)
+    cache = AnalysisCache() if use_cache else None
+    code = source_fingerprint(os.path.abspath(__file__))
+    
+    results = {}  # path -> (title, ranges data)
+    keys = {}
+    for path in files:
+        if cache:
+            keys[path] = fingerprint('ranges', file_digest(path), code, duration_weighted)
+            cached = cache.get('ranges', keys[path])
+            if cached is not None:
+                results[path] = cached
+    
+    misses = [path for path in files if path not in results]
+    if misses:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(workers, len(misses))) as pool:
+            results_iter = pool.map(analyze_corpus_file, misses, [duration_weighted] * len(misses), chunksize=4)
+            for path, result in zip(misses, results_iter):
+                results[path] = result
+                if cache and result[0] is not None:
+                    cache.put('ranges', keys[path], result)
+    
+    all_ranges = defaultdict(VoiceRange)
+    song_data = []
+    for path in files:
+        title, ranges_data = results[path]
+        voice_ranges = ranges_from_data(ranges_data)
+        if voice_ranges:
+            add_song(title, voice_ranges, all_ranges, song_data)
+            print(f"✓ Analyzed: {title} ({path})")
+    
+    print(f"\nParsed {len(misses)} of {len(files)} files ({len(files) - len(misses)} cached) "
+          f"in {time.perf_counter() - start:.2f} s")
+    return all_ranges, song_data
+
+def range_table(all_ranges):
+    """SACRED_HARP_RANGES entries from corpus histograms
+    
+    Parts are matched to the table's voices by name ('Treble', 'Alto', ...);
+    returns (table, notes per voice). Raises ValueError if a voice has no notes.
+    """
+    voices = {voice: VoiceRange() for voice in TABLE_VOICES}
+    for name, voice_range in all_ranges.items():
+        voice = re.sub(r'[^a-z]', '', name.lower())
+        if voice in voices:
+            voices[voice].merge(voice_range)
+    
+    missing = [voice for voice, voice_range in voices.items() if not voice_range.count]
+    if missing:
+        raise ValueError(f"No notes for {', '.join(missing)} in the corpus")
+    
+    table = {}
+    for voice, voice_range in voices.items():
+        entry = {'absolute_low': voice_range.min, 'absolute_high': voice_range.max}
+        if voice == 'bass':
+            entry['critical_low'] = BASS_CRITICAL_LOW
+        entry['percentile_10'] = voice_range.percentile(0.1)
+        entry['percentile_90'] = voice_range.percentile(0.9)
+        entry['sweet_spot_low'] = voice_range.percentile(0.25)
+        entry['sweet_spot_high'] = voice_range.percentile(0.75)
+        entry['average'] = round(voice_range.mean())
+        table[voice] = entry
+    return table, {voice: voice_range.count for voice, voice_range in voices.items()}
+
+def range_table_version(path=RANGE_TABLE_FILE):
+    """RANGE_TABLE_VERSION of an existing table file (0 if there is none)"""
+    try:
+        with open(path) as f:
+            match = re.search(r'^RANGE_TABLE_VERSION = (\d+)', f.read(), re.MULTILINE)
+    except OSError:
+        return 0
+    return int(match.group(1)) if match else 0
+
+def write_range_table(table, source, path=RANGE_TABLE_FILE):
+    """Write the analyzer's range table module, bumping its version
+    
+    source describes the corpus (songs, notes, weighting) and is recorded
+    with the table.
+    """
+    version = range_table_version(path) + 1
+    lines = [
+        '"""',
+        'Sacred Harp vocal ranges (MIDI note numbers), loaded by sacred_harp_analyzer.py',
+        'Generated by `analyze_ranges.py --write-table CORPUS`; regenerate it rather',
+        'than editing it by hand.',
+        '',
+        'absolute_low/high are the extremes found in the repertoire, percentile_10/90',
+        'the limits outside which a note is warned about, sweet_spot_low/high the',
+        '25th-75th percentile comfort zone and average the mean pitch. critical_low',
+        '(bass only) is the fixed hard floor: anything at or below it is too low to sing.',
+        '"""',
+        '',
+        f'RANGE_TABLE_VERSION = {version}',
+        '',
+        '# Corpus the table was computed from',
+        'RANGE_TABLE_SOURCE = {',
     ]
+    lines.extend(f'    {key!r}: {value!r},' for key, value in source.items())
+    lines.extend(['}', '', 'SACRED_HARP_RANGES = {'])
+    for voice, entry in table.items():
+        lines.append(f'    {voice!r}: {{')
+        for key, midi in entry.items():
+            lines.append(f'    {f"    {key!r}: {midi},":<30}# {midi_to_note_name(midi)}')
+        lines.append('    },')
+    lines.append('}')
     
-    print("Analyzing Sacred Harp vocal ranges from MusicXML files...")
-    all_ranges, song_data = download_and_analyze_files(urls)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return version
+
+if __name__ == "__main__":
+    # Offline corpus mode when given files:
+    #   python analyze_ranges.py [--workers N] [--no-cache] [--duration-weighted] [--write-table] DIRECTORY|GLOB ...
+    argv = sys.argv[1:]
+    use_cache = '--no-cache' not in argv
+    duration_weighted = '--duration-weighted' in argv
+    write_table = '--write-table' in argv
+    argv = [arg for arg in argv if arg not in ('--no-cache', '--duration-weighted', '--write-table')]
+    workers = None
+    if '--workers' in argv:
+        position = argv.index('--workers')
+        value = argv[position + 1] if position + 1 < len(argv) else ''
+        if not value.isdigit() or int(value) < 1:
+            print("--workers needs a number of worker processes (1 or more)")
+            print("Usage: python analyze_ranges.py [--workers N] [--no-cache] [--duration-weighted] "
+                  "[--write-table] DIRECTORY|GLOB ...")
+            sys.exit(1)
+        workers = int(value)
+        del argv[position:position + 2]
+    
+    if argv:
+        print("Analyzing Sacred Harp vocal ranges from local MusicXML files...")
+        all_ranges, song_data = analyze_corpus(argv, workers, use_cache, duration_weighted)
+    else:
+        # Sacred Harp URLs from user
+        urls = [
+            "https://shapenote.net/musicxml/33b.mxl",
+            "https://shapenote.net/musicxml/45t.mxl", 
+            "https://shapenote.net/musicxml/99.mxl",
+            "https://shapenote.net/musicxml/197d.mxl",
+            "https://shapenote.net/musicxml/229.mxl",
+            "https://shapenote.net/musicxml/528.mxl",
+            "https://shapenote.net/musicxml/CHN-121t.mxl",
+            "https://shapenote.net/musicxml/CHA-172.mxl",
+            "https://shapenote.net/musicxml/309.mxl",
+            "https://shapenote.net/musicxml/C-196d.mxl",
+            "https://shapenote.net/musicxml/SH-254.mxl",
+            "https://shapenote.net/musicxml/CHA-110.mxl"
+        ]
+    
+        print("Analyzing Sacred Harp vocal ranges from MusicXML files...")
+        all_ranges, song_data = download_and_analyze_files(urls, duration_weighted)
     
     # Print individual song analysis
     print("\n" + "="*60)
@@ -162,26 +447,37 @@ if __name__ == "__main__":
     
     # Print overall statistics
     print("\n" + "="*60)
-    print("OVERALL SACRED HARP VOCAL RANGES")
+    print("OVERALL SACRED HARP VOCAL RANGES" + (" (DURATION-WEIGHTED)" if duration_weighted else ""))
     print("="*60)
     
-    for voice, pitches in all_ranges.items():
-        if pitches:
-            min_pitch = min(pitches)
-            max_pitch = max(pitches)
-            avg_pitch = sum(pitches) / len(pitches)
+    for voice, voice_range in all_ranges.items():
+        if voice_range.count:
+            min_pitch = voice_range.min
+            max_pitch = voice_range.max
+            avg_pitch = voice_range.mean()
             
-            print(f"\n{voice.upper()} ({len(pitches)} notes analyzed):")
+            print(f"\n{voice.upper()} ({voice_range.count} notes analyzed):")
             print(f"  Absolute range: {midi_to_note_name(min_pitch)} to {midi_to_note_name(max_pitch)} (MIDI {min_pitch}-{max_pitch})")
             print(f"  Range span: {max_pitch - min_pitch} semitones")
             print(f"  Average pitch: {midi_to_note_name(round(avg_pitch))} (MIDI {avg_pitch:.1f})")
             
-            # Calculate percentiles for comfort zones
-            sorted_pitches = sorted(pitches)
-            p10 = sorted_pitches[int(0.1 * len(sorted_pitches))]
-            p90 = sorted_pitches[int(0.9 * len(sorted_pitches))]
-            p25 = sorted_pitches[int(0.25 * len(sorted_pitches))]
-            p75 = sorted_pitches[int(0.75 * len(sorted_pitches))]
+            # Percentiles for comfort zones
+            p10 = voice_range.percentile(0.1)
+            p90 = voice_range.percentile(0.9)
+            p25 = voice_range.percentile(0.25)
+            p75 = voice_range.percentile(0.75)
             
             print(f"  10th-90th percentile: {midi_to_note_name(p10)} to {midi_to_note_name(p90)} (MIDI {p10}-{p90})")
-            print(f"  25th-75th percentile: {midi_to_note_name(p25)} to {midi_to_note_name(p75)} (MIDI {p25}-{p75})")
\ No newline at end of file
+            print(f"  25th-75th percentile: {midi_to_note_name(p25)} to {midi_to_note_name(p75)} (MIDI {p25}-{p75})")
+    
+    if write_table:
+        try:
+            table, notes = range_table(all_ranges)
+        except ValueError as e:
+            print(f"\nError: {e}; {RANGE_TABLE_FILE} not written")
+            sys.exit(1)
+        source = {'corpus': ' '.join(argv) or 'shapenote.net',
+                  'songs': len(song_data), 'notes': sum(notes.values()),
+                  'weighting': 'duration' if duration_weighted else 'notes'}
+        version = write_range_table(table, source)
+        print(f"\nWrote range table version {version} to {RANGE_TABLE_FILE}")
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Parallel batch analysis of a compositions tree
+Finds every MIDI file (with its matching .ly) under a directory, analyzes them
+on a pool of warm worker processes and writes one aggregated report with
+per-song timings. A song that fails is reported separately without stopping
+the batch.
+
+With --fail-on=SEVERITY the batch is a gate: each song stops at its first
+diagnostic at least that severe, and the first song (in order) that fails
+cancels the songs not yet started.
+
+Usage: python batch_analysis.py DIRECTORY [report.log] [--workers N] [--fail-on=SEVERITY]
+                                 [--fatigue-windows=LIST] [--fatigue-weighted]
+"""
+
+import os
+import re
+import sys
+import time
+
+from diagnostics import SEVERITIES
+
+TIMESTAMP_PREFIX = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}: ', re.MULTILINE)
+
+
+def find_songs(directory):
+    """(midi file, matching .ly file or None) for every MIDI file under directory"""
+    songs = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            stem, extension = os.path.splitext(name)
+            if extension.lower() not in ('.midi', '.mid'):
+                continue
+            lilypond_file = os.path.join(root, stem + '.ly')
+            songs.append((os.path.join(root, name),
+                          lilypond_file if os.path.exists(lilypond_file) else None))
+    return songs
+
+
+def warm_worker():
+    """Pool initializer: import the analyzer and its heavy dependencies once per worker"""
+    import numpy  # noqa: F401
+    import fatigue  # noqa: F401
+    import midi_reader  # noqa: F401
+    import sacred_harp_analyzer  # noqa: F401
+
+
+def analyze_song(midi_file, lilypond_file=None, use_music21=False, use_cache=True, fail_on=None,
+                 fatigue_windows=None, fatigue_duration_weighted=False):
+    """Analyze one song in a worker; returns a picklable result dict
+
+    With fail_on, the analysis stops at the first diagnostic at least that
+    severe, which fails the song.
+    """
+    import tempfile
+    from sacred_harp_analyzer import SacredHarpAnalyzer
+
+    result = {'midi_file': midi_file, 'lilypond_file': lilypond_file, 'ok': False, 'log': '', 'error': None}
+    start = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, 'harmony.log')
+        try:
+            analyzer = SacredHarpAnalyzer(midi_file, log_file, lilypond_file, use_music21, use_cache,
+                                          fatigue_windows=fatigue_windows,
+                                          fatigue_duration_weighted=fatigue_duration_weighted)
+            if fail_on:
+                found = analyzer.first_diagnostic(fail_on)
+                result['ok'] = found is None and analyzer.run_succeeded
+                if found is not None:
+                    result['error'] = f"{found.severity.upper()}: {found.message.splitlines()[0]}"
+            else:
+                result['ok'] = analyzer.run_analysis()
+            if not result['ok'] and not result['error']:
+                result['error'] = 'Analysis failed'
+        except Exception as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+
+        if os.path.exists(log_file):
+            with open(log_file) as f:
+                result['log'] = TIMESTAMP_PREFIX.sub('', f.read())
+
+    # Use the analyzer's own error line as the failure reason when there is one
+    if not result['ok'] and result['error'] == 'Analysis failed':
+        errors = [line for line in result['log'].splitlines() if line.startswith('ERROR:')]
+        if errors:
+            result['error'] = errors[-1][len('ERROR: '):]
+
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(directory, report_file='batch-report.log', workers=None, use_music21=False, use_cache=True,
+              fail_on=None, fatigue_windows=None, fatigue_duration_weighted=False):
+    """Analyze every song under directory in parallel and write the aggregated report
+
+    Returns the list of result dicts (in song order). With fail_on (see
+    analyze_song), songs after the first failure are cancelled if they have
+    not started, and left out of the results.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    songs = find_songs(directory)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+
+    results = []
+    if songs:
+        # Analysis code lives next to this file; workers import it by module name
+        analysis_dir = os.path.dirname(os.path.abspath(__file__))
+        if analysis_dir not in sys.path:
+            sys.path.insert(0, analysis_dir)
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(songs)), initializer=warm_worker) as pool:
+            futures = [pool.submit(analyze_song, midi_file, lilypond_file, use_music21, use_cache, fail_on,
+                                   fatigue_windows, fatigue_duration_weighted)
+                       for midi_file, lilypond_file in songs]
+            for (midi_file, lilypond_file), future in zip(songs, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:  # Worker crashed (e.g. killed); keep going
+                    results.append({'midi_file': midi_file, 'lilypond_file': lilypond_file, 'ok': False,
+                                    'log': '', 'error': f"{type(e).__name__}: {e}", 'seconds': 0.0})
+                if fail_on and not results[-1]['ok']:
+                    for pending in futures:
+                        pending.cancel()
+                    break
+
+    write_report(report_file, directory, results, workers, time.perf_counter() - start,
+                 len(songs) - len(results))
+    return results
+
+
+def write_report(report_file, directory, results, workers, elapsed, skipped=0):
+    """Write one report: analyzed songs with timings first, then failures"""
+    analyzed = [result for result in results if result['ok']]
+    failed = [result for result in results if not result['ok']]
+
+    with open(report_file, 'w') as f:
+        f.write(f"=== SACRED HARP BATCH ANALYSIS: {directory} ===\n")
+        f.write(f"{len(results) + skipped} songs, {workers} workers\n\n")
+
+        for result in analyzed:
+            f.write(f"--- {result['midi_file']} ({result['seconds']:.2f} s) ---\n")
+            f.write(result['log'])
+            f.write("\n")
+
+        if failed:
+            f.write("=== FAILURES ===\n")
+            for result in failed:
+                f.write(f"--- {result['midi_file']} ({result['seconds']:.2f} s): {result['error']} ---\n")
+                f.write(result['log'])
+                f.write("\n")
+
+        skipped_text = f", {skipped} skipped" if skipped else ""
+        f.write(f"=== SUMMARY: {len(analyzed)} analyzed, {len(failed)} failed{skipped_text} in {elapsed:.2f} s ===\n")
+
+
+def main(argv=None):
+    argv = list(sys.argv if argv is None else argv)
+    use_music21 = '--music21' in argv
+    use_cache = '--no-cache' not in argv
+    fatigue_duration_weighted = '--fatigue-weighted' in argv
+    fail_on_args = [arg for arg in argv if arg.startswith('--fail-on=')]
+    fail_on = fail_on_args[-1].partition('=')[2] if fail_on_args else None
+    window_args = [arg for arg in argv if arg.startswith('--fatigue-windows=')]
+    argv = [arg for arg in argv if arg not in ('--music21', '--no-cache', '--fatigue-weighted')
+            and arg not in fail_on_args + window_args]
+
+    if fail_on is not None and fail_on not in SEVERITIES[:-1]:
+        print(f"--fail-on must be one of {', '.join(SEVERITIES[:-1])}")
+        sys.exit(1)
+
+    fatigue_windows = None
+    if window_args:
+        from fatigue import parse_windows
+        try:
+            fatigue_windows = parse_windows(window_args[-1].partition('=')[2])
+        except ValueError as e:
+            print(f"--fatigue-windows: {e}")
+            sys.exit(1)
+
+    usage = ("Usage: python batch_analysis.py [--music21] [--no-cache] [--workers N] [--fail-on=SEVERITY] "
+             "[--fatigue-windows=LIST] [--fatigue-weighted] DIRECTORY [report.log]")
+
+    workers = None
+    if '--workers' in argv:
+        position = argv.index('--workers')
+        value = argv[position + 1] if position + 1 < len(argv) else ''
+        if not value.isdigit() or int(value) < 1:
+            print("--workers needs a number of worker processes (1 or more)")
+            print(usage)
+            sys.exit(1)
+        workers = int(value)
+        del argv[position:position + 2]
+
+    if len(argv) < 2 or argv[1] in ('--help', '-h'):
+        print(usage)
+        sys.exit(0 if len(argv) > 1 else 1)
+
+    directory = argv[1]
+    report_file = argv[2] if len(argv) > 2 else 'batch-report.log'
+
+    song_count = len(find_songs(directory))
+    results = run_batch(directory, report_file, workers, use_music21, use_cache, fail_on,
+                        fatigue_windows, fatigue_duration_weighted)
+    failed = [result for result in results if not result['ok']]
+    skipped = max(song_count - len(results), 0)
+    skipped_text = f", {skipped} skipped" if skipped else ""
+    print(f"Analyzed {len(results) - len(failed)} of {song_count} songs, {len(failed)} failed{skipped_text}. "
+          f"Report written to {report_file}.")
+    if skipped:
+        print(f"Stopped at the first song failing --fail-on={fail_on}.")
+    for result in failed:
+        print(f"FAILED: {result['midi_file']}: {result['error']}")
+
+    # Non-zero exit lets CI gate on broken songs
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Analyzer benchmark suite
+Runs the full analysis pipeline (uncached) on every MIDI/.ly pair under
+compositions/ and on synthetic four-voice scores made by tiling a real song
+to 10x, 100x and 1000x its length, and times each stage separately with the
+analyzer's built-in profiler (see profiling.py). Results are saved as a JSON
+baseline; `compare` flags stages that got slower.
+
+Usage: python benchmark.py run [--output FILE] [--repeat N] [--scales 10,100,1000]
+                               [--template song.midi] [DIRECTORY]
+       python benchmark.py compare BASELINE CURRENT [--threshold 0.25] [--min-delta-ms 1]
+"""
+
+import json
+import os
+import platform
+import statistics
+import struct
+import sys
+import tempfile
+from datetime import datetime
+
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPOSITIONS_DIR = os.path.join(ANALYSIS_DIR, '..', 'compositions')
+
+BENCHMARK_VERSION = 1
+DEFAULT_SCALES = (10, 100, 1000)
+
+def time_analysis(midi_file, lilypond_file=None):
+    """Stage timings in seconds (see profiling.Profiler.finish_run) for one uncached analysis run"""
+    from profiling import Profiler
+    from sacred_harp_analyzer import SacredHarpAnalyzer
+
+    profiler = Profiler(stream=None)
+    with tempfile.TemporaryDirectory() as tmp:
+        analyzer = SacredHarpAnalyzer(midi_file, os.path.join(tmp, 'harmony.log'), lilypond_file,
+                                      use_cache=False, profiler=profiler)
+        if not analyzer.run_analysis():
+            raise RuntimeError(f"Analysis of {midi_file} failed")
+    return analyzer.last_profile['seconds']
+
+
+def benchmark_score(midi_file, lilypond_file=None, repeat=3):
+    """Median stage timings over `repeat` runs"""
+    runs = [time_analysis(midi_file, lilypond_file) for _ in range(repeat)]
+    return {stage: statistics.median(run[stage] for run in runs) for stage in runs[0]}
+
+
+def variable_length(value):
+    """MIDI variable-length quantity"""
+    data = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        data.insert(0, 0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(data)
+
+
+def track_chunk(events):
+    """MTrk chunk from (tick, event bytes) pairs, sorted by tick (stable)"""
+    body = bytearray()
+    tick = 0
+    for event_tick, event in sorted(events, key=lambda item: item[0]):
+        body += variable_length(event_tick - tick) + event
+        tick = event_tick
+    body += variable_length(0) + b'\xff\x2f\x00'
+    return b'MTrk' + struct.pack('>I', len(body)) + bytes(body)
+
+
+def write_tiled_midi(template_file, path, scale):
+    """Write `template_file` repeated `scale` times end to end (whole measures) as a new MIDI file
+
+    Returns the number of notes written.
+    """
+    from midi_reader import read_midi
+
+    midi = read_midi(template_file)
+    time_signatures = midi.meta_events('time_signature')
+    numerator, denominator = time_signatures[0].value if time_signatures else (4, 4)
+    measure_ticks = midi.ticks_per_quarter * 4 * numerator // denominator
+    period = -(-midi.total_ticks() // measure_ticks) * measure_ticks
+
+    conductor = []
+    for event in midi.meta:
+        if event.kind == 'time_signature':
+            conductor.append((0, bytes([0xFF, 0x58, 4, event.value.numerator,
+                                        event.value.denominator.bit_length() - 1, 24, 8])))
+        elif event.kind == 'key_signature':
+            conductor.append((0, bytes([0xFF, 0x59, 2, event.value.sharps & 0xFF,
+                                        1 if event.value.mode == 'minor' else 0])))
+        elif event.kind == 'tempo':
+            conductor.append((0, b'\xff\x51\x03' + event.value.to_bytes(3, 'big')))
+    # One of each kind, at the start
+    conductor = list({event[:2]: (tick, event) for tick, event in conductor}.values())
+
+    chunks = [track_chunk(conductor)]
+    for track in midi.note_tracks():
+        events = []
+        for row in midi.track_notes(track):
+            onset, duration, pitch = int(row['onset']), int(row['duration']), int(row['pitch'])
+            for copy in range(scale):
+                shift = copy * period
+                events.append((shift + onset + duration, bytes([0x80, pitch, 0])))
+                events.append((shift + onset, bytes([0x90, pitch, 80])))
+        # Note-offs before note-ons at the same tick, so repeated pitches pair up in order
+        events.sort(key=lambda item: (item[0], item[1][0] == 0x90))
+        chunks.append(track_chunk(events))
+
+    with open(path, 'wb') as f:
+        f.write(b'MThd' + struct.pack('>IHHH', 6, 1, len(chunks), midi.ticks_per_quarter))
+        f.write(b''.join(chunks))
+    return len(midi.notes) * scale
+
+
+def run_benchmarks(directory=COMPOSITIONS_DIR, scales=DEFAULT_SCALES, template=None, repeat=3):
+    """Benchmark every song under directory and the synthetic scores; returns the results dict"""
+    from batch_analysis import find_songs
+
+    songs = find_songs(directory)
+    scores = {}
+
+    for midi_file, lilypond_file in songs:
+        name = os.path.splitext(os.path.basename(midi_file))[0]
+        print(f"Benchmarking {name}...", flush=True)
+        scores[name] = {'midi_file': os.path.relpath(midi_file, directory),
+                        'stages': benchmark_score(midi_file, lilypond_file, repeat)}
+
+    if scales and (template or songs):
+        template = template or songs[0][0]
+        stem = os.path.splitext(os.path.basename(template))[0]
+        with tempfile.TemporaryDirectory() as tmp:
+            for scale in scales:
+                name = f"synthetic-{stem}-x{scale}"
+                midi_file = os.path.join(tmp, f"{name}.midi")
+                notes = write_tiled_midi(template, midi_file, scale)
+                print(f"Benchmarking {name} ({notes} notes)...", flush=True)
+                # Long scores are timed once; their run-to-run noise is small anyway
+                scores[name] = {'template': os.path.basename(template), 'scale': scale, 'notes': notes,
+                                'stages': benchmark_score(midi_file, None, repeat if scale < 100 else 1)}
+
+    return {
+        'version': BENCHMARK_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'scores': scores
+    }
+
+
+def compare_results(baseline, current, threshold=0.25, min_delta=0.001):
+    """(score, stage, baseline seconds, current seconds, slower?) for stages in both results
+
+    A stage is slower when it takes more than (1 + threshold) times as long as
+    in the baseline and at least min_delta seconds longer (to ignore noise in
+    stages that take almost no time).
+    """
+    rows = []
+    for score, result in current['scores'].items():
+        if score not in baseline['scores']:
+            continue
+        baseline_stages = baseline['scores'][score]['stages']
+        for stage, seconds in result['stages'].items():
+            if stage not in baseline_stages:
+                continue
+            before = baseline_stages[stage]
+            slower = seconds > before * (1 + threshold) and seconds - before >= min_delta
+            rows.append((score, stage, before, seconds, slower))
+    return rows
+
+
+def print_results(results):
+    """Per-score table of stage timings"""
+    for score, result in results['scores'].items():
+        print(f"\n{score}")
+        for stage, seconds in result['stages'].items():
+            print(f"  {stage:<26} {seconds * 1000:10.2f} ms")
+
+
+def pop_option(argv, name, default=None):
+    """Remove `name VALUE` from argv and return VALUE (or default)"""
+    if name not in argv:
+        return default
+    position = argv.index(name)
+    value = argv[position + 1]
+    del argv[position:position + 2]
+    return value
+
+
+def main(argv=None):
+    argv = list(sys.argv if argv is None else argv)
+    command = argv[1] if len(argv) > 1 else None
+
+    if command == 'run':
+        output = pop_option(argv, '--output', 'benchmark.json')
+        repeat = int(pop_option(argv, '--repeat', 3))
+        scales = pop_option(argv, '--scales')
+        scales = DEFAULT_SCALES if scales is None else [int(scale) for scale in scales.split(',') if scale]
+        template = pop_option(argv, '--template')
+        directory = argv[2] if len(argv) > 2 else COMPOSITIONS_DIR
+
+        results = run_benchmarks(directory, scales, template, repeat)
+        print_results(results)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {output}")
+
+    elif command == 'compare' and len(argv) >= 4:
+        threshold = float(pop_option(argv, '--threshold', 0.25))
+        min_delta = float(pop_option(argv, '--min-delta-ms', 1)) / 1000
+        with open(argv[2], encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(argv[3], encoding='utf-8') as f:
+            current = json.load(f)
+
+        rows = compare_results(baseline, current, threshold, min_delta)
+        for score, stage, before, seconds, slower in rows:
+            change = (seconds / before - 1) * 100 if before else float('inf')
+            flag = '  SLOWER' if slower else ''
+            print(f"{score:<28} {stage:<26} {before * 1000:10.2f} -> {seconds * 1000:10.2f} ms "
+                  f"({change:+.0f}%){flag}")
+
+        slower = [row for row in rows if row[4]]
+        print(f"\n{len(slower)} of {len(rows)} stages slower than {threshold:.0%} over the baseline")
+        sys.exit(1 if slower else 0)
+
+    else:
+        print(__doc__.strip().split('\n\n')[-1])
+        sys.exit(0 if command in ('--help', '-h') else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Pitch-class set lookup tables for chord labeling
+A beat's pitches are reduced to a 12-bit mask relative to the tonic (bit i
+set when the pitch class i semitones above the tonic sounds). A ChordTable
+labels all 4096 masks once, so labeling a beat is a list index, and a whole
+array of beats is one numpy take. The labeling rules themselves live in
+sacred_harp_analyzer.py, which builds one table per mode on first use.
+"""
+
+from collections import namedtuple
+
+MASK_COUNT = 1 << 12
+
+# scale_degrees is None when no sounding pitch is in the scale ("Unknown");
+# the analyzer then reports the absolute pitch classes instead
+ChordEntry = namedtuple('ChordEntry', ['root', 'roman', 'scale_degrees', 'assessment'])
+
+
+def pitch_class_mask(pitches, tonic_pitch_class):
+    """12-bit mask of the pitch classes in pitches, relative to the tonic"""
+    mask = 0
+    for pitch in pitches:
+        mask |= 1 << ((pitch - tonic_pitch_class) % 12)
+    return mask
+
+
+def mask_pitch_classes(mask, tonic_pitch_class):
+    """Sorted absolute pitch classes of a tonic-relative mask"""
+    return sorted((tonic_pitch_class + interval) % 12 for interval in range(12) if mask >> interval & 1)
+
+
+class ChordTable:
+    """Labels for every pitch-class set of one mode, computed once"""
+
+    def __init__(self, label):
+        """label(mask) -> ChordEntry (or None for the empty mask), called once per mask"""
+        self.entries = [label(mask) for mask in range(MASK_COUNT)]
+        self.entry_array = None
+
+    def __getitem__(self, mask):
+        return self.entries[mask]
+
+    def lookup_many(self, masks):
+        """Entries for a whole sequence of masks in one vectorized call"""
+        import numpy as np
+
+        if self.entry_array is None:
+            self.entry_array = np.empty(MASK_COUNT, dtype=object)
+            self.entry_array[:] = self.entries
+        return self.entry_array[np.asarray(masks, dtype=np.intp)].tolist()
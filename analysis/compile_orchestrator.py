@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+LilyPond compile orchestrator
+Replaces the `watch-lilypond.sh --all` loop on Linux: watches every .ly file
+under a directory (or a single file), coalesces bursts of saves into one
+pending compile per file, runs lilypond on a bounded pool of workers (one per
+core by default) and analyzes each song as soon as its MIDI file is written.
+Compile and analysis times are reported per file; each song's analysis goes to
+harmony.log next to its .ly file.
+
+Builds are cached by content (the .ly, its resolved \\includes and the lilypond
+version), so a save that changes nothing, or a branch switch back to a song
+version built before, restores the PDF and MIDI instead of running lilypond.
+
+Usage: python compile_orchestrator.py [--workers N] [--once] [--no-analysis] [--no-cache] (--all [DIRECTORY] | song.ly)
+"""
+
+import functools
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from analysis_cache import AnalysisCache, file_digest, fingerprint
+
+# One compile (and analysis) of a .ly file; times in seconds, analysis_seconds None if not analyzed.
+# cached is True when the outputs were restored from the build cache.
+CompileResult = namedtuple('CompileResult', ['lilypond_file', 'ok', 'compile_seconds', 'midi_file',
+                                             'analysis_seconds', 'log_file', 'error', 'cached'],
+                           defaults=(False,))
+
+MIDI_EXTENSIONS = ('.midi', '.mid')
+
+# Files a compile produces next to the .ly, stored per build in the cache
+OUTPUT_EXTENSIONS = ('.pdf',) + MIDI_EXTENSIONS
+
+# Lines of LilyPond output shown when a compile fails
+ERROR_CONTEXT_LINES = 5
+
+
+def find_lilypond_files(directory):
+    """Every .ly file under directory (skipping hidden directories), sorted"""
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+        found.extend(os.path.join(root, name) for name in sorted(files)
+                     if name.endswith('.ly') and not name.startswith('.'))
+    return found
+
+
+def needs_compile(lilypond_file):
+    """True if the .ly file has no PDF yet, or has changed since it was compiled"""
+    pdf_file = os.path.splitext(lilypond_file)[0] + '.pdf'
+    try:
+        return os.path.getmtime(pdf_file) < os.path.getmtime(lilypond_file)
+    except OSError:
+        return True
+
+
+@functools.lru_cache(maxsize=None)
+def lilypond_version(lilypond):
+    """First line of `lilypond --version`, part of every build cache key"""
+    completed = subprocess.run([lilypond, '--version'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               text=True, errors='replace')
+    lines = completed.stdout.strip().splitlines()
+    return lines[0] if lines else ''
+
+
+def included_files(lilypond_file):
+    """Files pulled in by \\include (recursively), breadth-first
+
+    An include is looked up next to the file that includes it, then next to
+    lilypond_file. One found in neither place (LilyPond's own, such as
+    articulate.ly) is returned as its bare name: the lilypond version
+    already covers it.
+    """
+    from lilypond_source import tokenize
+
+    main_directory = os.path.dirname(os.path.abspath(lilypond_file))
+    found = []
+    pending = [os.path.abspath(lilypond_file)]
+    while pending:
+        path = pending.pop(0)
+        try:
+            with open(path, encoding='utf-8', errors='replace') as f:
+                tokens = tokenize(f.read())
+        except OSError:
+            continue
+        for token, argument in zip(tokens, tokens[1:]):
+            if token.text != '\\include' or argument.kind != 'string':
+                continue
+            name = argument.text[1:-1]
+            candidates = [os.path.join(os.path.dirname(path), name), os.path.join(main_directory, name)]
+            resolved = next((os.path.abspath(candidate) for candidate in candidates
+                             if os.path.isfile(candidate)), name)
+            if resolved not in found:
+                found.append(resolved)
+                if os.path.isfile(resolved):
+                    pending.append(resolved)
+    return found
+
+
+def build_key(lilypond_file, version):
+    """Build cache key: .ly path and content, included files' content, lilypond version
+
+    The path is part of the key because the PDF's point-and-click links
+    embed it.
+    """
+    lilypond_file = os.path.abspath(lilypond_file)
+    includes = [(path, file_digest(path)) for path in included_files(lilypond_file)]
+    return fingerprint('build', version, lilypond_file, file_digest(lilypond_file), includes)
+
+
+def written_outputs(lilypond_file, since):
+    """{extension: contents} of the output files LilyPond wrote at or after time since"""
+    stem = os.path.splitext(lilypond_file)[0]
+    outputs = {}
+    for extension in OUTPUT_EXTENSIONS:
+        try:
+            if os.path.getmtime(stem + extension) >= since:
+                with open(stem + extension, 'rb') as f:
+                    outputs[extension] = f.read()
+        except OSError:
+            continue
+    return outputs
+
+
+def restore_outputs(lilypond_file, outputs):
+    """Write cached outputs next to lilypond_file, leaving identical files untouched"""
+    import tempfile
+
+    stem = os.path.splitext(lilypond_file)[0]
+    for extension, data in outputs.items():
+        path = stem + extension
+        try:
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    continue
+        except OSError:
+            pass
+        # Write and rename so a PDF viewer never sees a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+def output_midi_file(lilypond_file, outputs):
+    """Path of the MIDI file among a build's outputs, or None"""
+    stem = os.path.splitext(lilypond_file)[0]
+    return next((stem + extension for extension in MIDI_EXTENSIONS if extension in outputs), None)
+
+
+class CompileOrchestrator:
+    """Compile .ly files on a bounded thread pool, then analyze their MIDI
+
+    Each file is compiled by at most one worker at a time. A file that
+    changes while it is queued is not queued again; one that changes while
+    compiling is compiled once more when the current run finishes.
+    """
+
+    def __init__(self, lilypond='lilypond', workers=None, analyze=True, use_cache=True, root=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.lilypond = lilypond
+        self.root = root or os.getcwd()  # Reported paths are relative to this
+        self.workers = workers or os.cpu_count() or 1
+        self.analyze = analyze
+        self.use_cache = use_cache
+        self.cache = AnalysisCache() if use_cache else None
+        # lilypond runs as a subprocess, so threads are enough to keep every core busy
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        self.lock = threading.Lock()
+        self.queued = set()
+        self.compiling = set()
+        self.dirty = set()
+        self.idle = threading.Condition(self.lock)
+        self.analyzers = {}  # .ly file -> analyzer, kept for incremental re-analysis
+        self.results = []
+
+    def submit(self, lilypond_file):
+        """Schedule a compile, coalescing it with one already pending for the file"""
+        lilypond_file = os.path.abspath(lilypond_file)
+        with self.lock:
+            if lilypond_file in self.queued:
+                return
+            if lilypond_file in self.compiling:
+                self.dirty.add(lilypond_file)
+                return
+            self.queued.add(lilypond_file)
+        self.pool.submit(self.process, lilypond_file)
+
+    def process(self, lilypond_file):
+        """Worker: compile, analyze, report, and go again if the file changed meanwhile"""
+        with self.lock:
+            self.queued.discard(lilypond_file)
+            self.compiling.add(lilypond_file)
+
+        try:
+            result = self.compile_and_analyze(lilypond_file)
+        except Exception as e:  # Keep the worker alive for the next save
+            result = CompileResult(lilypond_file, False, 0.0, None, None, None, f"{type(e).__name__}: {e}")
+        self.report(result)
+
+        with self.lock:
+            self.compiling.discard(lilypond_file)
+            again = lilypond_file in self.dirty
+            self.dirty.discard(lilypond_file)
+            self.results.append(result)
+            self.idle.notify_all()
+        if again:
+            self.submit(lilypond_file)
+
+    def compile_and_analyze(self, lilypond_file):
+        directory, name = os.path.split(lilypond_file)
+        start = time.time()
+
+        key = outputs = None
+        if self.cache:
+            key = build_key(lilypond_file, lilypond_version(self.lilypond))
+            outputs = self.cache.get('builds', key)
+        cached = outputs is not None
+
+        if cached:
+            restore_outputs(lilypond_file, outputs)
+        else:
+            # LilyPond writes its output next to the source when run from its directory
+            completed = subprocess.run([self.lilypond, name], cwd=directory, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, text=True, errors='replace')
+            if completed.returncode != 0:
+                output = completed.stdout.strip().splitlines()[-ERROR_CONTEXT_LINES:]
+                return CompileResult(lilypond_file, False, time.time() - start, None, None, None,
+                                     f"lilypond exited with status {completed.returncode}"
+                                     + ''.join(f"\n    {line}" for line in output))
+
+            outputs = written_outputs(lilypond_file, start)
+            # Skip caching if the source changed mid-compile (the outputs may not match key)
+            if key and outputs and key == build_key(lilypond_file, lilypond_version(self.lilypond)):
+                self.cache.put('builds', key, outputs)
+        compile_seconds = time.time() - start
+
+        midi_file = output_midi_file(lilypond_file, outputs)
+        if not self.analyze or midi_file is None:
+            return CompileResult(lilypond_file, True, compile_seconds, midi_file, None, None, None, cached)
+
+        log_file = os.path.join(directory, 'harmony.log')
+        start = time.perf_counter()
+        analyzer = self.analyzers.get(lilypond_file)
+        if analyzer is None or analyzer.midi_file != midi_file:
+            from sacred_harp_analyzer import SacredHarpAnalyzer
+
+            analyzer = SacredHarpAnalyzer(midi_file, log_file, lilypond_file, use_cache=self.use_cache)
+            self.analyzers[lilypond_file] = analyzer
+        else:
+            analyzer.reload_lilypond_source()
+        ok = analyzer.run_analysis()
+        return CompileResult(lilypond_file, ok, compile_seconds, midi_file, time.perf_counter() - start,
+                             log_file, None if ok else "Analysis failed", cached)
+
+    def report(self, result):
+        name = os.path.relpath(result.lilypond_file, self.root)
+        compiled = 'restored from cache' if result.cached else 'compiled'
+        if result.analysis_seconds is not None:
+            line = (f"{name}: {compiled} in {result.compile_seconds:.2f} s, "
+                    f"analyzed in {result.analysis_seconds:.2f} s -> {os.path.relpath(result.log_file, self.root)}")
+        elif result.compile_seconds:
+            line = f"{name}: {compiled} in {result.compile_seconds:.2f} s"
+            if result.ok and self.analyze:
+                line += " (no MIDI written, not analyzed)"
+        else:
+            line = name
+        if result.error:
+            line += f" FAILED: {result.error}"
+        with self.lock:
+            print(line, flush=True)
+
+    def wait(self):
+        """Block until nothing is queued or compiling"""
+        with self.lock:
+            while self.queued or self.compiling:
+                self.idle.wait()
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def watch(orchestrator, lilypond_files, directory=None):
+    """Compile stale files, then recompile each file as it is saved"""
+    from file_watcher import make_watcher
+
+    for lilypond_file in lilypond_files:
+        if needs_compile(lilypond_file):
+            orchestrator.submit(lilypond_file)
+
+    # Watching the whole tree also picks up .ly files created later, in new song folders too
+    directories = (directory,) if directory else ()
+    with make_watcher(lilypond_files, directories, '.ly', recursive=True) as watcher:
+        print(f"Watching {directory or lilypond_files[0]} for .ly changes ({watcher.kind}, "
+              f"{orchestrator.workers} workers)...", flush=True)
+        while True:
+            for path in sorted(watcher.wait_for_changes()):
+                if os.path.isfile(path) and not os.path.basename(path).startswith('.'):
+                    orchestrator.submit(path)
+
+
+def main(argv=None):
+    argv = list(sys.argv if argv is None else argv)
+    once = '--once' in argv
+    analyze = '--no-analysis' not in argv
+    use_cache = '--no-cache' not in argv
+    argv = [arg for arg in argv if arg not in ('--once', '--no-analysis', '--no-cache')]
+
+    usage = ("Usage: python compile_orchestrator.py [--workers N] [--once] [--no-analysis] [--no-cache] "
+             "(--all [DIRECTORY] | song.ly)")
+
+    workers = None
+    if '--workers' in argv:
+        position = argv.index('--workers')
+        value = argv[position + 1] if position + 1 < len(argv) else ''
+        if not value.isdigit() or int(value) < 1:
+            print("--workers needs a number of parallel compiles (1 or more)")
+            print(usage)
+            sys.exit(1)
+        workers = int(value)
+        del argv[position:position + 2]
+
+    if len(argv) < 2 or argv[1] in ('--help', '-h'):
+        print(usage)
+        print("\nCompiles .ly files with lilypond as they change and analyzes each new MIDI file.")
+        print("--once compiles every file once and exits; otherwise stale files (no PDF, or older")
+        print("than the .ly) are compiled on startup and the rest as they are saved.")
+        print("--no-cache always runs lilypond (and re-analyzes) instead of using cached builds.")
+        sys.exit(0 if len(argv) > 1 else 1)
+
+    directory = None
+    if argv[1] in ('--all', '-a'):
+        directory = os.path.abspath(argv[2] if len(argv) > 2 else '.')
+        lilypond_files = find_lilypond_files(directory)
+    elif argv[1].endswith('.ly') and os.path.isfile(argv[1]):
+        lilypond_files = [os.path.abspath(argv[1])]
+    else:
+        print("Error: Please specify an existing .ly file or use --all/-a")
+        sys.exit(1)
+
+    lilypond = os.environ.get('LILYPOND', 'lilypond')
+    if not shutil.which(lilypond):
+        print(f"Error: {lilypond} is not installed")
+        print("Install with: sudo apt install lilypond (or set LILYPOND to its path)")
+        sys.exit(1)
+
+    orchestrator = CompileOrchestrator(lilypond, workers, analyze, use_cache, directory)
+    try:
+        if once:
+            for lilypond_file in lilypond_files:
+                orchestrator.submit(lilypond_file)
+            orchestrator.wait()
+        else:
+            watch(orchestrator, lilypond_files, directory)
+    except KeyboardInterrupt:
+        print("Stopping watcher...")
+    finally:
+        orchestrator.close()
+
+    failed = [result for result in orchestrator.results if not result.ok]
+    if once:
+        restored = sum(1 for result in orchestrator.results if result.cached)
+        print(f"Compiled {len(orchestrator.results)} files ({restored} from cache), {len(failed)} failed.")
+        sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
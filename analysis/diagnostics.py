@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Structured diagnostics and log sinks
+Analyzer output is collected as Diagnostic records and written once per run
+to a sink chosen by the log file's extension:
+  .jsonl                  JSON Lines, one object per diagnostic
+  .db / .sqlite / .sqlite3  SQLite run database (runs + diagnostics tables)
+  anything else           the classic "timestamp: message" text log
+
+File sinks rotate by size and keep a per-run index (<log>.index, JSON Lines of
+file/offset/length per run) so the latest run can be read without scanning
+the whole history. json/sqlite3 are imported on first write to keep startup fast.
+
+Usage: python diagnostics.py latest harmony.log
+"""
+
+import os
+import sys
+from collections import Counter, namedtuple
+
+# Most to least severe
+SEVERITIES = ('critical', 'error', 'forbidden', 'warning', 'info')
+
+# message is the exact text-log line; the other fields are for tools
+Diagnostic = namedtuple('Diagnostic', ['severity', 'rule', 'message', 'measure', 'beat',
+                                       'voice', 'midi_pitch', 'source_line'],
+                        defaults=(None, None, None, None, None))
+
+# Text/JSONL logs rotate past this size, keeping this many old files
+DEFAULT_MAX_BYTES = 1024 * 1024
+DEFAULT_BACKUPS = 3
+
+# SQLite databases keep this many most recent runs
+DEFAULT_MAX_RUNS = 500
+
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+# Column types of the Diagnostic fields; beat is fractional off the beat (e.g. 3.5)
+SQLITE_COLUMN_TYPES = {'severity': 'TEXT', 'rule': 'TEXT', 'message': 'TEXT', 'measure': 'INTEGER',
+                       'beat': 'REAL', 'voice': 'TEXT', 'midi_pitch': 'INTEGER', 'source_line': 'INTEGER'}
+
+
+def info(message):
+    """Informational diagnostic (run headers, progression summary, ...)"""
+    return Diagnostic('info', 'run', message)
+
+
+def at_least(diagnostic, severity):
+    """True if diagnostic is as severe as `severity` or more (see SEVERITIES)"""
+    return SEVERITIES.index(diagnostic.severity) <= SEVERITIES.index(severity)
+
+
+class RotatingFileSink:
+    """Append-only log file with size-based rotation and a per-run index"""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        self.path = path
+        self.index_path = path + '.index'
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def format_entries(self, run_id, entries):
+        """Text for a run's (timestamp, Diagnostic) entries"""
+        return ''.join(f"{timestamp}: {diagnostic.message}\n" for timestamp, diagnostic in entries)
+
+    def write_run(self, run_id, entries, run_info=None):
+        """Append a run in a single write and add its index entry"""
+        import json
+
+        if not entries:
+            return
+        data = self.format_entries(run_id, entries).encode('utf-8')
+
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size and size + len(data) > self.max_bytes:
+            self.rotate()
+            size = 0
+
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+        counts = Counter(diagnostic.severity for _, diagnostic in entries)
+        index_entry = {
+            'run_id': run_id,
+            'started': entries[0][0],
+            'file': os.path.basename(self.path),
+            'offset': size,
+            'length': len(data),
+            'counts': {severity: counts[severity] for severity in SEVERITIES if counts[severity]}
+        }
+        index_entry.update(run_info or {})
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(index_entry) + '\n')
+
+    def rotate(self):
+        """log -> log.1 -> log.2 ...; the oldest file and its index entries are dropped"""
+        import json
+
+        directory = os.path.dirname(self.path)
+        base = os.path.basename(self.path)
+
+        def rotated_name(number):
+            return base if number == 0 else f"{base}.{number}"
+
+        for number in range(self.backups, 0, -1):
+            source = os.path.join(directory, rotated_name(number - 1))
+            if os.path.exists(source):
+                os.replace(source, os.path.join(directory, rotated_name(number)))
+
+        # Point index entries at their files' new names
+        renamed = {rotated_name(number - 1): rotated_name(number) for number in range(1, self.backups + 1)}
+        entries = []
+        for entry in read_index(self.index_path):
+            if entry.get('file') in renamed:
+                entry['file'] = renamed[entry['file']]
+                entries.append(entry)
+        with open(self.index_path, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+
+
+class JsonLinesSink(RotatingFileSink):
+    """One JSON object per diagnostic, tagged with run id and timestamp"""
+
+    def format_entries(self, run_id, entries):
+        import json
+
+        lines = []
+        for timestamp, diagnostic in entries:
+            record = {'run_id': run_id, 'timestamp': timestamp}
+            record.update(diagnostic._asdict())
+            lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+        return ''.join(lines)
+
+
+class SqliteSink:
+    """Runs and their diagnostics in a SQLite database, keeping the newest max_runs"""
+
+    def __init__(self, path, max_runs=DEFAULT_MAX_RUNS):
+        self.path = path
+        self.max_runs = max_runs
+
+    def write_run(self, run_id, entries, run_info=None):
+        import sqlite3
+
+        if not entries:
+            return
+        run_info = run_info or {}
+
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                connection.execute("CREATE TABLE IF NOT EXISTS runs ("
+                                   "seq INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT UNIQUE, "
+                                   "started TEXT, midi_file TEXT, lilypond_file TEXT)")
+                connection.execute("CREATE TABLE IF NOT EXISTS diagnostics ("
+                                   "run_id TEXT, position INTEGER, timestamp TEXT, "
+                                   + ', '.join(f"{field} {SQLITE_COLUMN_TYPES[field]}"
+                                               for field in Diagnostic._fields)
+                                   + ")")
+                connection.execute("CREATE INDEX IF NOT EXISTS diagnostics_run ON diagnostics (run_id)")
+
+                connection.execute("INSERT INTO runs (run_id, started, midi_file, lilypond_file) VALUES (?, ?, ?, ?)",
+                                   (run_id, entries[0][0], run_info.get('midi_file'), run_info.get('lilypond_file')))
+                placeholders = ', '.join('?' * (3 + len(Diagnostic._fields)))
+                connection.executemany(f"INSERT INTO diagnostics VALUES ({placeholders})",
+                                       [(run_id, position, timestamp) + tuple(diagnostic)
+                                        for position, (timestamp, diagnostic) in enumerate(entries)])
+
+                # Bound the database to the most recent runs
+                connection.execute("DELETE FROM diagnostics WHERE run_id IN (SELECT run_id FROM runs "
+                                   "ORDER BY seq DESC LIMIT -1 OFFSET ?)", (self.max_runs,))
+                connection.execute("DELETE FROM runs WHERE seq NOT IN (SELECT seq FROM runs "
+                                   "ORDER BY seq DESC LIMIT ?)", (self.max_runs,))
+        finally:
+            connection.close()
+
+
+def make_sink(path):
+    """Sink for a log path, chosen by extension (see module docstring)"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.jsonl':
+        return JsonLinesSink(path)
+    if extension in SQLITE_EXTENSIONS:
+        return SqliteSink(path)
+    return RotatingFileSink(path)
+
+
+def read_index(index_path):
+    """Index entries of a rotating log, oldest first"""
+    import json
+
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def latest_run(path):
+    """Text of the most recent run in a log (any sink), or None if there is none"""
+    if os.path.splitext(path)[1].lower() in SQLITE_EXTENSIONS:
+        import sqlite3
+
+        if not os.path.exists(path):
+            return None
+        connection = sqlite3.connect(path)
+        try:
+            rows = connection.execute("SELECT timestamp, message FROM diagnostics WHERE run_id = "
+                                      "(SELECT run_id FROM runs ORDER BY seq DESC LIMIT 1) "
+                                      "ORDER BY position").fetchall()
+        finally:
+            connection.close()
+        return ''.join(f"{timestamp}: {message}\n" for timestamp, message in rows) or None
+
+    entries = read_index(path + '.index')
+    if not entries:
+        return None
+    entry = entries[-1]
+    with open(os.path.join(os.path.dirname(path), entry['file']), 'rb') as f:
+        f.seek(entry['offset'])
+        return f.read(entry['length']).decode('utf-8')
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != 'latest':
+        print("Usage: python diagnostics.py latest LOG_FILE")
+        sys.exit(1)
+
+    text = latest_run(sys.argv[2])
+    if text is None:
+        print(f"No runs recorded in {sys.argv[2]}")
+        sys.exit(1)
+    sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
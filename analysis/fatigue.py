@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Vectorized vocal fatigue engine
+Evaluates sustained high/low singing over a voices x beats pitch array,
+for several window sizes at once, using cumulative sums and run lengths
+"""
+
+import math
+
+import numpy as np
+
+# Default window: 8 beats (2 measures in 4/4)
+DEFAULT_WINDOW_BEATS = 8
+
+# Thresholds as a fraction of the window size (5 of 8 beats, 4 consecutive in 8)
+SUSTAINED_RATIO = 5 / 8
+CONSECUTIVE_RATIO = 4 / 8
+
+# Beat weights are counted in integer units of 1/COUNT_RESOLUTION beat, so
+# window sums from cumulative sums are exact. 5040 is divisible by every
+# denominator the note readers' grids produce (1/12 quarter at any beat length)
+COUNT_RESOLUTION = 5040
+
+# Named windows in bars, for callers that want 1 bar / 2 bars / a phrase
+WINDOW_BARS = {'bar': 1, 'two_bars': 2, 'phrase': 4}
+
+
+def window_sizes_for_meter(beats_per_measure, names=('bar', 'two_bars', 'phrase')):
+    """Convert windows (WINDOW_BARS names, or beat counts as ints) to beat counts for a meter"""
+    return sorted({WINDOW_BARS[name] * beats_per_measure if isinstance(name, str) else name
+                   for name in names})
+
+
+def parse_windows(text):
+    """Windows from a --fatigue-windows value: comma-separated WINDOW_BARS names
+    and/or beat counts (e.g. "bar,two_bars,phrase" or "8,12"); raises ValueError"""
+    windows = []
+    for item in text.split(','):
+        item = item.strip()
+        if item in WINDOW_BARS:
+            windows.append(item)
+        elif item.isdigit() and int(item) >= 3:
+            windows.append(int(item))
+        else:
+            raise ValueError(f"unknown fatigue window {item!r}: use {', '.join(WINDOW_BARS)} or a number of beats (3 or more)")
+    return tuple(windows)
+
+
+def window_sums(values, window):
+    """Sum of each length-`window` slice along the last axis, by differencing
+    cumulative sums
+
+    Values are rounded to integer counts of 1/COUNT_RESOLUTION first, so each
+    sum is exact and the same whether the table is the whole piece or a slice
+    of it (see update_fatigue_candidates).
+    """
+    counts = np.rint(np.asarray(values) * COUNT_RESOLUTION).astype(np.int64)
+    totals = np.cumsum(counts, axis=-1)
+    totals = np.concatenate([np.zeros(totals.shape[:-1] + (1,), dtype=np.int64), totals], axis=-1)
+    return (totals[..., window:] - totals[..., :-window]) / COUNT_RESOLUTION
+
+
+def run_lengths(flags):
+    """Length of the run of True values ending at each position along the last axis"""
+    positions = np.arange(flags.shape[-1])
+    last_break = np.where(flags, -1, positions)
+    last_break = np.maximum.accumulate(last_break, axis=-1)
+    return np.where(flags, positions - last_break, 0)
+
+
+def max_run_in_windows(flags, window):
+    """Longest run of True values inside each length-`window` slice"""
+    runs = run_lengths(flags)
+    views = np.lib.stride_tricks.sliding_window_view(runs, window, axis=-1)
+    # A run that started before the window only counts from the window start
+    return np.minimum(views, np.arange(1, window + 1)).max(axis=-1)
+
+
+def fatigue_candidates(pitch_table, low_limits, high_limits, measures, beats_per_measure,
+                       window_sizes=(DEFAULT_WINDOW_BEATS,), weights=None, first_beat=0):
+    """Every flagged window with its most severe finding, before de-duplication
+
+    pitch_table: float array (voices x beats) of analysis MIDI pitches, NaN for silence
+    low_limits/high_limits: per-voice 10th/90th percentile pitches
+    measures: per-beat measure numbers
+    weights: optional voices x beats array (e.g. note duration in beats) used
+             instead of counting every beat as 1
+    first_beat: index of the table's first column when it is a slice of a longer piece
+
+    Returns (window order, voice, start beat, finding) tuples, sorted in the
+    order select_findings reports them.
+    """
+    pitch_table = np.asarray(pitch_table, dtype=float)
+    voice_count, beat_count = pitch_table.shape
+    low_limits = np.asarray(low_limits, dtype=float)[:, None]
+    high_limits = np.asarray(high_limits, dtype=float)[:, None]
+
+    # NaN compares False, so silent beats count as neither and break runs
+    high = pitch_table > high_limits
+    low = pitch_table < low_limits
+    if weights is None:
+        weights = np.ones_like(pitch_table)
+
+    # Fall back to a beat-index estimate where a voice is silent
+    beat_index = np.arange(first_beat, first_beat + beat_count)
+    estimated_measures = beat_index // beats_per_measure + 1
+    measure_table = np.where(np.isnan(pitch_table), estimated_measures,
+                             np.asarray(measures)[None, :])
+
+    candidates = []
+    for window_order, window in enumerate(window_sizes):
+        if beat_count < window:
+            continue
+
+        sustained_at = math.ceil(SUSTAINED_RATIO * window)
+        consecutive_at = math.ceil(CONSECUTIVE_RATIO * window)
+
+        high_counts = window_sums(np.where(high, weights, 0.0), window)
+        low_counts = window_sums(np.where(low, weights, 0.0), window)
+        high_runs = max_run_in_windows(high, window)
+        low_runs = max_run_in_windows(low, window)
+        start_measures = measure_table[:, :beat_count - window + 1]
+        end_measures = measure_table[:, window - 1:]
+
+        # Most severe first: sustained high, consecutive high, sustained low, consecutive low
+        conditions = [high_counts >= sustained_at, high_runs >= consecutive_at,
+                      low_counts >= sustained_at, low_runs >= consecutive_at]
+        flagged = np.logical_or.reduce(conditions)
+
+        for voice, start in zip(*np.nonzero(flagged)):
+            if conditions[0][voice, start]:
+                kind, extreme, count = 'sustained', 'high', high_counts[voice, start]
+            elif conditions[1][voice, start]:
+                kind, extreme, count = 'consecutive', 'high', high_runs[voice, start]
+            elif conditions[2][voice, start]:
+                kind, extreme, count = 'sustained', 'low', low_counts[voice, start]
+            else:
+                kind, extreme, count = 'consecutive', 'low', low_runs[voice, start]
+
+            candidates.append((window_order, int(voice), first_beat + int(start), {
+                'kind': kind,
+                'extreme': extreme,
+                'count': float(count),
+                'window': window,
+                'start_measure': int(start_measures[voice, start]),
+                'end_measure': int(end_measures[voice, start])
+            }))
+
+    candidates.sort(key=lambda candidate: candidate[:3])
+    return candidates
+
+
+def select_findings(candidates, voice_count):
+    """Per-voice lists of finding dicts from candidates, in window/start order,
+    keeping the first (most severe window size first) finding for each
+    (start_measure, end_measure) range"""
+    findings = [[] for _ in range(voice_count)]
+    reported = [set() for _ in range(voice_count)]
+
+    for _, voice, _, finding in candidates:
+        range_key = (finding['start_measure'], finding['end_measure'])
+        if range_key in reported[voice]:
+            continue
+        reported[voice].add(range_key)
+        findings[voice].append(finding)
+
+    return findings
+
+
+def dirty_window_starts(dirty_beats, window, beat_count):
+    """Merged [first, last] ranges of window starts whose window touches a dirty beat"""
+    spans = []
+    for beat in sorted(dirty_beats):
+        first = max(0, beat - window + 1)
+        last = min(beat, beat_count - window)
+        if last < first:
+            continue
+        if spans and first <= spans[-1][1] + 1:
+            spans[-1][1] = max(spans[-1][1], last)
+        else:
+            spans.append([first, last])
+    return spans
+
+
+def update_fatigue_candidates(previous, dirty_beats, pitch_table, low_limits, high_limits,
+                              measures, beats_per_measure, window_sizes=(DEFAULT_WINDOW_BEATS,),
+                              weights=None):
+    """Recompute candidates only for windows that overlap `dirty_beats`
+
+    `previous` must come from the same window sizes and the same beat layout
+    (pitch_table columns) with only the dirty beats' contents changed. The
+    result equals fatigue_candidates on the whole table.
+    """
+    pitch_table = np.asarray(pitch_table, dtype=float)
+    beat_count = pitch_table.shape[1]
+    measures = np.asarray(measures)
+
+    recomputed = []
+    stale = {}  # window order -> start ranges being replaced
+    for window_order, window in enumerate(window_sizes):
+        spans = dirty_window_starts(dirty_beats, window, beat_count)
+        stale[window_order] = spans
+        for first, last in spans:
+            end = last + window
+            sliced = fatigue_candidates(pitch_table[:, first:end], low_limits, high_limits,
+                                        measures[first:end], beats_per_measure, (window,),
+                                        None if weights is None else weights[:, first:end],
+                                        first_beat=first)
+            recomputed.extend((window_order,) + candidate[1:] for candidate in sliced)
+
+    kept = [candidate for candidate in previous
+            if not any(first <= candidate[2] <= last for first, last in stale.get(candidate[0], ()))]
+    candidates = kept + recomputed
+    candidates.sort(key=lambda candidate: candidate[:3])
+    return candidates
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+File change watcher for watch mode
+Uses Linux inotify (through ctypes) to wake up as soon as a watched file is
+written, and falls back to fast mtime polling elsewhere (e.g. macOS).
+Bursts of writes are debounced into a single set of changed paths.
+Whole directories can be watched too, reporting any file with a given suffix
+(e.g. new .ly files), optionally with every subdirectory, including ones
+created while watching.
+"""
+
+import os
+import select
+import struct
+import time
+
+# Quiet period after the last write before a change is reported (seconds)
+DEBOUNCE_SECONDS = 0.05
+
+# How often the polling fallback checks mtimes (seconds)
+POLL_INTERVAL = 0.25
+
+# inotify event masks (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+
+class WatcherUnavailable(Exception):
+    """Raised when inotify can't be used on this system"""
+
+
+def subdirectories(directory):
+    """directory and every directory under it, skipping hidden ones"""
+    found = []
+    for root, dirs, _ in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+        found.append(root)
+    return found
+
+
+class InotifyWatcher:
+    """Watch files via inotify on their parent directories
+
+    Watching the directory (not the file) keeps working when a file is
+    replaced by rename, as editors do on save.
+    """
+
+    kind = 'inotify'
+
+    def __init__(self, paths, directories=(), suffix=None, recursive=False):
+        import ctypes
+        import ctypes.util
+
+        if not hasattr(select, 'poll') or not os.path.isdir('/proc/sys/fs/inotify'):
+            raise WatcherUnavailable("inotify is not available on this system")
+
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        try:
+            self.libc = ctypes.CDLL(libc_name, use_errno=True)
+            self.fd = self.libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        except (OSError, AttributeError) as e:
+            raise WatcherUnavailable(f"inotify_init1 failed: {e}")
+        if self.fd < 0:
+            raise WatcherUnavailable(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+
+        self.watched = {}  # wd -> (directory, {file name: watched path})
+        self.suffix = suffix
+        self.recursive = recursive
+        names_by_directory = {}
+        for directory in directories:
+            directory = os.path.abspath(directory)
+            for subdirectory in (subdirectories(directory) if recursive else [directory]):
+                names_by_directory[subdirectory] = {}
+        for path in paths:
+            directory, name = os.path.split(os.path.abspath(path))
+            names_by_directory.setdefault(directory, {})[name] = path
+
+        for directory, names in names_by_directory.items():
+            if self.add_watch(directory, names) < 0:
+                self.close()
+                raise WatcherUnavailable(f"Cannot watch {directory}: {os.strerror(ctypes.get_errno())}")
+
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+
+    def add_watch(self, directory, names):
+        """Watch a directory for writes to `names` (and suffix files); returns the wd, < 0 on failure"""
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd >= 0:
+            # Watching a directory twice gives the same wd
+            self.watched.setdefault(wd, (directory, {}))[1].update(names)
+        return wd
+
+    def watch_new_directory(self, directory):
+        """Watch a directory created under a recursively watched one
+
+        Returns the suffix files already in it, which may have been written
+        before the watch was in place.
+        """
+        found = set()
+        for subdirectory in subdirectories(directory):
+            if self.add_watch(subdirectory, {}) < 0:
+                continue  # Gone again already
+            try:
+                names = os.listdir(subdirectory)
+            except OSError:
+                continue
+            found.update(os.path.join(subdirectory, name) for name in names
+                         if name.endswith(self.suffix) and not name.startswith('.'))
+        return found
+
+    def read_changes(self):
+        """Drain pending events; return the watched paths they touched"""
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return changed
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, pos)
+                pos += INOTIFY_EVENT.size
+                name = os.fsdecode(data[pos:pos + name_length].rstrip(b'\0'))
+                pos += name_length
+                if wd not in self.watched:
+                    continue
+                directory, names = self.watched[wd]
+                if mask & IN_ISDIR:
+                    if self.recursive and self.suffix and not name.startswith('.'):
+                        changed |= self.watch_new_directory(os.path.join(directory, name))
+                elif name in names:
+                    changed.add(names[name])
+                elif self.suffix and name.endswith(self.suffix):
+                    changed.add(os.path.join(directory, name))
+
+    def wait_for_changes(self, timeout=None):
+        """Block until watched files change, then wait out the debounce period
+
+        Returns the set of changed paths (empty if the timeout expired).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed = set()
+        while not changed:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not self.poller.poll(None if remaining is None else remaining * 1000):
+                return changed
+            changed |= self.read_changes()
+
+        # Debounce: keep collecting until the files have been quiet for a moment
+        while self.poller.poll(DEBOUNCE_SECONDS * 1000):
+            changed |= self.read_changes()
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PollingWatcher:
+    """Portable fallback: compare mtime and size every POLL_INTERVAL seconds"""
+
+    kind = 'polling'
+
+    def __init__(self, paths, interval=POLL_INTERVAL, directories=(), suffix=None, recursive=False):
+        self.paths = list(paths)
+        self.interval = interval
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.suffix = suffix
+        self.recursive = recursive
+        self.signatures = {path: self.signature(path) for path in self.current_paths()}
+
+    @staticmethod
+    def signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def current_paths(self):
+        """Watched paths plus the matching files currently in watched directories"""
+        paths = list(self.paths)
+        for root in self.directories:
+            for directory in (subdirectories(root) if self.recursive else [root]):
+                try:
+                    names = sorted(os.listdir(directory))
+                except OSError:
+                    continue
+                paths.extend(os.path.join(directory, name) for name in names
+                             if self.suffix and name.endswith(self.suffix))
+        return paths
+
+    def read_changes(self):
+        changed = set()
+        for path in self.current_paths():
+            signature = self.signature(path)
+            if signature != self.signatures.get(path):
+                self.signatures[path] = signature
+                changed.add(path)
+        return changed
+
+    def wait_for_changes(self, timeout=None):
+        """Poll until watched files change, then until they stop changing"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        changed = self.read_changes()
+        while not changed:
+            if deadline is not None and time.monotonic() >= deadline:
+                return changed
+            time.sleep(self.interval)
+            changed = self.read_changes()
+
+        while True:
+            time.sleep(DEBOUNCE_SECONDS)
+            more = self.read_changes()
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def make_watcher(paths, directories=(), suffix=None, recursive=False):
+    """inotify watcher where supported, otherwise the polling fallback
+
+    Files ending in suffix inside directories are reported as they are
+    created or written, as absolute paths. With recursive, that includes
+    every (non-hidden) subdirectory, and subdirectories created later.
+    """
+    try:
+        return InotifyWatcher(paths, directories, suffix, recursive)
+    except WatcherUnavailable:
+        return PollingWatcher(paths, directories=directories, suffix=suffix, recursive=recursive)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Sweep-line harmonic segmentation
+Walks every part's note onsets and releases in time order and cuts the
+piece wherever the set of sounding pitches changes, so each segment is one
+harmony with its exact start and end. Consecutive segments sounding the same
+pitches (a re-struck chord) are merged, so the work and the number of
+segments grow with the number of note events, not with the piece's length.
+"""
+
+from collections import namedtuple
+
+# pitches holds, per part, the pitch tuples of the notes sounding throughout
+# [start, end) in stream order (empty for a silent part)
+Segment = namedtuple('Segment', ['start', 'end', 'pitches'])
+
+
+def harmonic_segments(part_indexes, cuts=()):
+    """Segments of everything the parts (note_index.PartIndex) sound, in time order
+
+    cuts are times to split at even without a change (e.g. barlines), so no
+    segment straddles one. Stretches where every part is silent are skipped.
+    """
+    # time -> (part, note, starts) changes, releases and onsets alike
+    changes = {}
+    for part, part_index in enumerate(part_indexes):
+        for note, (onset, release) in enumerate(zip(part_index.onsets, part_index.releases)):
+            if release > onset:
+                changes.setdefault(onset, []).append((part, note, True))
+                changes.setdefault(release, []).append((part, note, False))
+    cuts = set(cuts)
+    for time in cuts:
+        changes.setdefault(time, [])
+
+    sounding = [set() for _ in part_indexes]
+    segments = []
+    current = None
+    start = None
+    for time in sorted(changes):
+        for part, note, starts in changes[time]:
+            if starts:
+                sounding[part].add(note)
+            else:
+                sounding[part].discard(note)
+
+        pitches = tuple(tuple(part_index.pitches[note] for note in sorted(notes))
+                        for part_index, notes in zip(part_indexes, sounding))
+        if pitches == current and time not in cuts:
+            continue
+        if current is not None and any(current):
+            segments.append(Segment(start, time, current))
+        current, start = pitches, time
+
+    return segments
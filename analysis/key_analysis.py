@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Key detection helpers
+Key resolution from LilyPond directives and MIDI key signatures, with a
+statistical key-profile correlation (same weights and spelling as music21's
+default 'key' analysis) as the last resort
+"""
+
+import re
+
+# Default pitch spelling for each pitch class (matches music21 MIDI import)
+PITCH_CLASS_NAMES = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+
+# Aarden-Essen key profiles (music21's default for analyze('key'))
+MAJOR_PROFILE = [17.7661, 0.145624, 14.9265, 0.160186, 19.8049, 11.3587,
+                 0.291248, 22.062, 0.145624, 8.15494, 0.232998, 4.95122]
+MINOR_PROFILE = [18.2648, 0.737619, 14.0499, 16.8599, 0.702494, 14.4362,
+                 0.702494, 18.6161, 4.56621, 1.93186, 7.37619, 1.75623]
+
+# Tonic spellings preferred when the default spelling isn't a usual key name
+ENHARMONIC_TONICS = {'major': {'G#': 'A-'}, 'minor': {}}
+
+LETTER_PITCH_CLASSES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+
+# LilyPond espanol note names (\language "espanol")
+ESPANOL_STEPS = {'do': 'C', 're': 'D', 'mi': 'E', 'fa': 'F', 'sol': 'G', 'la': 'A', 'si': 'B'}
+ESPANOL_ACCIDENTALS = {'': '', 's': '#', 'ss': '##', 'b': '-', 'bb': '--'}
+
+# Tonic for each key-signature sharp count (negative = flats)
+MAJOR_SIGNATURE_TONICS = {-7: 'C-', -6: 'G-', -5: 'D-', -4: 'A-', -3: 'E-', -2: 'B-', -1: 'F',
+                          0: 'C', 1: 'G', 2: 'D', 3: 'A', 4: 'E', 5: 'B', 6: 'F#', 7: 'C#'}
+MINOR_SIGNATURE_TONICS = {-7: 'A-', -6: 'E-', -5: 'B-', -4: 'F', -3: 'C', -2: 'G', -1: 'D',
+                          0: 'A', 1: 'E', 2: 'B', 3: 'F#', 4: 'C#', 5: 'G#', 6: 'D#', 7: 'A#'}
+
+
+def pitch_class_from_name(name):
+    """Pitch class of a key/pitch name like 'C', 'F#' or 'B-'"""
+    pitch_class = LETTER_PITCH_CLASSES[name[0].upper()]
+    for accidental in name[1:]:
+        if accidental == '#':
+            pitch_class += 1
+        elif accidental == '-':
+            pitch_class -= 1
+    return pitch_class % 12
+
+
+def espanol_to_key_name(note):
+    """Convert an espanol note name (e.g. 'sib', 'fas') to a key name ('B-', 'F#')"""
+    note = note.rstrip(",'")
+    for step in sorted(ESPANOL_STEPS, key=len, reverse=True):
+        if note.startswith(step) and note[len(step):] in ESPANOL_ACCIDENTALS:
+            return ESPANOL_STEPS[step] + ESPANOL_ACCIDENTALS[note[len(step):]]
+    return None
+
+
+def strip_lilypond_comments(text):
+    """Remove %{ block %} and % line comments from LilyPond source"""
+    text = re.sub(r'%\{.*?%\}', '', text, flags=re.DOTALL)
+    return re.sub(r'%[^\n]*', '', text)
+
+
+def key_from_lilypond(text):
+    """Resolve the sounding (tonic name, mode) from LilyPond source, or None
+
+    Reads the \\key directive, any uncommented \\minor, and the first
+    \\transpose that changes pitch class (octave-only doubling transposes are
+    skipped). `songKey = X` is substituted for \\songKey as in the template.
+    If the \\key is written in the transposition's source key (the template's
+    "always write in do" convention) the transposition is applied; otherwise
+    the \\key is taken to already be the sounding key.
+    """
+    text = strip_lilypond_comments(text)
+
+    key_match = re.search(r'\\key\s+([a-z]+)\s*(?:\\(major|minor))?', text)
+    if not key_match:
+        return None
+    tonic = espanol_to_key_name(key_match.group(1))
+    if tonic is None:
+        return None
+    mode = 'minor' if re.search(r'\\minor\b', text) else 'major'
+
+    song_key = re.search(r'^\s*songKey\s*=\s*([a-z]+)', text, re.MULTILINE)
+    for match in re.finditer(r'\\transpose\s+([a-z]+[,\']*)\s+(\\songKey|[a-z]+[,\']*)', text):
+        target = match.group(2)
+        if target == '\\songKey':
+            if not song_key:
+                continue
+            target = song_key.group(1)
+
+        source_name = espanol_to_key_name(match.group(1))
+        target_name = espanol_to_key_name(target)
+        if source_name is None or target_name is None:
+            continue
+        if pitch_class_from_name(source_name) == pitch_class_from_name(target_name):
+            continue  # Octave doubling, not a key change
+
+        if pitch_class_from_name(tonic) == pitch_class_from_name(source_name):
+            tonic = target_name
+        break
+
+    return tonic, mode
+
+
+def key_from_signature(sharps, mode):
+    """(tonic name, mode) for a key signature's sharp count (negative = flats)"""
+    tonics = MINOR_SIGNATURE_TONICS if mode == 'minor' else MAJOR_SIGNATURE_TONICS
+    if sharps not in tonics:
+        return None
+    return tonics[sharps], mode
+
+
+def profile_correlation(distribution, profile, tonic):
+    """Pearson correlation between a pitch-class distribution and a rotated key profile"""
+    profile_mean = sum(profile) / 12
+    distribution_mean = sum(distribution) / 12
+
+    top = 0.0
+    profile_var = 0.0
+    distribution_var = 0.0
+    for pc in range(12):
+        weight = profile[(pc - tonic) % 12] - profile_mean
+        value = distribution[pc] - distribution_mean
+        top += weight * value
+        profile_var += weight ** 2
+        distribution_var += value ** 2
+
+    if profile_var == 0 or distribution_var == 0:
+        return 0.0
+    return top / (profile_var * distribution_var) ** 0.5
+
+
+def estimate_key(notes):
+    """Estimate (tonic name, mode) from (midi pitches, quarter length) pairs
+
+    Each pitch is weighted by its duration. Returns None when there are no notes.
+    """
+    distribution = [0.0] * 12
+    for pitches, quarter_length in notes:
+        for midi in pitches:
+            distribution[midi % 12] += quarter_length
+
+    if not any(distribution):
+        return None
+
+    candidates = []
+    for mode, profile in (('major', MAJOR_PROFILE), ('minor', MINOR_PROFILE)):
+        for tonic in range(12):
+            candidates.append((profile_correlation(distribution, profile, tonic), tonic, mode))
+
+    _, tonic, mode = max(candidates, key=lambda candidate: candidate[0])
+    name = PITCH_CLASS_NAMES[tonic]
+    return ENHARMONIC_TONICS[mode].get(name, name), mode
@@ -0,0 +1,833 @@
+#!/usr/bin/env python3
+"""
+LilyPond source tokenizer, note-to-source map and note-event front end
+Tokenizes a .ly file in one pass and walks each voice's music (espanol note
+names, \\relative, durations, dots, ties, chords, tuplets, \\repeat and
+\\alternative) to record where every note is written. The result maps
+(voice, note index) and (voice, musical offset) to the exact line and
+column, built once per source file.
+
+Voice music is recognised in both template layouts: trebleA/trebleB ...
+sections (played A then B) and single trebleMusic ... definitions.
+
+note_events() plays the score that has a \\midi block (staves, \\transpose,
+\\songKey, octave doubling) into the same per-track note events the MIDI
+reader produces, so songs can be analyzed without compiling them first.
+
+Usage: python lilypond_source.py song.ly [--events]
+"""
+
+import re
+import sys
+from bisect import bisect_right
+from collections import namedtuple
+from fractions import Fraction
+
+Token = namedtuple('Token', ['kind', 'text', 'line', 'column'])
+
+# One note as written: offset/duration in quarter notes from the start of the
+# voice, pitch as a MIDI number before any \transpose (None for rests)
+SourceNote = namedtuple('SourceNote', ['voice', 'section', 'index', 'offset', 'duration',
+                                       'pitch', 'tied', 'line', 'column'])
+
+VOICE_NAMES = ('treble', 'alto', 'tenor', 'bass')
+VOICE_DEFINITION = re.compile(r'^(treble|alto|tenor|bass)(A|B|Music)$')
+
+# Sections in the order the score plays them
+SECTION_ORDER = ('A', 'B', 'Music')
+
+# Offsets are keyed in MIDI-style ticks so float offsets from the MIDI file match
+TICKS_PER_QUARTER = 960
+
+TOKEN_PATTERN = re.compile(r"""
+    (?P<block_comment>%\{.*?%\})
+  | (?P<comment>%[^\n]*)
+  | (?P<newline>\n)
+  | (?P<space>[ \t\r\f\v]+)
+  | (?P<string>"(?:\\.|[^"\\])*")
+  | (?P<scheme>\#)
+  | (?P<command>\\[A-Za-z]+|\\.)
+  | (?P<word>[^\W\d_]+)
+  | (?P<number>\d+)
+  | (?P<symbol><<|>>|.)
+""", re.VERBOSE | re.DOTALL)
+
+# Espanol note names: step index (do = 0 ... si = 6) and accidentals
+NOTE_STEPS = {'do': 0, 're': 1, 'mi': 2, 'fa': 3, 'sol': 4, 'la': 5, 'si': 6}
+NOTE_ACCIDENTALS = {'': 0, 's': 1, 'ss': 2, 'b': -1, 'bb': -2}
+STEP_SEMITONES = [0, 2, 4, 5, 7, 9, 11]
+NOTE_NAME = re.compile(r'^(do|re|mi|fa|sol|la|si)(ss|s|bb|b)?$')
+
+# Octave number of LilyPond's unmarked octave (do = C3 = MIDI 48)
+BASE_OCTAVE = 3
+
+# \relative without a start pitch behaves as if relative to f (F3)
+DEFAULT_RELATIVE_STEP = BASE_OCTAVE * 7 + NOTE_STEPS['fa']
+
+# Rests, spacers, multi-measure rests and chord repeats
+REST_WORDS = ('r', 's', 'R')
+
+# Commands that take a music argument played in zero time
+GRACE_COMMANDS = ('\\grace', '\\acciaccatura', '\\appoggiatura', '\\slashedGrace')
+
+# Commands followed by one argument that isn't music
+ONE_ARGUMENT_COMMANDS = ('\\clef', '\\bar', '\\mark', '\\language', '\\jump', '\\tag')
+
+# Output and settings blocks that hold no notes
+SETTINGS_COMMANDS = ('\\layout', '\\midi', '\\header', '\\paper', '\\with')
+
+# Text-only modes, never walked as notes
+TEXT_MODES = ('\\lyricmode', '\\lyrics', '\\addlyrics', '\\markup', '\\markuplist',
+              '\\chordmode', '\\figuremode', '\\drummode')
+
+# Contexts that become a MIDI track, and contexts without notes
+STAFF_CONTEXTS = ('Staff', 'RhythmicStaff', 'TabStaff', 'DrumStaff')
+TEXT_CONTEXTS = ('Lyrics', 'ChordNames', 'FiguredBass', 'NoteNames', 'Dynamics')
+
+
+def tokenize(text):
+    """Tokens of a LilyPond source, with 1-based line and column
+
+    Comments and whitespace are dropped; an embedded Scheme expression
+    (#..., #'(...), ##t) becomes a single 'scheme' token.
+    """
+    tokens = []
+    line = 1
+    line_start = 0
+    position = 0
+    length = len(text)
+
+    while position < length:
+        match = TOKEN_PATTERN.match(text, position)
+        kind = match.lastgroup
+        end = match.end()
+
+        if kind == 'scheme':
+            end = skip_scheme(text, end)
+        if kind not in ('newline', 'space', 'comment', 'block_comment'):
+            tokens.append(Token(kind, text[position:end], line, position - line_start + 1))
+
+        # Track line starts for the tokens that follow (block comments and
+        # strings can span lines)
+        newlines = text.count('\n', position, end)
+        if newlines:
+            line += newlines
+            line_start = text.rindex('\n', position, end) + 1
+        position = end
+
+    return tokens
+
+
+def skip_scheme(text, position):
+    """End position of the Scheme datum starting at position (just after '#')"""
+    length = len(text)
+    while position < length and text[position] in "#'`,":
+        position += 1
+    if position >= length:
+        return position
+
+    if text[position] == '"':
+        match = re.compile(r'"(?:\\.|[^"\\])*"').match(text, position)
+        return match.end() if match else length
+
+    if text[position] == '(':
+        depth = 0
+        while position < length:
+            char = text[position]
+            if char == '"':
+                match = re.compile(r'"(?:\\.|[^"\\])*"').match(text, position)
+                position = match.end() if match else length
+                continue
+            if char == ';':  # Scheme line comment
+                newline = text.find('\n', position)
+                position = length if newline < 0 else newline
+                continue
+            if char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if depth == 0:
+                    return position + 1
+            position += 1
+        return position
+
+    while position < length and not text[position].isspace() and text[position] not in '{}()<>':
+        position += 1
+    return position
+
+
+def pitch_from_name(name):
+    """(diatonic step within the octave, semitone offset) of an espanol note name"""
+    match = NOTE_NAME.match(name)
+    if not match:
+        return None
+    return NOTE_STEPS[match.group(1)], NOTE_ACCIDENTALS[match.group(2) or '']
+
+
+def midi_from_step(diatonic_step, alteration):
+    """MIDI number of an absolute diatonic step number plus accidental"""
+    octave, step = divmod(diatonic_step, 7)
+    return 12 * (octave + 1) + STEP_SEMITONES[step] + alteration
+
+
+class LilyPondSource:
+    """A tokenized .ly file with its variable definitions
+
+    Music definitions are walked once, in source order, so each one's notes
+    and starting default duration are known (an unwritten duration carries
+    over from the previous definition, as in LilyPond's parser).
+    """
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.definitions = music_definitions(self.tokens)  # name -> (first, end) token range
+        self.pitches = pitch_definitions(self.tokens)  # name -> token position (songKey = sol)
+        self.unfold_repeats = any(token.text == '\\unfoldRepeats' for token in self.tokens)
+
+        self.start_durations = {}
+        self.walked = {}  # name -> MusicWalker that played the definition on its own
+        duration = Fraction(1)
+        for name, (first, last) in sorted(self.definitions.items(), key=lambda item: item[1]):
+            if self.tokens[first].text in TEXT_MODES:
+                continue
+            walker = MusicWalker(self)
+            walker.duration = self.start_durations[name] = duration
+            walker.walk(first, last)
+            duration = walker.duration
+            self.walked[name] = walker
+
+    def midi_score(self):
+        """(first, end) token range inside the \\score with a \\midi block, or None"""
+        scores = []
+        for index, token in enumerate(self.tokens):
+            if token.text == '\\score' and index + 1 < len(self.tokens) and self.tokens[index + 1].text == '{':
+                close = MusicWalker(self).matching(index + 1, '{', '}')
+                scores.append((index + 2, close))
+        for first, last in scores:
+            if any(self.tokens[index].text == '\\midi' for index in range(first, last)):
+                return first, last
+        return scores[0] if scores else None
+
+
+class MusicWalker:
+    """Walks music tokens, recording each written note's timing and place"""
+
+    def __init__(self, source):
+        self.source = source
+        self.tokens = source.tokens
+
+        self.offset = Fraction(0)
+        self.duration = Fraction(1)  # Last written duration in quarter notes (default 4)
+        self.scale = Fraction(1)  # Tuplet time scaling
+        self.reference = None  # Diatonic step for \relative, None for absolute
+        self.fixed_shift = 0  # Octave steps added to absolute pitches by \fixed
+        self.transposition = 0  # Semitones added by enclosing \transpose blocks
+        self.last_chord = None
+        self.notes = []  # (offset, duration, sounding pitch, tied, token) as played
+        self.tracks = None  # Playing a score: one notes list per staff
+        self.time_signature = None  # First \time as (numerator, denominator)
+        self.expanding = set()
+
+    def walk(self, position, end):
+        """Play the music between two token positions"""
+        while position < end:
+            position = self.element(position, end)
+
+    def element(self, position, end):
+        """Play one music element; returns the position after it"""
+        token = self.tokens[position]
+
+        if token.text == '{':
+            close = self.matching(position, '{', '}')
+            self.walk(position + 1, close)
+            return close + 1
+
+        if token.text == '<<':
+            close = self.matching(position, '<<', '>>')
+            start, longest = self.offset, self.offset
+            inner = position + 1
+            while inner < close:
+                if self.tokens[inner].text == '\\\\':
+                    inner += 1
+                    continue
+                self.offset = start
+                inner = self.element(inner, close)
+                longest = max(longest, self.offset)
+            self.offset = longest
+            return close + 1
+
+        if token.text == '<':
+            return self.chord(position, end)
+
+        if token.text == '~':
+            # Tie every note of the last note or chord into the next
+            for index in range(len(self.notes) - 1, -1, -1):
+                note_offset, duration, pitch, _, note_token = self.notes[index]
+                if note_offset != self.notes[-1][0]:
+                    break
+                self.notes[index] = (note_offset, duration, pitch, True, note_token)
+            return position + 1
+
+        if token.kind == 'word':
+            if token.text in REST_WORDS:
+                return self.rest(position + 1, end)
+            if token.text == 'q' and self.last_chord:
+                return self.play(self.last_chord, token, position + 1, end)
+            pitch, position = self.pitch(position, end)
+            if pitch is None:
+                return position
+            self.last_chord = None
+            return self.play([pitch], token, position, end)
+
+        if token.kind == 'command':
+            return self.command(position, end)
+
+        if token.text in '-^_' and position + 1 < end:
+            return position + 2  # Articulation or markup attached to a note
+
+        return position + 1
+
+    def matching(self, position, opening, closing):
+        """Position of the bracket closing the one at position"""
+        depth = 0
+        for index in range(position, len(self.tokens)):
+            text = self.tokens[index].text
+            if text == opening:
+                depth += 1
+            elif text == closing:
+                depth -= 1
+                if depth == 0:
+                    return index
+        return len(self.tokens)
+
+    def pitch(self, position, end):
+        """Read a note name with octave marks; returns (MIDI pitch or None, next position)"""
+        name = pitch_from_name(self.tokens[position].text)
+        position += 1
+        if name is None:
+            return None, position
+        step, alteration = name
+
+        octave_shift = 0
+        while position < end and self.tokens[position].text in ("'", ','):
+            octave_shift += 1 if self.tokens[position].text == "'" else -1
+            position += 1
+        while position < end and self.tokens[position].text in ('!', '?'):
+            position += 1
+
+        if self.reference is None:
+            diatonic = BASE_OCTAVE * 7 + step + 7 * octave_shift + self.fixed_shift
+        else:
+            interval = (step - self.reference) % 7
+            if interval > 3:
+                interval -= 7
+            diatonic = self.reference + interval + 7 * octave_shift
+            self.reference = diatonic
+        return midi_from_step(diatonic, alteration), position
+
+    def read_duration(self, position, end):
+        """Read an optional duration (number or \\breve, dots, *n/m); returns next position"""
+        if position >= end:
+            return position
+
+        token = self.tokens[position]
+        if token.kind == 'number' and token.text in ('1', '2', '4', '8', '16', '32', '64', '128'):
+            duration = Fraction(4, int(token.text))
+        elif token.text in ('\\breve', '\\longa'):
+            duration = Fraction(8 if token.text == '\\breve' else 16)
+        else:
+            return position
+        position += 1
+
+        # Dots must follow the duration directly ("do2." not "do2 .")
+        dot = duration / 2
+        while (position < end and self.tokens[position].text == '.'
+               and self.tokens[position].line == self.tokens[position - 1].line
+               and self.tokens[position].column == self.tokens[position - 1].column + len(self.tokens[position - 1].text)):
+            duration += dot
+            dot /= 2
+            position += 1
+
+        while position + 1 < end and self.tokens[position].text == '*' and self.tokens[position + 1].kind == 'number':
+            factor = Fraction(int(self.tokens[position + 1].text))
+            position += 2
+            if position + 1 < end and self.tokens[position].text == '/' and self.tokens[position + 1].kind == 'number':
+                factor /= int(self.tokens[position + 1].text)
+                position += 2
+            duration *= factor
+
+        self.duration = duration
+        return position
+
+    def play(self, pitches, token, position, end):
+        """Record a note or chord at the current offset and advance time"""
+        position = self.read_duration(position, end)
+        length = self.duration * self.scale
+        for pitch in pitches:
+            self.notes.append((self.offset, length, pitch + self.transposition, False, token))
+        self.offset += length
+        return position
+
+    def rest(self, position, end):
+        position = self.read_duration(position, end)
+        self.offset += self.duration * self.scale
+        return position
+
+    def chord(self, position, end):
+        """<do mi sol>4: pitches relative to each other, the first sets the reference"""
+        close = position + 1
+        while close < end and self.tokens[close].text != '>':
+            close += 1
+
+        pitches = []
+        first_reference = None
+        inner = position + 1
+        while inner < close:
+            if self.tokens[inner].kind == 'word':
+                pitch, inner = self.pitch(inner, close)
+                if pitch is not None:
+                    pitches.append(pitch)
+                    if first_reference is None:
+                        first_reference = self.reference
+            else:
+                inner += 1
+        if first_reference is not None:
+            self.reference = first_reference
+
+        self.last_chord = pitches
+        return self.play(pitches, self.tokens[position], close + 1, end)
+
+    def lexical_state(self):
+        """Parser state that follows the source text rather than playing order"""
+        return self.reference, self.duration, self.last_chord
+
+    def restore_lexical_state(self, state):
+        self.reference, self.duration, self.last_chord = state
+
+    def absolute_pitch(self, position, end):
+        """Read a pitch argument (do' or a \\songKey-style variable) as an absolute
+        diatonic step; returns (step and alteration or None, next position)"""
+        token = self.tokens[position]
+        if token.kind == 'command' and token.text[1:] in self.source.pitches:
+            value, _ = self.absolute_pitch(self.source.pitches[token.text[1:]], len(self.tokens))
+            return value, position + 1
+
+        name = pitch_from_name(token.text)
+        position += 1
+        if name is None:
+            return None, position
+        step, alteration = name
+        octave_shift = 0
+        while position < end and self.tokens[position].text in ("'", ','):
+            octave_shift += 1 if self.tokens[position].text == "'" else -1
+            position += 1
+        return (BASE_OCTAVE * 7 + step + 7 * octave_shift, alteration), position
+
+    def fraction_argument(self, position):
+        """Read 'n/m' at position; returns (Fraction, next position)"""
+        numerator = int(self.tokens[position].text)
+        denominator = int(self.tokens[position + 2].text)
+        return Fraction(numerator, denominator), position + 3
+
+    def command(self, position, end):
+        """Handle a backslash command inside music"""
+        name = self.tokens[position].text
+        position += 1
+
+        if name == '\\relative':
+            saved = self.reference
+            self.reference = DEFAULT_RELATIVE_STEP
+            if position < end and pitch_from_name(self.tokens[position].text):
+                (self.reference, _), position = self.absolute_pitch(position, end)
+            position = self.element(position, end)
+            self.reference = saved
+            return position
+
+        if name in ('\\tuplet', '\\times'):
+            ratio, position = self.fraction_argument(position)
+            if name == '\\tuplet':
+                ratio = 1 / ratio
+                if position < end and self.tokens[position].kind == 'number':
+                    position += 1  # Tuplet span duration
+            saved = self.scale
+            self.scale *= ratio
+            position = self.element(position, end)
+            self.scale = saved
+            return position
+
+        if name in GRACE_COMMANDS:
+            saved_offset, saved_notes = self.offset, len(self.notes)
+            position = self.element(position, end)
+            self.offset = saved_offset
+            del self.notes[saved_notes:]
+            return position
+
+        if name == '\\repeat':
+            kind = self.tokens[position].text
+            count = int(self.tokens[position + 1].text)
+            body = position + 2
+            after_body = self.skip(body, end)
+
+            alternatives = []
+            after = after_body
+            if after < end and self.tokens[after].text == '\\alternative':
+                close = self.matching(after + 1, '{', '}')
+                inner = after + 2
+                while inner < close:
+                    alternatives.append(inner)
+                    inner = self.skip(inner, close)
+                after = close + 1
+
+            # Played once as printed: the body, then each ending. This also
+            # fixes the relative pitches and default durations, which
+            # LilyPond resolves in source order before any unfolding
+            start_state = self.lexical_state()
+            start_offset, start_count = self.offset, len(self.notes)
+            self.element(body, end)
+            ending_states = []
+            for alternative in alternatives:
+                ending_states.append(self.lexical_state())
+                self.element(alternative, end)
+            end_state = self.lexical_state()
+
+            if kind == 'volta' and not self.source.unfold_repeats:
+                return after
+
+            self.offset = start_offset
+            del self.notes[start_count:]
+            for time in range(count):
+                self.restore_lexical_state(start_state)
+                self.element(body, end)
+                if alternatives:
+                    # Early passes take the first endings in turn
+                    ending = max(0, time - (count - len(alternatives)))
+                    self.restore_lexical_state(ending_states[ending])
+                    self.element(alternatives[ending], end)
+            self.restore_lexical_state(end_state)
+            return after
+
+        if name in ('\\partial', '\\time'):
+            if name == '\\time' and position + 2 < end and self.tokens[position + 1].text == '/':
+                if self.time_signature is None:
+                    self.time_signature = (int(self.tokens[position].text), int(self.tokens[position + 2].text))
+                return position + 3
+            saved = self.duration
+            position = self.read_duration(position, end)
+            self.duration = saved
+            return position
+
+        if name == '\\skip':
+            return self.rest(position, end)
+
+        if name == '\\key':
+            position += 1
+            if position < end and self.tokens[position].kind == 'command':
+                position += 1
+            return position
+
+        if name in ('\\set', '\\override', '\\unset', '\\revert', '\\tweak'):
+            while position < end and self.tokens[position].kind in ('word', 'symbol') \
+                    and self.tokens[position].text not in ('=', '{', '}', '<', '<<', '~', '|'):
+                position += 1
+            if position < end and self.tokens[position].text == '=':
+                position += 2
+            elif name in ('\\tweak', '\\revert') and position < end and self.tokens[position].kind == 'scheme':
+                position += 1
+            return position
+
+        if name == '\\markup':
+            return self.skip(position, end)
+
+        if name == '\\tempo':
+            # \tempo "Text" 4 = 100
+            while position < end and (self.tokens[position].kind in ('string', 'number', 'scheme')
+                                      or self.tokens[position].text in ('=', '-')):
+                position += 1
+            return position
+
+        if name in ONE_ARGUMENT_COMMANDS:
+            return self.skip(position, end)
+
+        if name in ('\\transpose', '\\fixed'):
+            # \\relative doesn't reach inside either: their music is absolute
+            first, position = self.absolute_pitch(position, end)
+            saved = self.reference, self.fixed_shift, self.transposition
+            self.reference = None
+            if name == '\\transpose':
+                second, position = self.absolute_pitch(position, end)
+                if first and second:
+                    self.transposition += midi_from_step(*second) - midi_from_step(*first)
+            elif first:
+                self.fixed_shift = first[0] - first[0] % 7 - BASE_OCTAVE * 7
+            position = self.element(position, end)
+            self.reference, self.fixed_shift, self.transposition = saved
+            return position
+
+        if name in ('\\new', '\\context'):
+            return self.new_context(position, end)
+
+        if name == '\\lyricsto':
+            return self.skip(position + 1, end)
+
+        if name in TEXT_MODES or name in SETTINGS_COMMANDS:
+            return self.skip(position, end)
+
+        # A reference to another music variable plays its contents, with the
+        # default duration it has where it is written
+        variable = name[1:]
+        if variable in self.source.definitions and variable not in self.expanding:
+            first, last = self.source.definitions[variable]
+            self.expanding.add(variable)
+            saved = self.lexical_state()
+            self.duration = self.source.start_durations.get(variable, self.duration)
+            self.walk(first, last)
+            self.restore_lexical_state(saved)
+            self.expanding.discard(variable)
+        return position
+
+    def new_context(self, position, end):
+        """\\new Staff = "name" \\with { ... } music: staves get their own track"""
+        context = self.tokens[position].text
+        position += 1
+        if position + 1 < end and self.tokens[position].text == '=':
+            position += 2
+        if position < end and self.tokens[position].text == '\\with':
+            position = self.skip(position + 1, end)
+
+        if context in TEXT_CONTEXTS:
+            if position < end and self.tokens[position].text == '\\lyricsto':
+                position += 2
+            return self.skip(position, end)
+
+        if context in STAFF_CONTEXTS and self.tracks is not None:
+            saved = self.notes
+            self.notes = []
+            self.tracks.append(self.notes)
+            position = self.element(position, end)
+            self.notes = saved
+            return position
+
+        return self.element(position, end)
+
+    def skip(self, position, end):
+        """Position after one argument (braced block or single token) without playing it"""
+        if position >= end:
+            return end
+        text = self.tokens[position].text
+        if text == '{':
+            return self.matching(position, '{', '}') + 1
+        if text == '<<':
+            return self.matching(position, '<<', '>>') + 1
+        if text in ('\\relative', '\\transpose', '\\fixed', '\\tuplet', '\\times', '\\markup',
+                    '\\bold', '\\italic', '\\small', '\\smaller', '\\tiny'):
+            position += 1
+            while position < end and self.tokens[position].text not in ('{', '<<') \
+                    and self.tokens[position].kind != 'command':
+                position += 1
+            return self.skip(position, end)
+        return position + 1
+
+
+class SourceMap:
+    """Exact source position of every note, by voice
+
+    notes[voice] lists each voice's notes in playing order (sections
+    concatenated), so notes[voice][i] is the i-th note sung. note_at() finds
+    the note sounding at a musical offset: onsets are a dict lookup, times
+    inside a held note fall back to a bisect.
+    """
+
+    def __init__(self, notes):
+        self.notes = notes
+        self.onsets = {}
+        self.onset_ticks = {}
+        for voice, voice_notes in notes.items():
+            for note in voice_notes:
+                self.onsets.setdefault((voice, offset_ticks(note.offset)), note)
+            self.onset_ticks[voice] = [offset_ticks(note.offset) for note in voice_notes]
+
+    def __len__(self):
+        return sum(len(voice_notes) for voice_notes in self.notes.values())
+
+    def note(self, voice, index):
+        """The index-th note of a voice, or None"""
+        voice_notes = self.notes.get(voice, ())
+        return voice_notes[index] if 0 <= index < len(voice_notes) else None
+
+    def note_at(self, voice, offset):
+        """The note of a voice sounding at offset (quarter notes), or None"""
+        ticks = offset_ticks(offset)
+        note = self.onsets.get((voice, ticks))
+        if note is not None or voice not in self.notes:
+            return note
+
+        index = bisect_right(self.onset_ticks[voice], ticks) - 1
+        if index < 0:
+            return None
+        note = self.notes[voice][index]
+        return note if ticks < offset_ticks(note.offset + note.duration) else None
+
+
+def offset_ticks(offset):
+    return round(offset * TICKS_PER_QUARTER)
+
+
+def pitch_definitions(tokens):
+    """Variable name -> token position of its pitch, for `songKey = sol`"""
+    pitches = {}
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token.text in ('{', '<<'):
+            depth += 1
+        elif token.text in ('}', '>>'):
+            depth -= 1
+        elif (depth == 0 and token.kind == 'word' and index + 2 < len(tokens)
+              and tokens[index + 1].text == '=' and pitch_from_name(tokens[index + 2].text)):
+            pitches[token.text] = index + 2
+    return pitches
+
+
+def music_definitions(tokens):
+    """Variable name -> (first, end) token range of its music, for `name = ... { }`"""
+    definitions = {}
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token.text in ('{', '<<'):
+            depth += 1
+        elif token.text in ('}', '>>'):
+            depth -= 1
+        elif (depth == 0 and token.kind == 'word' and index + 2 < len(tokens)
+              and tokens[index + 1].text == '='):
+            start = index + 2
+            # The value runs to its first top-level block (e.g. \relative do' { ... })
+            # (commands, and pitch arguments directly after a command)
+            position = start
+            previous = None
+            while position < len(tokens) and tokens[position].text not in ('{', '<<'):
+                kind = tokens[position].kind
+                if kind == 'word' and previous not in ('command', 'word'):
+                    break
+                if kind not in ('command', 'word') and tokens[position].text not in ("'", ','):
+                    break
+                previous = kind if kind != 'symbol' else previous
+                position += 1
+            if position < len(tokens) and tokens[position].text in ('{', '<<'):
+                opening = tokens[position].text
+                closing = '}' if opening == '{' else '>>'
+                level = 0
+                for close in range(position, len(tokens)):
+                    if tokens[close].text == opening:
+                        level += 1
+                    elif tokens[close].text == closing:
+                        level -= 1
+                        if level == 0:
+                            break
+                definitions[token.text] = (start, close + 1)
+    return definitions
+
+
+def build_source_map(text):
+    """SourceMap of the voice music in a LilyPond source"""
+    source = text if isinstance(text, LilyPondSource) else LilyPondSource(text)
+
+    # Sections play one after another
+    notes = {}
+    for voice in VOICE_NAMES:
+        voice_notes = []
+        offset = Fraction(0)
+        for section in SECTION_ORDER:
+            name = f"{voice}{section}"
+            if name not in source.walked:
+                continue
+            walker = source.walked[name]
+            for note_offset, note_duration, pitch, tied, token in walker.notes:
+                voice_notes.append(SourceNote(voice, name, len(voice_notes), offset + note_offset,
+                                              note_duration, pitch, tied, token.line, token.column))
+            offset += walker.offset
+        if voice_notes:
+            notes[voice] = voice_notes
+
+    return SourceMap(notes)
+
+
+def note_events(text):
+    """Note events of the \\midi score, as the MIDI reader would give them
+
+    Returns {'part_events': one list of (onset, release, pitches) per staff
+    with notes, 'time_signature': (numerator, denominator) or None,
+    'key_signature': None}. Tied notes are merged and notes starting together
+    become one chord, pitches in written order.
+    """
+    source = text if isinstance(text, LilyPondSource) else LilyPondSource(text)
+    score = source.midi_score()
+
+    walker = MusicWalker(source)
+    walker.tracks = []
+    unplaced = walker.notes
+    if score:
+        walker.walk(*score)
+    tracks = [unplaced] + walker.tracks
+
+    part_events = []
+    for track in tracks:
+        events = track_events(track)
+        if events:
+            part_events.append(events)
+
+    return {'part_events': part_events, 'time_signature': walker.time_signature, 'key_signature': None}
+
+
+def track_events(notes):
+    """(onset, release, pitches) chords for one track's played notes, ties merged"""
+    notes = sorted(notes, key=lambda note: note[0])  # stable: written order within a chord
+
+    merged = []  # [onset, release, pitch, tied]
+    open_ties = {}  # (pitch, release) -> merged note a tie continues into
+    for offset, duration, pitch, tied, _ in notes:
+        held = open_ties.pop((pitch, offset), None)
+        if held is not None:
+            held[1] = offset + duration
+            held[3] = tied
+        else:
+            held = [offset, offset + duration, pitch, tied]
+            merged.append(held)
+        if tied:
+            open_ties[(pitch, held[1])] = held
+
+    events = []
+    for onset, release, pitch, _ in merged:
+        if events and events[-1][0] == onset:
+            events[-1][2].append(pitch)
+        else:
+            events.append((onset, release, [pitch]))
+    return [(float(onset), float(release), tuple(pitches)) for onset, release, pitches in events]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python lilypond_source.py song.ly [--events]")
+        sys.exit(1)
+
+    with open(sys.argv[1], encoding='utf-8') as f:
+        source = LilyPondSource(f.read())
+
+    if '--events' in sys.argv:
+        events = note_events(source)
+        print(f"Time signature: {events['time_signature']}")
+        for track, track_events in enumerate(events['part_events'], 1):
+            print(f"Track {track}: {len(track_events)} events")
+            for onset, release, pitches in track_events:
+                print(f"  {onset:7.2f} {release:7.2f}  {' '.join(str(pitch) for pitch in pitches)}")
+        return
+
+    source_map = build_source_map(source)
+
+    for voice, voice_notes in source_map.notes.items():
+        print(f"{voice}: {len(voice_notes)} notes")
+        for note in voice_notes:
+            print(f"  {float(note.offset):7.2f}  {note.pitch:3d}{'~' if note.tied else ' '} "
+                  f"{note.section} line {note.line}, column {note.column}")
+
+
+if __name__ == "__main__":
+    main()
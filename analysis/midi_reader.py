@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Lightweight Standard MIDI File reader
+Turns the small, regular MIDI files LilyPond writes into compact note-event
+arrays plus a list of meta events, without going through music21
+"""
+
+import math
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+# One row per note: onset and duration in ticks, MIDI pitch, source track
+NOTE_DTYPE = np.dtype([
+    ('onset', np.int64),
+    ('duration', np.int64),
+    ('pitch', np.int16),
+    ('track', np.int16)
+])
+
+# music21's default MIDI quantization grid: sixteenths and eighth-note triplets
+QUARTER_LENGTH_DIVISORS = (4, 3)
+
+# kind is one of 'tempo', 'time_signature', 'key_signature', 'track_name'
+MetaEvent = namedtuple('MetaEvent', ['tick', 'track', 'kind', 'value'])
+
+TimeSignature = namedtuple('TimeSignature', ['numerator', 'denominator'])
+KeySignature = namedtuple('KeySignature', ['sharps', 'mode'])
+
+
+class MidiReadError(Exception):
+    """Raised when a file is not a Standard MIDI File this reader understands"""
+
+
+class MidiData:
+    """Parsed contents of a Standard MIDI File"""
+
+    def __init__(self, ticks_per_quarter, notes, meta):
+        self.ticks_per_quarter = ticks_per_quarter
+        self.notes = notes  # Structured array with NOTE_DTYPE, sorted by track then onset
+        self.meta = meta    # List of MetaEvent, sorted by tick
+
+    def note_tracks(self):
+        """Track numbers that contain notes, in file order (one per voice)"""
+        return [int(track) for track in np.unique(self.notes['track'])]
+
+    def track_notes(self, track):
+        """Notes belonging to one track"""
+        return self.notes[self.notes['track'] == track]
+
+    def meta_events(self, kind):
+        """Meta events of a given kind, in time order"""
+        return [event for event in self.meta if event.kind == kind]
+
+    def part_events(self, track, divisors=QUARTER_LENGTH_DIVISORS):
+        """(onset, release, pitches) tuples in quarter lengths for one track
+
+        Notes starting together become one chord, and offsets and durations
+        are snapped to the grid the same way music21's MIDI import does, so
+        results line up with the music21 path.
+        """
+        track_notes = self.track_notes(track)
+        tpq = self.ticks_per_quarter
+
+        # Group simultaneous notes into chords, keeping file order
+        chords = []
+        for row in track_notes:
+            onset = int(row['onset'])
+            if chords and chords[-1][0] == onset:
+                chords[-1][2].append(int(row['pitch']))
+            else:
+                chords.append((onset, int(row['duration']), [int(row['pitch'])]))
+
+        offsets = [quantize(onset / tpq, divisors) for onset, _, _ in chords]
+
+        events = []
+        for i, (onset, duration, pitches) in enumerate(chords):
+            # Durations may stretch to fill the gap before the next note
+            gap = offsets[i + 1] - offsets[i] if i + 1 < len(chords) else None
+            quarter_length = quantize(duration / tpq, divisors, zero_allowed=False, gap=gap)
+            events.append((offsets[i], offsets[i] + quarter_length, tuple(pitches)))
+
+        return events
+
+    def total_ticks(self):
+        """Tick at which the last note ends"""
+        if not len(self.notes):
+            return 0
+        return int((self.notes['onset'] + self.notes['duration']).max())
+
+
+def nearest_multiple(value, unit):
+    """Nearest multiple of unit to value, rounding halfway cases down"""
+    match_low = unit * math.floor(value / unit)
+    if value <= match_low + unit / 2.0:
+        return match_low
+    return match_low + unit
+
+
+def quantize(value, divisors, zero_allowed=True, gap=None):
+    """Snap a quarter length to the best grid among 1/divisor units
+
+    Prefers the grid that exactly fills `gap` (distance to the next note),
+    then the smallest error, then the finer grid - as music21 does.
+    """
+    candidates = []
+    for divisor in divisors:
+        unit = 1 / divisor
+        match = nearest_multiple(value, unit)
+        if not zero_allowed and match == 0.0:
+            match = unit
+        error = abs(round(value - match, 7))
+        if gap is None or gap % unit == 0:
+            remaining_gap = 0.0
+        else:
+            remaining_gap = max(gap - match, 0.0)
+        candidates.append((remaining_gap, error, unit, match))
+    return min(candidates)[3]
+
+
+def read_variable_length(data, pos):
+    """Read a MIDI variable-length quantity, returning (value, new position)"""
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def parse_meta_event(meta_type, payload):
+    """Decode the meta events the analyzer cares about; None for everything else"""
+    if meta_type == 0x51 and len(payload) == 3:
+        return 'tempo', int.from_bytes(payload, 'big')  # Microseconds per quarter note
+    if meta_type == 0x58 and len(payload) >= 2:
+        return 'time_signature', TimeSignature(payload[0], 2 ** payload[1])
+    if meta_type == 0x59 and len(payload) == 2:
+        sharps = struct.unpack('b', payload[:1])[0]
+        return 'key_signature', KeySignature(sharps, 'minor' if payload[1] else 'major')
+    if meta_type == 0x03:
+        return 'track_name', payload.decode('utf-8', errors='replace')
+    return None
+
+
+def read_track(data, track_num, notes, meta):
+    """Parse one MTrk chunk body, appending note rows and meta events"""
+    pos = 0
+    tick = 0
+    status = None
+    open_notes = {}  # (channel, pitch) -> list of (onset tick, order)
+    order = 0
+
+    while pos < len(data):
+        delta, pos = read_variable_length(data, pos)
+        tick += delta
+
+        if data[pos] & 0x80:
+            status = data[pos]
+            pos += 1
+        elif status is None:
+            raise MidiReadError(f"Running status without a previous status byte in track {track_num}")
+
+        if status == 0xFF:
+            meta_type = data[pos]
+            length, pos = read_variable_length(data, pos + 1)
+            payload = data[pos:pos + length]
+            pos += length
+            if meta_type == 0x2F:  # End of track
+                break
+            decoded = parse_meta_event(meta_type, payload)
+            if decoded:
+                meta.append(MetaEvent(tick, track_num, decoded[0], decoded[1]))
+            status = None  # Meta events cancel running status
+            continue
+
+        if status in (0xF0, 0xF7):  # SysEx
+            length, pos = read_variable_length(data, pos)
+            pos += length
+            status = None
+            continue
+
+        kind = status & 0xF0
+        channel = status & 0x0F
+        if kind in (0xC0, 0xD0):
+            pos += 1
+            continue
+
+        pitch, velocity = data[pos], data[pos + 1]
+        pos += 2
+
+        if kind == 0x90 and velocity > 0:
+            open_notes.setdefault((channel, pitch), []).append((tick, order))
+            order += 1
+        elif kind == 0x80 or kind == 0x90:
+            pending = open_notes.get((channel, pitch))
+            if pending:
+                onset, note_order = pending.pop(0)
+                notes.append((onset, tick - onset, pitch, track_num, note_order))
+
+    # Notes never switched off run to the end of the track
+    for (channel, pitch), pending in open_notes.items():
+        for onset, note_order in pending:
+            notes.append((onset, tick - onset, pitch, track_num, note_order))
+
+
+def read_midi(path):
+    """Read a Standard MIDI File into a MidiData"""
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:4] != b'MThd':
+        raise MidiReadError(f"{path} is not a Standard MIDI File")
+
+    header_length = struct.unpack('>I', data[4:8])[0]
+    file_format, track_count, division = struct.unpack('>HHH', data[8:14])
+    if division & 0x8000:
+        raise MidiReadError("SMPTE time division is not supported")
+    if file_format not in (0, 1):
+        raise MidiReadError(f"MIDI format {file_format} is not supported")
+
+    pos = 8 + header_length
+    raw_notes = []
+    meta = []
+
+    for track_num in range(track_count):
+        if data[pos:pos + 4] != b'MTrk':
+            raise MidiReadError(f"Missing track chunk {track_num} in {path}")
+        length = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        try:
+            read_track(data[pos + 8:pos + 8 + length], track_num, raw_notes, meta)
+        except IndexError:
+            raise MidiReadError(f"Truncated track chunk {track_num} in {path}")
+        pos += 8 + length
+
+    # Sort by track, onset, then note-on order so chords keep their file order
+    raw_notes.sort(key=lambda note: (note[3], note[0], note[4]))
+    notes = np.array([note[:4] for note in raw_notes], dtype=NOTE_DTYPE)
+    meta.sort(key=lambda event: (event.tick, event.track))
+
+    return MidiData(division, notes, meta)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Note interval index for fast "what sounds at time t" lookups
+Built once per part so beat-by-beat queries don't walk the stream each time
+"""
+
+from bisect import bisect_right
+
+
+class PartIndex:
+    """Sorted onset/release arrays for a single part (voice)"""
+
+    def __init__(self, events):
+        """Build index from (onset, release, pitches) tuples in stream order"""
+        events = sorted(events, key=lambda event: event[0])  # stable: keeps stream order on ties
+
+        self.onsets = [event[0] for event in events]
+        self.releases = [event[1] for event in events]
+        self.pitches = [event[2] for event in events]
+        self.query_count = 0  # sounding_indices calls, for --profile
+
+        # Running maximum of releases lets us bisect for the first note that
+        # could still be sounding, even if notes in the part overlap
+        self.max_release = []
+        running_max = float('-inf')
+        for release in self.releases:
+            running_max = max(running_max, release)
+            self.max_release.append(running_max)
+
+    @classmethod
+    def from_part(cls, part):
+        """Index the notes and chords of a music21 part (pitches as MIDI numbers)"""
+        events = []
+        for element in part.flat.notes:
+            onset = float(element.offset)
+            release = onset + float(element.quarterLength)
+            events.append((onset, release, tuple(p.midi for p in element.pitches)))
+        return cls(events)
+
+    def __len__(self):
+        return len(self.onsets)
+
+    def sounding_indices(self, start, end=None):
+        """Return indices of notes overlapping [start, end] in stream order
+
+        Matches music21's getElementsByOffset(start, end,
+        includeElementsThatEndAtStart=False, mustFinishInSpan=False,
+        mustBeginInSpan=False): a note counts if it begins at or before
+        `end` and is still sounding after `start`.
+        """
+        if end is None:
+            end = start
+        self.query_count += 1
+
+        hi = bisect_right(self.onsets, end)
+        lo = bisect_right(self.max_release, start, 0, hi)
+
+        return [i for i in range(lo, hi) if self.releases[i] > start]
+
+    def sounding(self, start, end=None):
+        """Return pitch tuples of notes overlapping [start, end] in stream order"""
+        return [self.pitches[i] for i in self.sounding_indices(start, end)]
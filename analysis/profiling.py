@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Stage timing and hot-path counters for analyzer runs (--profile)
+SacredHarpAnalyzer wraps each stage of a run in `self.stage(name)`; with no
+Profiler attached that is a shared no-op context, so profiling can stay
+available in watch mode at no real cost. A Profiler adds up each stage's
+exclusive wall time (time in nested stages is not counted twice) and
+named counters, and after each run prints a summary block and optionally
+writes a cProfile/pstats dump or a Chrome trace-event JSON file.
+"""
+
+import json
+import os
+import sys
+import time
+
+
+class Stage:
+    """One timed occurrence of a stage (a context manager)"""
+
+    __slots__ = ('profiler', 'name', 'start', 'nested')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.profiler.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler.stack.pop()
+        profiler.seconds[self.name] = profiler.seconds.get(self.name, 0.0) + elapsed - self.nested
+        if profiler.stack:
+            profiler.stack[-1].nested += elapsed
+        if profiler.trace_events is not None:
+            profiler.trace_events.append((self.name, self.start, elapsed))
+        return False
+
+
+class Profiler:
+    """Per-run stage times and counters, plus optional pstats or Chrome trace output
+
+    output: None for the summary only, a path ending in .json for a Chrome
+    trace (chrome://tracing, Perfetto), or any other path for a pstats dump.
+    Each run overwrites it.
+    """
+
+    def __init__(self, output=None, stream=sys.stderr):
+        self.output = output
+        self.stream = stream
+        self.cprofile = None
+        self.reset()
+
+    @property
+    def tracing(self):
+        return bool(self.output) and self.output.endswith('.json')
+
+    def reset(self):
+        self.seconds = {}  # stage -> exclusive seconds, in the order stages first ran
+        self.counters = {}
+        self.stack = []
+        self.origin = time.perf_counter()
+        self.trace_events = [] if self.tracing else None
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def start_run(self):
+        """Start cProfile for a run, when writing pstats"""
+        if self.output and not self.tracing:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def finish_run(self, label=''):
+        """Report the run, write the output file and start afresh; returns the report dict
+
+        The report has 'seconds' (exclusive per stage, with the time in no
+        stage of its own as 'other' and the sum as 'total') and 'counters'.
+        """
+        if self.cprofile:
+            self.cprofile.disable()
+
+        seconds = dict(self.seconds)
+        seconds['other'] = seconds.pop('run', 0.0)
+        seconds['total'] = sum(seconds.values())
+        report = {'seconds': seconds, 'counters': dict(self.counters)}
+
+        if self.stream:
+            self.stream.write('\n'.join(self.summary_lines(report, label)) + '\n')
+        if self.cprofile:
+            self.cprofile.dump_stats(self.output)
+            self.cprofile = None
+        elif self.tracing:
+            self.write_trace()
+
+        self.reset()
+        return report
+
+    def summary_lines(self, report, label=''):
+        seconds = report['seconds']
+        total = seconds['total']
+        lines = [f"PROFILE{' ' + label if label else ''}: {total * 1000:.1f} ms"]
+        for stage, stage_seconds in seconds.items():
+            if stage == 'total':
+                continue
+            share = stage_seconds / total if total else 0.0
+            lines.append(f"  {stage:<26} {stage_seconds * 1000:9.2f} ms {share:6.1%}")
+        if report['counters']:
+            lines.append("  " + ", ".join(f"{name.replace('_', ' ')} {value}"
+                                          for name, value in report['counters'].items()))
+        if self.output:
+            lines.append(f"  {'trace' if self.tracing else 'pstats'} written to {self.output}")
+        return lines
+
+    def write_trace(self):
+        """Chrome trace-event JSON: one complete ('X') event per stage occurrence, counters at the end"""
+        pid = os.getpid()
+        events = [{'name': name, 'cat': 'analysis', 'ph': 'X', 'pid': pid, 'tid': 0,
+                   'ts': (start - self.origin) * 1e6, 'dur': elapsed * 1e6}
+                  for name, start, elapsed in self.trace_events]
+        end = max((event['ts'] + event['dur'] for event in events), default=0)
+        events.append({'name': 'counters', 'ph': 'C', 'pid': pid, 'tid': 0, 'ts': end,
+                       'args': self.counters})
+        with open(self.output, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Multi-pattern matcher for chord progressions
+Patterns (sequences of Roman numerals) are read from a library file and
+compiled once into an Aho-Corasick automaton over whole tokens. A
+progression is then scanned in one linear pass that finds every occurrence
+of every pattern, with its position; since tokens are compared whole, "I"
+never matches inside "vii°".
+
+The library format is described in progression_patterns.txt.
+
+Usage: python progression_matcher.py I vi V I IV V I
+"""
+
+import os
+import sys
+from collections import deque, namedtuple
+
+DEFAULT_LIBRARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'progression_patterns.txt')
+
+PATTERN_KINDS = ('good', 'forbidden')
+PATTERN_MODES = ('major', 'minor', 'any')
+
+# line is the pattern's line number in the library, for error messages
+Pattern = namedtuple('Pattern', ['kind', 'mode', 'tokens', 'line'])
+
+# start/end are token indexes into the progression (end exclusive)
+Match = namedtuple('Match', ['pattern', 'start', 'end'])
+
+
+def load_patterns(path=DEFAULT_LIBRARY):
+    """Patterns of a library file, in file order; raises ValueError on a malformed line"""
+    patterns = []
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) < 3 or fields[0] not in PATTERN_KINDS or fields[1] not in PATTERN_MODES:
+                raise ValueError(f"{path}:{line_number}: expected KIND MODE NUMERAL..., "
+                                 f"KIND one of {'/'.join(PATTERN_KINDS)} and MODE one of {'/'.join(PATTERN_MODES)}")
+            patterns.append(Pattern(fields[0], fields[1], tuple(fields[2:]), line_number))
+    return patterns
+
+
+class ProgressionMatcher:
+    """Aho-Corasick automaton over Roman-numeral tokens"""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+
+        # Trie: per state, token -> next state, plus the patterns ending there
+        self.transitions = [{}]
+        self.outputs = [[]]
+        for number, pattern in enumerate(self.patterns):
+            state = 0
+            for token in pattern.tokens:
+                if token not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.outputs.append([])
+                    self.transitions[state][token] = len(self.transitions) - 1
+                state = self.transitions[state][token]
+            self.outputs[state].append(number)
+
+        # Failure links, breadth-first; each state also reports its fallbacks' patterns
+        self.failures = [0] * len(self.transitions)
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, child in self.transitions[state].items():
+                fallback = self.failures[state]
+                while fallback and token not in self.transitions[fallback]:
+                    fallback = self.failures[fallback]
+                self.failures[child] = self.transitions[fallback].get(token, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.failures[child]]
+                queue.append(child)
+
+    def find(self, tokens, mode=None):
+        """Every occurrence of every pattern in tokens, ordered by end position
+
+        With a mode, patterns for the other mode are skipped ('any' always applies).
+        """
+        matches = []
+        state = 0
+        for position, token in enumerate(tokens):
+            while state and token not in self.transitions[state]:
+                state = self.failures[state]
+            state = self.transitions[state].get(token, 0)
+            for number in self.outputs[state]:
+                pattern = self.patterns[number]
+                if mode is None or pattern.mode in ('any', mode):
+                    matches.append(Match(pattern, position + 1 - len(pattern.tokens), position + 1))
+        return matches
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python progression_matcher.py NUMERAL NUMERAL ...")
+        sys.exit(1)
+
+    tokens = sys.argv[1:]
+    for match in ProgressionMatcher(load_patterns()).find(tokens):
+        print(f"{match.pattern.kind:>9} {match.pattern.mode:<5} chords {match.start + 1}-{match.end}: "
+              f"{' - '.join(match.pattern.tokens)}")
+
+
+if __name__ == "__main__":
+    main()
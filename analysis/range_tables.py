@@ -0,0 +1,60 @@
+"""
+Sacred Harp vocal ranges (MIDI note numbers), loaded by sacred_harp_analyzer.py
+Generated by `analyze_ranges.py --write-table CORPUS`; regenerate it rather
+than editing it by hand.
+
+absolute_low/high are the extremes found in the repertoire, percentile_10/90
+the limits outside which a note is warned about, sweet_spot_low/high the
+25th-75th percentile comfort zone and average the mean pitch. critical_low
+(bass only) is the fixed hard floor: anything at or below it is too low to sing.
+"""
+
+RANGE_TABLE_VERSION = 1
+
+# Corpus the table was computed from
+RANGE_TABLE_SOURCE = {
+    'corpus': 'shapenote.net: Sacred Harp, Christian Harmony and Southern Harmony',
+    'songs': 12,
+    'notes': 3074,
+    'weighting': 'notes',
+}
+
+SACRED_HARP_RANGES = {
+    'treble': {
+        'absolute_low': 63,       # D#4
+        'absolute_high': 79,      # G5
+        'percentile_10': 68,      # G#4
+        'percentile_90': 76,      # E5
+        'sweet_spot_low': 70,     # A#4
+        'sweet_spot_high': 74,    # D5
+        'average': 72,            # C5
+    },
+    'alto': {
+        'absolute_low': 58,       # A#3
+        'absolute_high': 79,      # G5
+        'percentile_10': 63,      # D#4
+        'percentile_90': 71,      # B4
+        'sweet_spot_low': 65,     # F4
+        'sweet_spot_high': 69,    # A4
+        'average': 67,            # G4
+    },
+    'tenor': {
+        'absolute_low': 62,       # D4
+        'absolute_high': 81,      # A5
+        'percentile_10': 66,      # F#4
+        'percentile_90': 76,      # E5
+        'sweet_spot_low': 68,     # G#4
+        'sweet_spot_high': 74,    # D5
+        'average': 71,            # B4
+    },
+    'bass': {
+        'absolute_low': 43,       # G2
+        'absolute_high': 60,      # C4
+        'critical_low': 43,       # G2
+        'percentile_10': 47,      # B2
+        'percentile_90': 57,      # A3
+        'sweet_spot_low': 50,     # D3
+        'sweet_spot_high': 55,    # G3
+        'average': 52,            # E3
+    },
+}
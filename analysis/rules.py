@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Single-pass rule engine for the analyzer's checks
+Each rule is a small stateful visitor. One traversal of the piece feeds every
+registered rule its events in time order:
+
+    segment(index, record)               every chord record (harmonic segment)
+    beat(index, measure, offset, record)  every beat, with the record sounding
+                                          at it (None when nothing sounds)
+
+and finish() lets rules that look across the whole piece report at the end.
+Each returns an iterable of Diagnostics (or None). A new rule costs one call
+per event, not another pass over the piece.
+
+Rules marked per_segment only look at the record they are given, so the
+engine caches their findings per measure and only re-runs them on measures
+that changed. Such a rule can cache something other than the Diagnostic and
+build it in present(), which runs each time a finding is logged, cached or not.
+
+To add a check, subclass Rule in this module and decorate it with
+@register_rule; findings are logged in registration order.
+"""
+
+# Registered rule classes, in the order their findings are logged
+RULES = []
+
+
+def register_rule(rule_class):
+    """Class decorator adding a rule to RULES"""
+    RULES.append(rule_class)
+    return rule_class
+
+
+class Rule:
+    """Base class: override the events the rule needs"""
+
+    name = None
+    per_segment = False  # Findings depend only on the segment (cached per measure)
+    message_prefix = ''  # Prepended to each finding's message when logged
+
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+
+    def start(self, previous, changed):
+        """Called before the traversal with the state() this rule returned on the
+        previous run (None if there is none, or it no longer applies) and the set
+        of measure numbers that changed since then (None: treat everything as new)"""
+
+    def segment(self, index, record):
+        return ()
+
+    def beat(self, index, measure, offset, record):
+        return ()
+
+    def finish(self):
+        return ()
+
+    def state(self):
+        """Anything to hand back to start() on the next run (must pickle)"""
+        return None
+
+    def present(self, finding):
+        """The Diagnostic logged for a finding returned by segment() (per_segment rules only)"""
+        return finding
+
+
+class RuleEngine:
+    """Drives a set of rules over the chord records and beats of a piece"""
+
+    def __init__(self, analyzer, rule_classes=None):
+        self.analyzer = analyzer
+        self.rules = [rule_class(analyzer) for rule_class in (RULES if rule_classes is None else rule_classes)]
+
+    def stream(self, measures, beats, changed=None, previous=None):
+        """(rule, Diagnostic) for every finding, as soon as the traversal reaches it
+
+        measures: {measure number: {'records': [...], ...}} in order. Findings of
+        per_segment rules are cached in each measure's 'findings' and reused
+        unless the measure is in `changed` (None: redo everything); reused ones
+        are yielded when the traversal reaches their measure.
+        beats: (measure number, offset) of every beat, in order.
+        previous: {rule name: state} from the last run.
+
+        Each rule's findings come in order, but different rules' findings are
+        interleaved. Once it is exhausted, states() has each rule's state.
+        """
+        previous = previous or {}
+        for rule in self.rules:
+            rule.start(previous.get(rule.name), changed)
+        for measure in measures.values():
+            measure.setdefault('findings', {})
+
+        yield from self.traverse(self.rules, measures, beats, changed, self.analyzer.profiler is not None)
+
+    def states(self):
+        """{rule name: state} after a traversal"""
+        return {rule.name: rule.state() for rule in self.rules}
+
+    def traverse(self, rules, measures, beats, changed, timed):
+        """One pass over measures and beats, feeding `rules`; yields (rule, Diagnostic)
+
+        Per-segment findings are only stored in the measures once the pass is
+        complete, so an abandoned pass leaves the cache as it was. With `timed`,
+        each rule's calls are profiled as a stage named after it.
+        """
+        stage = self.analyzer.stage
+        streaming = [rule for rule in rules if not rule.per_segment]
+
+        def call(rule, method, *args):
+            if timed:
+                with stage(rule.name):
+                    return getattr(rule, method)(*args) or ()
+            return getattr(rule, method)(*args) or ()
+
+        records = []
+        fresh = {}  # measure number -> {per-segment rule name: findings} to redo there
+        for measure_num, measure in measures.items():
+            cached = measure['findings']
+            fresh[measure_num] = {rule.name: [] for rule in rules if rule.per_segment and
+                                  (changed is None or measure_num in changed or rule.name not in cached)}
+            records.extend(measure['records'])
+
+        def visit_segment(index):
+            record = records[index]
+            measure_num = record['measure']
+            redo = fresh[measure_num]
+            if index == 0 or records[index - 1]['measure'] != measure_num:
+                for rule in rules:
+                    if rule.per_segment and rule.name not in redo:
+                        for finding in measures[measure_num]['findings'][rule.name]:
+                            yield rule, rule.present(finding)
+            for rule in rules:
+                if rule.per_segment and rule.name in redo:
+                    for finding in call(rule, 'segment', index, record):
+                        redo[rule.name].append(finding)
+                        yield rule, rule.present(finding)
+            for rule in streaming:
+                for finding in call(rule, 'segment', index, record):
+                    yield rule, finding
+
+        # Segments starting at or before a beat are visited before it
+        next_segment = 0
+        for beat_index, (measure_num, offset) in enumerate(beats):
+            while next_segment < len(records) and records[next_segment]['offset'] <= offset:
+                yield from visit_segment(next_segment)
+                next_segment += 1
+            sounding = records[next_segment - 1] if next_segment else None
+            if sounding is not None and offset >= sounding['end']:
+                sounding = None
+            for rule in streaming:
+                for finding in call(rule, 'beat', beat_index, measure_num, offset, sounding):
+                    yield rule, finding
+        while next_segment < len(records):
+            yield from visit_segment(next_segment)
+            next_segment += 1
+
+        for rule in streaming:
+            for finding in call(rule, 'finish'):
+                yield rule, finding
+
+        for measure_num, redo in fresh.items():
+            measures[measure_num]['findings'].update(redo)
+
+
+@register_rule
+class ChordRule(Rule):
+    """Forbidden, rare and unknown chords"""
+
+    name = 'chords'
+    per_segment = True
+
+    def segment(self, index, record):
+        entry = self.analyzer.chord_log_entry(record)
+        return (entry,) if entry else ()
+
+
+@register_rule
+class VoiceLeadingRule(Rule):
+    """Adjacent-degree dissonance and bass/tenor crossings"""
+
+    name = 'voice_leading'
+    per_segment = True
+    message_prefix = 'VOICE LEADING WARNING: '
+
+    def segment(self, index, record):
+        return self.analyzer.check_beat_voice_leading(record)
+
+
+@register_rule
+class RangeRule(Rule):
+    """Critical and extreme notes for each voice
+
+    Where each note is written in the LilyPond source is looked up when the
+    finding is logged, so cached findings survive edits that move notes around.
+    """
+
+    name = 'ranges'
+    per_segment = True
+    message_prefix = 'VOICE LEADING WARNING: '
+
+    def segment(self, index, record):
+        return self.analyzer.check_beat_ranges(record)
+
+    def present(self, finding):
+        return self.analyzer.locate_range_warning(finding)
+
+
+@register_rule
+class VocalFatigueRule(Rule):
+    """Sustained singing near the top or bottom of a voice's range, in beat windows
+
+    Collects the beat grid during the traversal and evaluates every window at
+    the end with fatigue.py; windows untouched by changed measures are reused.
+    """
+
+    name = 'vocal_fatigue'
+    message_prefix = 'VOICE LEADING WARNING: '
+
+    def start(self, previous, changed):
+        self.previous = previous
+        self.changed = changed
+        self.grid = []
+        self.candidates = None
+
+    def beat(self, index, measure, offset, record):
+        self.grid.append((measure, offset, record))
+
+    def finish(self):
+        dirty_beats = [i for i, (measure, _, _) in enumerate(self.grid)
+                       if self.changed is None or measure in self.changed]
+        previous = self.previous if self.changed is not None else None
+        self.candidates = self.analyzer.vocal_fatigue_candidates(self.grid, previous, dirty_beats)
+        return self.analyzer.check_vocal_fatigue(self.candidates)
+
+    def state(self):
+        return self.candidates
+
+
+@register_rule
+class ContraryMotionRule(Rule):
+    """Too much parallel treble/tenor motion over the piece"""
+
+    name = 'contrary_motion'
+    message_prefix = 'VOICE LEADING WARNING: '
+
+    def start(self, previous, changed):
+        self.records = []
+        self.transitions = []
+
+    def segment(self, index, record):
+        if self.records:
+            self.transitions.append(self.analyzer.motion_between(self.records[-1], record))
+        else:
+            self.transitions.append(None)
+        self.records.append(record)
+
+    def finish(self):
+        return self.analyzer.check_contrary_motion(self.records, self.transitions)
+
+
+@register_rule
+class ProgressionRule(Rule):
+    """Good and forbidden progressions from the pattern library"""
+
+    name = 'progression'
+
+    def start(self, previous, changed):
+        self.progression = []
+
+    def segment(self, index, record):
+        if record['roman'] != 'Unknown':
+            self.progression.append(record)
+
+    def finish(self):
+        if len(self.progression) > 1:
+            return self.analyzer.analyze_progression(self.progression)
+        return ()
@@ -4,15 +4,34 @@ Sacred Harp Chord Analyzer
 Analyzes MIDI files from LilyPond compilation for Sacred Harp harmonic compliance
 Based on chord rules documented in CLAUDE.md
 
-Requirements: pip install music21
+Reads MIDI with a built-in Standard MIDI File parser; music21 is only
+needed for the optional fallback path (pip install music21)
+
+Heavy modules (numpy, midi_reader, fatigue, music21) are imported inside
+the methods that need them, so --help and importing the rule/range tables
+stay fast. tests/test_startup.py holds the startup-time budget.
+
+Parsed notes and finished results are cached on disk by content hash
+(see analysis_cache.py), so re-analyzing an unchanged song is nearly free.
 """
 
-import music21
 import sys
 import os
 from datetime import datetime
-from pathlib import Path
-from collections import Counter
+import math
+from bisect import bisect_right
+from contextlib import nullcontext
+from note_index import PartIndex
+from harmonic_segments import harmonic_segments
+from analysis_cache import AnalysisCache, file_digest, fingerprint, source_fingerprint
+from diagnostics import SEVERITIES, Diagnostic, at_least, info, make_sink
+from key_analysis import (PITCH_CLASS_NAMES, estimate_key, key_from_lilypond,
+                          key_from_signature, pitch_class_from_name)
+from chord_table import ChordEntry, ChordTable, mask_pitch_classes, pitch_class_mask
+from progression_matcher import ProgressionMatcher, load_patterns
+# Vocal ranges (MIDI note numbers), generated from MusicXML repertoire data
+# by analyze_ranges.py --write-table
+from range_tables import SACRED_HARP_RANGES
 
 # Sacred Harp chord rules extracted from CLAUDE.md
 SACRED_HARP_RULES = {
@@ -30,58 +49,8 @@ SACRED_HARP_RULES = {
     }
 }
 
-# Common Sacred Harp progressions
-GOOD_PROGRESSIONS = [
-    ['I', 'vi', 'V', 'I'],
-    ['I', 'IV', 'V', 'I'],
-    ['I', 'vi', 'ii', 'V', 'I'],
-    ['i', 'VII', 'III', 'i'],
-    ['i', 'iv', 'v', 'i'],
-    ['i', 'VII', 'iv', 'i']
-]
-
-# Sacred Harp vocal ranges (MIDI note numbers)
-# Based on analysis of actual Sacred Harp MusicXML files (12 songs, 3074 notes)
-# Includes Sacred Harp, Christian Harmony, and Southern Harmony repertoire
-SACRED_HARP_RANGES = {
-    'treble': {
-        'absolute_low': 63,      # D#4 - absolute minimum found in repertoire
-        'absolute_high': 79,     # G5 - absolute maximum found in repertoire
-        'percentile_10': 68,     # G#4 - 10th percentile (avoid below this)
-        'percentile_90': 76,     # E5 - 90th percentile (avoid above this)
-        'sweet_spot_low': 70,    # A#4 - 25th percentile (comfortable low)
-        'sweet_spot_high': 74,   # D5 - 75th percentile (comfortable high)
-        'average': 72            # C5 - statistical average pitch
-    },
-    'alto': {
-        'absolute_low': 58,      # A#3 - absolute minimum found in repertoire
-        'absolute_high': 79,     # G5 - absolute maximum found in repertoire (21 semitone span!)
-        'percentile_10': 63,     # D#4 - 10th percentile (avoid below this)
-        'percentile_90': 71,     # B4 - 90th percentile (avoid above this)
-        'sweet_spot_low': 65,    # F4 - 25th percentile (comfortable low)
-        'sweet_spot_high': 69,   # A4 - 75th percentile (comfortable high)
-        'average': 67            # G4 - statistical average pitch
-    },
-    'tenor': {
-        'absolute_low': 62,      # D4 - absolute minimum found in repertoire
-        'absolute_high': 81,     # A5 - absolute maximum found in repertoire
-        'percentile_10': 66,     # F#4 - 10th percentile (avoid below this)
-        'percentile_90': 76,     # E5 - 90th percentile (avoid above this)
-        'sweet_spot_low': 68,    # G#4 - 25th percentile (comfortable low)
-        'sweet_spot_high': 74,   # D5 - 75th percentile (comfortable high)
-        'average': 71            # B4 - statistical average pitch
-    },
-    'bass': {
-        'absolute_low': 43,      # G2 - absolute minimum found in repertoire
-        'absolute_high': 60,     # C4 - absolute maximum found in repertoire
-        'critical_low': 43,      # G2 - NEVER go below this (too low to sing)
-        'percentile_10': 47,     # B2 - 10th percentile (avoid below this)
-        'percentile_90': 57,     # A3 - 90th percentile (avoid above this)
-        'sweet_spot_low': 50,    # D3 - 25th percentile (comfortable low)
-        'sweet_spot_high': 55,   # G3 - 75th percentile (comfortable high)
-        'average': 52            # E3 - statistical average pitch
-    }
-}
+# Good and forbidden progressions, from the pattern library progression_patterns.txt
+PROGRESSION_PATTERNS = load_patterns()
 
 # Major scale degrees (C major for analysis)
 MAJOR_SCALE_DEGREES = {
@@ -115,29 +84,205 @@ MINOR_ROMAN_NUMERALS = {
     1: 'i', 2: 'ii°', 3: 'III', 4: 'iv', 5: 'v', 6: 'VI', 7: 'VII'
 }
 
+def midi_to_note_name(midi):
+    """Convert MIDI number to note name with octave (e.g. E-4)"""
+    return f"{PITCH_CLASS_NAMES[midi % 12]}{midi // 12 - 1}"
+
+def chord_root_and_roman(scale_degrees, mode):
+    """Determine chord root and Roman numeral from sorted scale degrees"""
+    if not scale_degrees:
+        return None, "Unknown"
+    
+    # Check for common Sacred Harp chord patterns
+    scale_set = set(scale_degrees)
+    
+    # Perfect matches first
+    if scale_set == {1, 3, 5}:  # do mi sol
+        return 1, 'I'
+    elif scale_set == {6, 1, 3}:  # la do mi  
+        return 6, 'vi'
+    elif scale_set == {5, 7, 2}:  # sol si re
+        return 5, 'V'
+    elif scale_set == {4, 6, 1}:  # fa la do
+        return 4, 'IV'
+    elif scale_set == {2, 4, 6}:  # re fa la
+        return 2, 'ii'
+    elif scale_set == {3, 5, 7}:  # mi sol si
+        return 3, 'iii'
+    elif scale_set == {7, 2, 4}:  # si re fa
+        return 7, 'vii°'
+    
+    # Handle incomplete chords (dyads - common in Sacred Harp)
+    elif scale_set == {1, 5}:  # do sol (I chord without third)
+        return 1, 'I'
+    elif scale_set == {1, 3}:  # do mi (I chord without fifth)  
+        return 1, 'I'
+    elif scale_set == {6, 3}:  # la mi (vi chord incomplete)
+        return 6, 'vi'
+    elif scale_set == {5, 7}:  # sol si (V chord without third)
+        return 5, 'V'
+    elif scale_set == {5, 2}:  # sol re (V chord without third)
+        return 5, 'V'
+    
+    # Single notes - assume root of chord
+    elif len(scale_degrees) == 1:
+        degree = scale_degrees[0]
+        if mode == 'major':
+            return degree, MAJOR_ROMAN_NUMERALS.get(degree, f"?{degree}")
+        else:
+            return degree, MINOR_ROMAN_NUMERALS.get(degree, f"?{degree}")
+    
+    # Complex chords - try to find root by lowest note
+    else:
+        root_degree = min(scale_degrees)
+        if mode == 'major':
+            return root_degree, MAJOR_ROMAN_NUMERALS.get(root_degree, f"?{root_degree}")
+        else:
+            return root_degree, MINOR_ROMAN_NUMERALS.get(root_degree, f"?{root_degree}")
+
+def assess_chord_in_mode(roman_numeral, mode):
+    """Assess chord against Sacred Harp rules"""
+    rules = SACRED_HARP_RULES.get(mode, SACRED_HARP_RULES['major'])
+    
+    if roman_numeral in rules['forbidden']:
+        return {'status': 'FORBIDDEN', 'message': f'{roman_numeral} chord FORBIDDEN in Sacred Harp style'}
+    elif roman_numeral in rules['common']:
+        return {'status': 'GOOD', 'message': f'{roman_numeral} chord - excellent choice for Sacred Harp'}
+    elif roman_numeral in rules['quite_common']:
+        return {'status': 'OK', 'message': f'{roman_numeral} chord - good Sacred Harp choice'}
+    elif roman_numeral in rules['rare']:
+        return {'status': 'WARNING', 'message': f'{roman_numeral} chord - use sparingly in Sacred Harp'}
+    else:
+        return {'status': 'UNKNOWN', 'message': f'{roman_numeral} chord - check Sacred Harp style guide'}
+
+def label_chord_mask(mask, mode):
+    """ChordEntry for a tonic-relative pitch-class mask (None if nothing sounds)"""
+    if not mask:
+        return None
+    
+    # Transpose to C major for analysis (Sacred Harp solmization system)
+    scale_degrees = sorted(MAJOR_SCALE_DEGREES[interval] for interval in MAJOR_SCALE_DEGREES
+                           if mask >> interval & 1)
+    if not scale_degrees:
+        return ChordEntry(None, "Unknown", None, assess_chord_in_mode("Unknown", mode))
+    
+    chord_root, roman_numeral = chord_root_and_roman(scale_degrees, mode)
+    return ChordEntry(chord_root, roman_numeral, tuple(scale_degrees), assess_chord_in_mode(roman_numeral, mode))
+
+# mode -> ChordTable, each built on first use so --help doesn't pay for it
+CHORD_TABLES = {}
+
+def chord_table_for_mode(mode):
+    """Precomputed labels of all 4096 pitch-class sets in a mode"""
+    table = CHORD_TABLES.get(mode)
+    if table is None:
+        table = CHORD_TABLES[mode] = ChordTable(lambda mask: label_chord_mask(mask, mode))
+    return table
+
+# Automaton over PROGRESSION_PATTERNS, built on first use
+PROGRESSION_MATCHER = None
+
+def progression_matcher():
+    """The shared matcher for the progression pattern library"""
+    global PROGRESSION_MATCHER
+    if PROGRESSION_MATCHER is None:
+        PROGRESSION_MATCHER = ProgressionMatcher(PROGRESSION_PATTERNS)
+    return PROGRESSION_MATCHER
+
+# Modules whose source feeds the result-cache fingerprint
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+ANALYSIS_MODULES = ['sacred_harp_analyzer.py', 'chord_table.py', 'diagnostics.py', 'fatigue.py',
+                    'key_analysis.py', 'lilypond_source.py', 'midi_reader.py', 'note_index.py',
+                    'progression_matcher.py', 'progression_patterns.txt', 'harmonic_segments.py', 'rules.py']
+
+def rules_fingerprint():
+    """Version fingerprint of the rule/range tables and analysis code"""
+    return fingerprint(SACRED_HARP_RULES, PROGRESSION_PATTERNS, SACRED_HARP_RANGES,
+                       source_fingerprint(*(os.path.join(ANALYSIS_DIR, module) for module in ANALYSIS_MODULES)))
+
+# What SacredHarpAnalyzer.stage returns when nothing is profiling
+NO_PROFILING = nullcontext()
+
 class SacredHarpAnalyzer:
-    def __init__(self, midi_file, log_file='harmony.log', lilypond_file=None):
+    def __init__(self, midi_file, log_file='harmony.log', lilypond_file=None, use_music21=False,
+                 use_cache=True, profiler=None, fatigue_windows=None, fatigue_duration_weighted=False):
         self.midi_file = midi_file
         self.log_file = log_file
+        self.profiler = profiler  # profiling.Profiler under --profile, else None
+        self.last_profile = None  # The profiler's report on the last run
+        # Given a .ly file instead of a MIDI file, read the notes straight from
+        # the source (lilypond_source.note_events) without compiling it
+        self.from_source = midi_file.lower().endswith('.ly')
+        if self.from_source and not lilypond_file:
+            lilypond_file = midi_file
         self.lilypond_file = lilypond_file
-        self.score = None
+        self.use_music21 = use_music21  # Parse with music21 instead of the built-in reader
+        self.cache = AnalysisCache() if use_cache else None
+        self.midi_hash = None  # Content hash of the MIDI file for this run
+        self.recorded_messages = None  # Diagnostics logged by the current uncached run
+        
+        # Diagnostics are buffered and written to the sink once per run (see diagnostics.py)
+        self.diagnostics_sink = make_sink(log_file)
+        self.pending_diagnostics = []  # (timestamp, Diagnostic) not yet written
+        self.streamed_count = 0  # How many pending diagnostics iter_diagnostics has yielded
+        self.run_succeeded = None  # Whether the last run (see iter_diagnostics) succeeded
+        self.run_id = None  # Identifies one run in the log index / run database
+        
+        # State kept between runs for incremental re-analysis and change reports
+        self.previous_diagnostics = None  # First lines of the diagnostics logged by the previous run
+        self.incremental_state = None  # Per-measure results etc. (see analyze_and_log)
+        self.reanalyzed_measures = None  # (changed, total) measures when run incrementally
+        self.midi_data = None  # MidiData from the built-in reader (None on a note-cache hit)
+        self.score = None  # music21 score (fallback path only)
+        self.part_indexes = []  # One PartIndex per part, built in load_midi
+        self.total_length = 0  # Length of the piece in quarter notes
         self.key = None
         self.mode = None
-        self.key_signature = None
+        self.tonic_pitch_class = 0
+        self.key_source = None  # Where the key came from (see resolve_key)
+        self.midi_key_signature = None  # First KeySignature meta event in the MIDI file
         self.time_signature = None
         self.beats_per_measure = 4
         self.beat_duration = 1.0
         
-        # LilyPond source mapping
+        # Vocal fatigue windows: beat counts and/or fatigue.WINDOW_BARS names ('bar',
+        # 'two_bars', 'phrase'), resolved for the meter by fatigue.window_sizes_for_meter.
+        # None means fatigue.DEFAULT_WINDOW_BEATS (--fatigue-windows)
+        self.fatigue_windows = fatigue_windows
+        self.fatigue_duration_weighted = fatigue_duration_weighted  # Weight beats by sounding note length (--fatigue-weighted)
+        
+        # LilyPond source mapping and transposition tracking (see reset_lilypond_state)
+        self.reset_lilypond_state()
+        
+        # Load LilyPond source if provided
+        if self.lilypond_file:
+            self.load_lilypond_source()
+    
+    def stage(self, name):
+        """Context manager timing one stage of a run when profiling (see profiling.py)"""
+        return self.profiler.stage(name) if self.profiler else NO_PROFILING
+    
+    def count(self, name, amount=1):
+        """Add to a profiling counter (nothing when not profiling)"""
+        if self.profiler:
+            self.profiler.count(name, amount)
+    
+    def reset_lilypond_state(self):
+        """Forget everything derived from the LilyPond source"""
         self.lilypond_content = None
-        self.voice_sections = {}  # Maps voice names to their content and line numbers
-        self.section_timings = {'A': 0, 'B': 0}  # Approximate timing of A/B sections
+        self.lilypond_hash = None  # Hash of the source as loaded (part of the result cache key)
+        self.lilypond_key = None
+        self.lilypond_source = None  # Tokenized source (lilypond_source.LilyPondSource)
+        self.source_map = None  # Exact source position of every note (lilypond_source.SourceMap)
+        self.source_contexts = {}  # (line, column) -> context lines shown in warnings
         
         # Transposition tracking
         self.written_key_mode = 'major'  # Mode of written music (major/minor)
         self.transpose_semitones = 0  # Semitones to add to MIDI pitches for analysis
-        
-        # Load LilyPond source if provided
+    
+    def reload_lilypond_source(self):
+        """Re-read the LilyPond source after it changes (watch mode)"""
+        self.reset_lilypond_state()
         if self.lilypond_file:
             self.load_lilypond_source()
         
@@ -146,59 +291,24 @@ class SacredHarpAnalyzer:
         if not self.lilypond_file or not os.path.exists(self.lilypond_file):
             return
             
-        try:
-            with open(self.lilypond_file, 'r', encoding='utf-8') as f:
-                self.lilypond_content = f.readlines()
-            
-            # Parse voice sections: bassA, bassB, trebleA, etc.
-            import re
-            voice_pattern = r'^(treble|alto|tenor|bass)([AB])\s*=\s*\\relative'
-            
-            for line_num, line in enumerate(self.lilypond_content, 1):
-                match = re.match(voice_pattern, line.strip())
-                if match:
-                    voice_name = match.group(1).lower()
-                    section = match.group(2)
-                    
-                    # Find the end of this voice section
-                    section_content = []
-                    brace_count = 0
-                    found_opening_brace = False
-                    
-                    for i in range(line_num - 1, len(self.lilypond_content)):
-                        content_line = self.lilypond_content[i]
-                        section_content.append(content_line.rstrip())
-                        
-                        # Count braces to find section end
-                        for char in content_line:
-                            if char == '{':
-                                brace_count += 1
-                                found_opening_brace = True
-                            elif char == '}':
-                                brace_count -= 1
-                                if found_opening_brace and brace_count == 0:
-                                    # Found end of section
-                                    section_key = f"{voice_name}{section}"
-                                    self.voice_sections[section_key] = {
-                                        'start_line': line_num,
-                                        'end_line': i + 1,
-                                        'content': section_content,
-                                        'voice': voice_name,
-                                        'section': section
-                                    }
-                                    break
-                        
-                        if found_opening_brace and brace_count == 0:
-                            break
-            
-            # Parse key and transposition directives
-            self.parse_key_and_transposition()
-            
-            # Estimate section timings based on content
-            self.estimate_section_timings()
-            
-        except Exception as e:
-            self.log_message(f"WARNING: Could not parse LilyPond file {self.lilypond_file}: {e}")
+        with self.stage('parse'):
+            try:
+                with open(self.lilypond_file, 'r', encoding='utf-8') as f:
+                    self.lilypond_content = f.readlines()
+                self.lilypond_hash = fingerprint(''.join(self.lilypond_content))
+                
+                # Map every written note to its line and column
+                from lilypond_source import LilyPondSource, build_source_map
+                self.lilypond_source = LilyPondSource(''.join(self.lilypond_content))
+                self.source_map = build_source_map(self.lilypond_source)
+                
+                # Parse key and transposition directives
+                self.parse_key_and_transposition()
+                self.lilypond_key = key_from_lilypond(''.join(self.lilypond_content))
+                
+            except Exception as e:
+                self.log_diagnostic(Diagnostic('warning', 'lilypond.parse',
+                                               f"WARNING: Could not parse LilyPond file {self.lilypond_file}: {e}"))
     
     def parse_key_and_transposition(self):
         """Parse \\key and \\transpose directives from LilyPond source"""
@@ -247,718 +357,1025 @@ class SacredHarpAnalyzer:
                 self.log_message(f"Detected transposition: \\transpose {from_note} {to_note} (LilyPond: {lilypond_transpose:+d} semitones, Analysis: {self.transpose_semitones:+d} semitones)")
                 break
     
-    def estimate_section_timings(self):
-        """Estimate when A and B sections occur in the MIDI"""
-        # Simple heuristic: A section starts at 0, B section starts after A
-        # This could be improved by analyzing the actual music content
-        if not self.score:
-            return
-            
-        total_length = self.score.flat.highestTime
-        # Assume A section is roughly first half, B section is second half
-        self.section_timings['A'] = 0
-        self.section_timings['B'] = total_length / 2
-    
-    def get_lilypond_location(self, voice, offset, measure, beat):
-        """Map MIDI timing to LilyPond source location"""
-        if not self.voice_sections:
-            return None
-            
-        # Determine section (A or B) based on timing
-        section = 'A' if offset < self.section_timings['B'] else 'B'
-        section_key = f"{voice}{section}"
-        
-        if section_key not in self.voice_sections:
+    def get_lilypond_location(self, voice, offset):
+        """The written note (lilypond_source.SourceNote) a voice sings at offset, or None"""
+        if not self.source_map:
             return None
-            
-        voice_info = self.voice_sections[section_key]
-        
-        # Estimate line within the section based on measure/beat
-        # This is approximate - we don't have precise measure-to-line mapping
-        section_progress = 0.0
-        if section == 'A':
-            section_progress = offset / self.section_timings['B'] if self.section_timings['B'] > 0 else 0
-        else:
-            section_duration = max(1, self.score.flat.highestTime - self.section_timings['B'])
-            section_progress = (offset - self.section_timings['B']) / section_duration
-            
-        # Estimate line number within the voice section
-        content_lines = len(voice_info['content'])
-        estimated_line_offset = int(section_progress * max(1, content_lines - 2))  # -2 to avoid last brace
-        estimated_line = voice_info['start_line'] + estimated_line_offset + 1  # +1 for content start
-        
-        return {
-            'section_key': section_key,
-            'voice': voice,
-            'section': section,
-            'start_line': voice_info['start_line'],
-            'end_line': voice_info['end_line'],
-            'estimated_line': min(estimated_line, voice_info['end_line'] - 1),
-            'measure': measure,
-            'beat': beat,
-            'section_progress': section_progress
-        }
+        return self.source_map.note_at(voice, offset)
     
-    def get_context_from_lilypond(self, location_info, context_lines=3):
-        """Extract context around the problematic location"""
-        if not location_info or not self.lilypond_content:
-            return None
-            
-        estimated_line = location_info['estimated_line']
-        start_line = max(0, estimated_line - context_lines - 1)  # -1 for 0-based indexing
-        end_line = min(len(self.lilypond_content), estimated_line + context_lines)
+    def get_context_from_lilypond(self, note, context_lines=2):
+        """Source lines around a note, with a caret under it (built once per note)"""
+        key = (note.line, note.column)
+        self.count('context_lookups')
+        if key in self.source_contexts:
+            return self.source_contexts[key]
+        
+        with self.stage('warning_context'):
+            context = self.build_source_context(note, context_lines)
+        self.source_contexts[key] = context
+        return context
+    
+    def build_source_context(self, note, context_lines):
+        """The lines get_context_from_lilypond shows for a note"""
+        start_line = max(1, note.line - context_lines)
+        end_line = min(len(self.lilypond_content), note.line + context_lines)
         
         context = []
-        for i in range(start_line, end_line):
-            line_content = self.lilypond_content[i].rstrip()
-            marker = "→ " if i + 1 == estimated_line else "  "
-            context.append(f"{marker}Line {i+1}: {line_content}")
-            
+        for line_num in range(start_line, end_line + 1):
+            line_content = self.lilypond_content[line_num - 1].rstrip()
+            if line_num == note.line:
+                prefix = f"→ Line {line_num}: "
+                context.append(prefix + line_content)
+                # Keep tabs so the caret lines up under the note
+                indent = ''.join('\t' if char == '\t' else ' ' for char in line_content[:note.column - 1])
+                context.append(' ' * len(prefix) + indent + '^')
+            else:
+                context.append(f"  Line {line_num}: {line_content}")
+        
         return context
         
     def load_midi(self):
         """Load and parse MIDI file"""
+        with self.stage('parse'):
+            from midi_reader import MidiReadError, TimeSignature
+        
+        # Clear state from a previous load (the watcher reuses the analyzer)
+        self.midi_data = None
+        self.score = None
+        self.time_signature = None
+        self.midi_key_signature = None
+        
         try:
-            self.score = music21.converter.parse(self.midi_file)
+            with self.stage('parse'):
+                if self.from_source:
+                    self.load_lilypond_notes()
+                elif self.use_music21:
+                    self.load_midi_music21()
+                else:
+                    try:
+                        self.load_midi_native()
+                    except MidiReadError as e:
+                        self.log_diagnostic(Diagnostic('warning', 'midi.fallback',
+                                                       f"WARNING: Built-in MIDI reader failed ({e}), falling back to music21"))
+                        self.load_midi_music21()
             
-            # Get key signature - assume C major if not found (LilyPond default with \key do \major)
-            try:
-                key_sig = self.score.analyze('key')
-                self.key = key_sig.tonic.name
-                self.mode = key_sig.mode
-            except:
-                # Default to C major (Sacred Harp solmization system)
-                self.key = 'C'
-                self.mode = 'major'
-                
-            self.key_signature = music21.key.Key(self.key, self.mode)
+            with self.stage('key_detection'):
+                self.resolve_key()
+            self.tonic_pitch_class = pitch_class_from_name(self.key)
             
-            # Get time signature
-            try:
-                time_sigs = self.score.flat.getElementsByClass(music21.meter.TimeSignature)
-                if time_sigs:
-                    self.time_signature = time_sigs[0]
-                    self.beats_per_measure = self.time_signature.numerator
-                    
-                    # Handle different time signatures
-                    if self.time_signature.denominator == 4:
-                        self.beat_duration = 1.0  # Quarter note beat
-                    elif self.time_signature.denominator == 2:
-                        self.beat_duration = 2.0  # Half note beat
-                    elif self.time_signature.denominator == 8:
-                        # Compound time - group by dotted quarter
-                        if self.beats_per_measure in [6, 9, 12]:
-                            self.beats_per_measure = self.beats_per_measure // 3
-                            self.beat_duration = 1.5  # Dotted quarter beat
-                        else:
-                            self.beat_duration = 0.5  # Eighth note beat
-                    else:
-                        self.beat_duration = 4.0 / self.time_signature.denominator
-                else:
-                    # Default to 4/4
-                    self.time_signature = music21.meter.TimeSignature('4/4')
-                    self.beats_per_measure = 4
-                    self.beat_duration = 1.0
-            except:
-                # Default to 4/4 if time signature detection fails
-                self.time_signature = music21.meter.TimeSignature('4/4')
-                self.beats_per_measure = 4
-                self.beat_duration = 1.0
+            # Handle different time signatures - assume 4/4 if not found
+            if not self.time_signature:
+                self.time_signature = TimeSignature(4, 4)
+            self.beats_per_measure = self.time_signature.numerator
             
-            # Update section timings now that we have the score
-            if self.voice_sections:
-                self.estimate_section_timings()
+            if self.time_signature.denominator == 4:
+                self.beat_duration = 1.0  # Quarter note beat
+            elif self.time_signature.denominator == 2:
+                self.beat_duration = 2.0  # Half note beat
+            elif self.time_signature.denominator == 8:
+                # Compound time - group by dotted quarter
+                if self.beats_per_measure in [6, 9, 12]:
+                    self.beats_per_measure = self.beats_per_measure // 3
+                    self.beat_duration = 1.5  # Dotted quarter beat
+                else:
+                    self.beat_duration = 0.5  # Eighth note beat
+            else:
+                self.beat_duration = 4.0 / self.time_signature.denominator
             
             return True
         except Exception as e:
-            self.log_message(f"ERROR: Could not load MIDI file: {e}")
+            self.log_diagnostic(Diagnostic('error', 'midi.load', f"ERROR: Could not load MIDI file: {e}"))
             return False
     
-    def get_chord_at_offset(self, offset):
-        """Extract all simultaneous pitches at given offset and identify chord"""
-        notes_at_time = []
+    def load_midi_native(self):
+        """Load MIDI with the built-in Standard MIDI File reader"""
+        from midi_reader import read_midi
+        
+        # Level 1 cache: extracted notes by MIDI content (and reader version)
+        notes_key = None
+        notes = None
+        if self.cache and self.midi_hash:
+            notes_key = fingerprint(self.midi_hash, source_fingerprint(os.path.join(ANALYSIS_DIR, 'midi_reader.py')))
+            notes = self.cache.get('notes', notes_key)
+        
+        if notes is None:
+            self.midi_data = read_midi(self.midi_file)
+            time_sigs = self.midi_data.meta_events('time_signature')
+            key_sigs = self.midi_data.meta_events('key_signature')
+            notes = {
+                'part_events': [self.midi_data.part_events(track) for track in self.midi_data.note_tracks()],
+                'time_signature': time_sigs[0].value if time_sigs else None,
+                'key_signature': key_sigs[0].value if key_sigs else None
+            }
+            if notes_key:
+                self.cache.put('notes', notes_key, notes)
+        
+        self.use_note_events(notes)
+    
+    def load_lilypond_notes(self):
+        """Read note events straight from the LilyPond source (no MIDI compile)"""
+        from lilypond_source import note_events
+        from midi_reader import TimeSignature
+        
+        if self.lilypond_source is None:
+            raise ValueError(f"Could not read LilyPond source {self.lilypond_file}")
+        
+        notes = note_events(self.lilypond_source)
+        if notes['time_signature']:
+            notes['time_signature'] = TimeSignature(*notes['time_signature'])
+        self.use_note_events(notes)
+    
+    def use_note_events(self, notes):
+        """Index per-track (onset, release, pitches) events and take the meter and key signature"""
+        # Index every track that has notes once so per-beat lookups are O(log n)
+        part_events = notes['part_events']
+        self.part_indexes = [PartIndex(events) for events in part_events]
+        self.time_signature = notes['time_signature']
+        self.midi_key_signature = notes['key_signature']
+        
+        # Piece length runs to the end of the last (padded) measure
+        last_release = max((events[-1][1] for events in part_events if events), default=0)
+        if self.time_signature and last_release:
+            measure_length = self.time_signature.numerator * 4.0 / self.time_signature.denominator
+            last_release = math.ceil(last_release / measure_length) * measure_length
+        self.total_length = last_release
+    
+    def load_midi_music21(self):
+        """Load MIDI through music21 (slower fallback)"""
+        import music21
+        from midi_reader import KeySignature, TimeSignature
+        
+        self.score = music21.converter.parse(self.midi_file)
         
-        # Get all parts (voices)
+        # Index every part once so per-beat lookups are O(log n)
         parts = self.score.parts if self.score.parts else [self.score]
+        self.part_indexes = [PartIndex.from_part(part) for part in parts]
+        self.total_length = self.score.flat.highestTime
         
-        for part in parts:
-            # Find notes/chords at this exact offset
-            elements = part.flat.getElementsByOffset(offset, offset + 0.5, 
-                                                   includeElementsThatEndAtStart=False,
-                                                   mustFinishInSpan=False,
-                                                   mustBeginInSpan=False)
-            
-            for element in elements:
-                if hasattr(element, 'pitch'):  # Single note
-                    notes_at_time.append(element.pitch)
-                elif hasattr(element, 'pitches'):  # Chord
-                    notes_at_time.extend(element.pitches)
+        key_sigs = self.score.flat.getElementsByClass(music21.key.KeySignature)
+        if key_sigs:
+            self.midi_key_signature = KeySignature(key_sigs[0].sharps, getattr(key_sigs[0], 'mode', 'major'))
         
-        if not notes_at_time:
-            return None, []
-            
-        return self.identify_sacred_harp_chord(notes_at_time)
+        time_sigs = self.score.flat.getElementsByClass(music21.meter.TimeSignature)
+        if time_sigs:
+            self.time_signature = TimeSignature(time_sigs[0].numerator, time_sigs[0].denominator)
     
-    def identify_sacred_harp_chord(self, pitches):
-        """Identify chord from list of pitches, handling Sacred Harp conventions"""
-        if not pitches:
-            return None, []
-        
-        # Convert to pitch classes (remove octave information)
-        pitch_classes = [p.pitchClass for p in pitches]
-        unique_pitch_classes = sorted(list(set(pitch_classes)))
-        
-        # Handle octave doubling (common in Sacred Harp bass)
-        pitch_class_counts = Counter(pitch_classes)
-        
-        # Get scale degrees for analysis
-        scale_degrees = []
-        for pc in unique_pitch_classes:
-            # Transpose to C major for analysis (Sacred Harp solmization system)
-            transposed_pc = (pc - self.key_signature.tonic.pitchClass) % 12
-            if transposed_pc in MAJOR_SCALE_DEGREES:
-                scale_degrees.append(MAJOR_SCALE_DEGREES[transposed_pc])
-        
-        scale_degrees = sorted(list(set(scale_degrees)))
-        
-        if not scale_degrees:
-            return "Unknown", unique_pitch_classes
-        
-        # Identify chord based on scale degrees
-        chord_root, roman_numeral = self.determine_chord_root_and_roman(scale_degrees)
-        
-        return roman_numeral, scale_degrees
-    
-    def determine_chord_root_and_roman(self, scale_degrees):
-        """Determine chord root and Roman numeral from scale degrees"""
-        if not scale_degrees:
-            return None, "Unknown"
-        
-        # Check for common Sacred Harp chord patterns
-        scale_set = set(scale_degrees)
-        
-        # Perfect matches first
-        if scale_set == {1, 3, 5}:  # do mi sol
-            return 1, 'I'
-        elif scale_set == {6, 1, 3}:  # la do mi  
-            return 6, 'vi'
-        elif scale_set == {5, 7, 2}:  # sol si re
-            return 5, 'V'
-        elif scale_set == {4, 6, 1}:  # fa la do
-            return 4, 'IV'
-        elif scale_set == {2, 4, 6}:  # re fa la
-            return 2, 'ii'
-        elif scale_set == {3, 5, 7}:  # mi sol si
-            return 3, 'iii'
-        elif scale_set == {7, 2, 4}:  # si re fa
-            return 7, 'vii°'
-        
-        # Handle incomplete chords (dyads - common in Sacred Harp)
-        elif scale_set == {1, 5}:  # do sol (I chord without third)
-            return 1, 'I'
-        elif scale_set == {1, 3}:  # do mi (I chord without fifth)  
-            return 1, 'I'
-        elif scale_set == {6, 3}:  # la mi (vi chord incomplete)
-            return 6, 'vi'
-        elif scale_set == {5, 7}:  # sol si (V chord without third)
-            return 5, 'V'
-        elif scale_set == {5, 2}:  # sol re (V chord without third)
-            return 5, 'V'
-        
-        # Single notes - assume root of chord
-        elif len(scale_degrees) == 1:
-            degree = scale_degrees[0]
-            if self.mode == 'major':
-                return degree, MAJOR_ROMAN_NUMERALS.get(degree, f"?{degree}")
-            else:
-                return degree, MINOR_ROMAN_NUMERALS.get(degree, f"?{degree}")
-        
-        # Complex chords - try to find root by lowest note
+    def resolve_key(self):
+        """Set key and mode from the first source that has one
+        
+        Order: LilyPond \\key/\\transpose directives, the MIDI key signature,
+        then statistical key analysis (only run when nothing else is known),
+        falling back to C major (Sacred Harp solmization system).
+        """
+        midi_key = None
+        if self.midi_key_signature:
+            midi_key = key_from_signature(*self.midi_key_signature)
+        
+        if self.lilypond_key:
+            detected, self.key_source = self.lilypond_key, 'LilyPond source'
+            if midi_key and pitch_class_from_name(midi_key[0]) != pitch_class_from_name(detected[0]):
+                self.log_diagnostic(Diagnostic(
+                    'warning', 'key.mismatch',
+                    f"WARNING: {self.lilypond_file} is in {' '.join(detected)} but the MIDI "
+                    f"key signature says {' '.join(midi_key)} - MIDI may be out of date"))
+        elif midi_key:
+            detected, self.key_source = midi_key, 'MIDI key signature'
         else:
-            root_degree = min(scale_degrees)
-            if self.mode == 'major':
-                return root_degree, MAJOR_ROMAN_NUMERALS.get(root_degree, f"?{root_degree}")
-            else:
-                return root_degree, MINOR_ROMAN_NUMERALS.get(root_degree, f"?{root_degree}")
-    
-    def analyze_chords(self):
-        """Analyze chord progressions throughout the piece"""
-        if not self.score:
-            return []
+            detected, self.key_source = self.estimate_key_statistically(), 'statistical analysis'
         
-        chord_analysis = []
-        
-        # Get total length of piece
-        total_length = self.score.flat.highestTime
+        if not detected:
+            detected, self.key_source = ('C', 'major'), 'default'
+        self.key, self.mode = detected
+    
+    def estimate_key_statistically(self):
+        """Key-profile estimate of (tonic, mode) from the notes, or None"""
+        if self.score is not None:
+            try:
+                key_sig = self.score.analyze('key')
+                return key_sig.tonic.name, key_sig.mode
+            except Exception:
+                return None
         
-        # Analyze every beat based on detected time signature
-        current_offset = 0.0
+        return estimate_key((part_index.pitches[i], part_index.releases[i] - part_index.onsets[i])
+                            for part_index in self.part_indexes
+                            for i in range(len(part_index)))
+    
+    def label_chord(self, mask, entry=None):
+        """(roman numeral, scale degrees) for a pitch-class mask, via the chord table"""
+        if entry is None:
+            entry = chord_table_for_mode(self.mode)[mask]
+        if entry is None:
+            return None, []
+        if entry.scale_degrees is None:
+            # Nothing in the scale: report the absolute pitch classes instead
+            return entry.roman, mask_pitch_classes(mask, self.tonic_pitch_class)
+        return entry.roman, list(entry.scale_degrees)
+    
+    def measure_offsets(self):
+        """(measure number, beat offsets) for every measure, using the detected meter"""
+        measures = []
+        measure_length = self.beats_per_measure * self.beat_duration
         measure_num = 1
-        beat_num = 1
         
-        while current_offset < total_length:
-            roman_numeral, scale_degrees = self.get_chord_at_offset(current_offset)
+        while (measure_num - 1) * measure_length < self.total_length:
+            start = (measure_num - 1) * measure_length
+            offsets = [start + beat * self.beat_duration for beat in range(self.beats_per_measure)]
+            measures.append((measure_num, [offset for offset in offsets if offset < self.total_length]))
+            measure_num += 1
+        
+        return measures
+    
+    def measure_segments(self):
+        """(measure number, measure start, harmonic segments) for every measure
+        
+        Segments come from one sweep over every part's note onsets and releases
+        (see harmonic_segments.py), cut at the barlines.
+        """
+        measures = self.measure_offsets()
+        barlines = [offsets[0] for _, offsets in measures]
+        segments = [[] for _ in measures]
+        for segment in harmonic_segments(self.part_indexes, barlines):
+            index = bisect_right(barlines, segment.start) - 1
+            if 0 <= index < len(measures):
+                segments[index].append(segment)
+        return [(measure_num, start, measure) for (measure_num, _), start, measure
+                in zip(measures, barlines, segments)]
+    
+    def beat_number(self, offset, measure_start):
+        """1-based beat of offset in its measure (fractional between beats)"""
+        beat = 1 + (offset - measure_start) / self.beat_duration
+        return int(beat) if beat == int(beat) else round(beat, 3)
+    
+    def segment_mask(self, segment):
+        """Pitch-class mask (relative to the tonic) of everything sounding in a segment"""
+        mask = 0
+        for part_pitches in segment.pitches:
+            for pitches in part_pitches:
+                mask |= pitch_class_mask(pitches, self.tonic_pitch_class)
+        return mask
+    
+    def analyze_measure(self, measure_num, start, segments):
+        """Chord records for the harmonic segments of one measure"""
+        # Label every segment of the measure with one chord-table lookup
+        masks = [self.segment_mask(segment) for segment in segments]
+        labels = zip(masks, chord_table_for_mode(self.mode).lookup_many(masks))
+        records = []
+        
+        for segment, (mask, entry) in zip(segments, labels):
+            roman_numeral, scale_degrees = self.label_chord(mask, entry)
             
             if roman_numeral:
-                assessment = self.assess_chord(roman_numeral)
+                assessment = entry.assessment
                 
-                chord_analysis.append({
-                    'offset': current_offset,
+                records.append({
+                    'offset': segment.start,
+                    'end': segment.end,
+                    'duration': (segment.end - segment.start) / self.beat_duration,  # in beats
                     'measure': measure_num,
-                    'beat': beat_num,
+                    'beat': self.beat_number(segment.start, start),
                     'roman': roman_numeral,
                     'scale_degrees': scale_degrees,
-                    'assessment': assessment
+                    'assessment': assessment,
+                    # Per-voice snapshot shared by every check_* method
+                    'voice_pitches': self.segment_voice_pitches(segment)
                 })
-            
-            # Advance to next beat using detected beat duration
-            current_offset += self.beat_duration
-            beat_num += 1
-            
-            # New measure based on detected beats per measure
-            if beat_num > self.beats_per_measure:
-                beat_num = 1
-                measure_num += 1
-        
-        return chord_analysis
-    
-    def assess_chord(self, roman_numeral):
-        """Assess chord against Sacred Harp rules"""
-        rules = SACRED_HARP_RULES.get(self.mode, SACRED_HARP_RULES['major'])
-        
-        if roman_numeral in rules['forbidden']:
-            return {'status': 'FORBIDDEN', 'message': f'{roman_numeral} chord FORBIDDEN in Sacred Harp style'}
-        elif roman_numeral in rules['common']:
-            return {'status': 'GOOD', 'message': f'{roman_numeral} chord - excellent choice for Sacred Harp'}
-        elif roman_numeral in rules['quite_common']:
-            return {'status': 'OK', 'message': f'{roman_numeral} chord - good Sacred Harp choice'}
-        elif roman_numeral in rules['rare']:
-            return {'status': 'WARNING', 'message': f'{roman_numeral} chord - use sparingly in Sacred Harp'}
-        else:
-            return {'status': 'UNKNOWN', 'message': f'{roman_numeral} chord - check Sacred Harp style guide'}
+        
+        return records
     
-    def get_voice_pitches_at_offset(self, offset):
-        """Extract pitches by voice at given offset"""
-        voice_pitches = {'treble': None, 'alto': None, 'tenor': None, 'bass': None}
+    def measure_fingerprint(self, start, end):
+        """Every note sounding in [start, end), per part (see analyze_measure)"""
+        return tuple(
+            tuple((part_index.onsets[i], part_index.releases[i], part_index.pitches[i])
+                  for i in part_index.sounding_indices(start, end))
+            for part_index in self.part_indexes
+        )
+    
+    def segment_voice_pitches(self, segment):
+        """Pitches by voice in a harmonic segment
         
-        parts = self.score.parts if self.score.parts else [self.score]
+        Parts are taken in SATB order; where notes overlap in a part, the last
+        one sounding wins, and a chord gives its first pitch.
+        """
+        voices = ['treble', 'alto', 'tenor', 'bass']  # SATB part order
+        voice_pitches = dict.fromkeys(voices)
         
-        for i, part in enumerate(parts):
-            elements = part.flat.getElementsByOffset(offset, offset + 0.5, 
-                                                   includeElementsThatEndAtStart=False,
-                                                   mustFinishInSpan=False,
-                                                   mustBeginInSpan=False)
-            
-            for element in elements:
-                if hasattr(element, 'pitch'):  # Single note
-                    pitch = element.pitch
-                elif hasattr(element, 'pitches') and element.pitches:  # Chord
-                    pitch = element.pitches[0]  # Take first pitch
-                else:
-                    continue
-                    
-                # Map part index to voice name (assuming SATB order)
-                if i == 0:
-                    voice_pitches['treble'] = pitch
-                elif i == 1:
-                    voice_pitches['alto'] = pitch
-                elif i == 2:
-                    voice_pitches['tenor'] = pitch
-                elif i == 3:
-                    voice_pitches['bass'] = pitch
+        for voice, part_pitches in zip(voices, segment.pitches):
+            for pitches in part_pitches:
+                if pitches:
+                    voice_pitches[voice] = pitches[0]  # Single note, or first pitch of chord
         
         return voice_pitches
     
-    def check_voice_leading_issues(self, chord_analysis):
-        """Check for specific Sacred Harp voice leading issues"""
+    def check_beat_voice_leading(self, analysis):
+        """Dissonance and voice-crossing Diagnostics for a single chord record (segment)"""
         warnings = []
         
-        for i, analysis in enumerate(chord_analysis):
-            measure = analysis['measure']
-            beat = analysis['beat']
-            offset = analysis['offset']
-            scale_degrees = set(analysis['scale_degrees'])
-            
-            # Check for adjacent scale degrees (dissonance)
-            if {1, 2}.issubset(scale_degrees):  # do-re
-                warning = f"Bar {measure}, Beat {beat}: Adjacent scale degrees do-re create dissonance"
-                warning += f"\n→ Fix suggestion: Brief passing dissonance is acceptable, but avoid sustaining both notes"
-                warnings.append(warning)
-            if {3, 4}.issubset(scale_degrees):  # mi-fa  
-                warning = f"Bar {measure}, Beat {beat}: Adjacent scale degrees mi-fa create dissonance"
-                warning += f"\n→ Fix suggestion: Common at cadences, but avoid prolonged mi-fa combinations"
-                warnings.append(warning)
-            if {7, 1}.issubset(scale_degrees):  # si-do
-                warning = f"Bar {measure}, Beat {beat}: Adjacent scale degrees si-do create dissonance"
-                warning += f"\n→ Fix suggestion: Natural at cadences (si resolves to do), acceptable when brief"
-                warnings.append(warning)
-            
-            # Check voice crossings
-            voice_pitches = self.get_voice_pitches_at_offset(offset)
+        measure = analysis['measure']
+        beat = analysis['beat']
+        scale_degrees = set(analysis['scale_degrees'])
+        
+        # Check for adjacent scale degrees (dissonance)
+        if {1, 2}.issubset(scale_degrees):  # do-re
+            warning = f"Bar {measure}, Beat {beat}: Adjacent scale degrees do-re create dissonance"
+            warning += f"\n→ Fix suggestion: Brief passing dissonance is acceptable, but avoid sustaining both notes"
+            warnings.append(Diagnostic('warning', 'dissonance.do-re', warning, measure, beat))
+        if {3, 4}.issubset(scale_degrees):  # mi-fa  
+            warning = f"Bar {measure}, Beat {beat}: Adjacent scale degrees mi-fa create dissonance"
+            warning += f"\n→ Fix suggestion: Common at cadences, but avoid prolonged mi-fa combinations"
+            warnings.append(Diagnostic('warning', 'dissonance.mi-fa', warning, measure, beat))
+        if {7, 1}.issubset(scale_degrees):  # si-do
+            warning = f"Bar {measure}, Beat {beat}: Adjacent scale degrees si-do create dissonance"
+            warning += f"\n→ Fix suggestion: Natural at cadences (si resolves to do), acceptable when brief"
+            warnings.append(Diagnostic('warning', 'dissonance.si-do', warning, measure, beat))
+        
+        # Check voice crossings
+        voice_pitches = analysis['voice_pitches']
+        
+        if voice_pitches['bass'] is not None and voice_pitches['tenor'] is not None:
+            if voice_pitches['bass'] > voice_pitches['tenor']:
+                warnings.append(Diagnostic(
+                    'warning', 'voice-crossing',
+                    f"Bar {measure}, Beat {beat}: Bass crosses above tenor (acceptable when tenor is low)",
+                    measure, beat, 'bass', voice_pitches['bass']))
+        
+        # Don't log good voice crossings
+        # if voice_pitches['treble'] and voice_pitches['tenor']:
+        #     if voice_pitches['treble'] < voice_pitches['tenor']:
+        #         warnings.append(f"Bar {measure}, Beat {beat}: Treble crosses below tenor (good contrary motion)")
+        
+        return warnings
+    
+    def check_beat_ranges(self, analysis):
+        """Critical and extreme range findings for a single chord record (segment)
+        
+        Each is (Diagnostic, offset, fix suggestion); locate_range_warning turns
+        it into the Diagnostic that is logged.
+        """
+        warnings = []
+        
+        measure = analysis['measure']
+        beat = analysis['beat']
+        offset = analysis['offset']
+        voice_pitches = analysis['voice_pitches']
+        
+        for voice, pitch in voice_pitches.items():
+            if pitch is None or voice not in SACRED_HARP_RANGES:
+                continue
+                
+            ranges = SACRED_HARP_RANGES[voice]
+            midi_note = pitch
+            note_name = midi_to_note_name(midi_note)
             
-            if voice_pitches['bass'] and voice_pitches['tenor']:
-                if voice_pitches['bass'].midi > voice_pitches['tenor'].midi:
-                    warnings.append(f"Bar {measure}, Beat {beat}: Bass crosses above tenor (acceptable when tenor is low)")
+            # Apply reverse transposition for analysis (convert sounding pitch to written pitch)
+            analysis_midi = midi_note + self.transpose_semitones
             
-            # Don't log good voice crossings
-            # if voice_pitches['treble'] and voice_pitches['tenor']:
-            #     if voice_pitches['treble'].midi < voice_pitches['tenor'].midi:
-            #         warnings.append(f"Bar {measure}, Beat {beat}: Treble crosses below tenor (good contrary motion)")
+            # Critical range violations (NEVER do this) - only for bass
+            if voice == 'bass' and analysis_midi <= ranges['critical_low']:
+                warning = f"Bar {measure}, Beat {beat}: CRITICAL: {voice.title()} note {note_name} (MIDI {midi_note}, Analysis: {analysis_midi}) is too low to sing! Never go below {midi_to_note_name(ranges['critical_low'])}."
+                warnings.append((Diagnostic('critical', 'range.critical', warning, measure, beat, voice, midi_note),
+                                 offset, "Change note to higher octave or transpose passage up"))
+                continue
             
+            # Outside absolute range found in repertoire (very rare)
+            if analysis_midi < ranges['absolute_low']:
+                warning = f"Bar {measure}, Beat {beat}: EXTREME: {voice.title()} note {note_name} (MIDI {midi_note}, Analysis: {analysis_midi}) is below any note found in Sacred Harp repertoire."
+                warnings.append((Diagnostic('warning', 'range.extreme', warning, measure, beat, voice, midi_note),
+                                 offset, "Raise note by octave or reconsider voice assignment"))
+            elif analysis_midi > ranges['absolute_high']:
+                warning = f"Bar {measure}, Beat {beat}: EXTREME: {voice.title()} note {note_name} (MIDI {midi_note}, Analysis: {analysis_midi}) is above any note found in Sacred Harp repertoire."
+                warnings.append((Diagnostic('warning', 'range.extreme', warning, measure, beat, voice, midi_note),
+                                 offset, "Lower note by octave or transpose passage down"))
         
-        # Check for critical and extreme range violations (immediate warnings)
-        critical_warnings = self.check_critical_ranges(chord_analysis)
-        warnings.extend(critical_warnings)
+        return warnings
+    
+    def locate_range_warning(self, finding):
+        """The Diagnostic for a check_beat_ranges finding, pointing at the written
+        note in the LilyPond source when there is one
+        
+        This is looked up from the source map each time, not cached with the
+        measure, so editing the source only reanalyzes the measures whose notes changed.
+        """
+        diagnostic, offset, suggestion = finding
+        source_note = self.get_lilypond_location(diagnostic.voice, offset)
+        if not source_note:
+            return diagnostic
+        message = diagnostic.message + self.source_location_text(source_note) + f"\n→ Fix suggestion: {suggestion}"
+        return diagnostic._replace(message=message, source_line=source_note.line)
+    
+    def source_location_text(self, note):
+        """Location and context lines appended to a warning about a written note"""
+        text = f"\n→ Location: {note.section} section, line {note.line}, column {note.column} in {self.lilypond_file}"
+        return text + "\n→ Context:\n" + "\n".join(self.get_context_from_lilypond(note))
+    
+    def build_pitch_table(self, grid):
+        """Build a voices x beats array of analysis MIDI pitches (NaN where silent)"""
+        import numpy as np
         
-        # Check for vocal fatigue from sustained extreme range singing
-        fatigue_warnings = self.check_vocal_fatigue(chord_analysis)
-        warnings.extend(fatigue_warnings)
+        voices = list(SACRED_HARP_RANGES.keys())
+        pitch_table = np.full((len(voices), len(grid)), np.nan)
         
-        # Check treble-tenor contrary motion over time
-        contrary_motion_warnings = self.check_contrary_motion(chord_analysis)
-        warnings.extend(contrary_motion_warnings)
+        for beat_index, (_, _, analysis) in enumerate(grid):
+            if analysis is None:
+                continue
+            for voice_index, voice in enumerate(voices):
+                pitch = analysis['voice_pitches'].get(voice)
+                if pitch is not None:
+                    # Apply reverse transposition for analysis
+                    pitch_table[voice_index, beat_index] = pitch + self.transpose_semitones
         
-        return warnings
+        return voices, pitch_table
     
-    def check_critical_ranges(self, chord_analysis):
-        """Check for critical and extreme range violations (immediate warnings)"""
-        warnings = []
-        
-        for analysis in chord_analysis:
-            measure = analysis['measure']
-            beat = analysis['beat']
-            offset = analysis['offset']
-            voice_pitches = self.get_voice_pitches_at_offset(offset)
-            
-            for voice, pitch in voice_pitches.items():
-                if not pitch or voice not in SACRED_HARP_RANGES:
+    def build_duration_weights(self, grid):
+        """Build a voices x beats array of how much of each beat the note sounding at its start lasts"""
+        import numpy as np
+        
+        voices = list(SACRED_HARP_RANGES.keys())
+        weights = np.zeros((len(voices), len(grid)))
+        
+        for beat_index, (_, beat_start, _) in enumerate(grid):
+            beat_end = beat_start + self.beat_duration
+            for voice_index, part_index in enumerate(self.part_indexes[:len(voices)]):
+                indices = part_index.sounding_indices(beat_start)
+                if not indices:
                     continue
-                    
-                ranges = SACRED_HARP_RANGES[voice]
-                midi_note = pitch.midi
-                
-                # Apply reverse transposition for analysis (convert sounding pitch to written pitch)
-                analysis_midi = midi_note + self.transpose_semitones
-                
-                # Get LilyPond location if available
-                location_info = self.get_lilypond_location(voice, offset, measure, beat)
-                
-                # Critical range violations (NEVER do this) - only for bass
-                if voice == 'bass' and analysis_midi <= ranges['critical_low']:
-                    warning = f"Bar {measure}, Beat {beat}: CRITICAL: {voice.title()} note {pitch.name}{pitch.octave} (MIDI {midi_note}, Analysis: {analysis_midi}) is too low to sing! Never go below G2."
-                    
-                    if location_info:
-                        warning += f"\n→ Location: {location_info['section_key']} section, approximately line {location_info['estimated_line']} in {self.lilypond_file}"
-                        context = self.get_context_from_lilypond(location_info)
-                        if context:
-                            warning += f"\n→ Context:\n" + "\n".join(context)
-                        warning += f"\n→ Fix suggestion: Change note to higher octave or transpose passage up"
-                    
-                    warnings.append(warning)
-                    continue
-                
-                # Outside absolute range found in repertoire (very rare)
-                if analysis_midi < ranges['absolute_low']:
-                    warning = f"Bar {measure}, Beat {beat}: EXTREME: {voice.title()} note {pitch.name}{pitch.octave} (MIDI {midi_note}, Analysis: {analysis_midi}) is below any note found in Sacred Harp repertoire."
-                    
-                    if location_info:
-                        warning += f"\n→ Location: {location_info['section_key']} section, approximately line {location_info['estimated_line']} in {self.lilypond_file}"
-                        context = self.get_context_from_lilypond(location_info)
-                        if context:
-                            warning += f"\n→ Context:\n" + "\n".join(context)
-                        warning += f"\n→ Fix suggestion: Raise note by octave or reconsider voice assignment"
-                    
-                    warnings.append(warning)
-                elif analysis_midi > ranges['absolute_high']:
-                    warning = f"Bar {measure}, Beat {beat}: EXTREME: {voice.title()} note {pitch.name}{pitch.octave} (MIDI {midi_note}, Analysis: {analysis_midi}) is above any note found in Sacred Harp repertoire."
-                    
-                    if location_info:
-                        warning += f"\n→ Location: {location_info['section_key']} section, approximately line {location_info['estimated_line']} in {self.lilypond_file}"
-                        context = self.get_context_from_lilypond(location_info)
-                        if context:
-                            warning += f"\n→ Context:\n" + "\n".join(context)
-                        warning += f"\n→ Fix suggestion: Lower note by octave or transpose passage down"
-                    
-                    warnings.append(warning)
+                # Same note as segment_voice_pitches picks (the last one)
+                note = indices[-1]
+                overlap = min(part_index.releases[note], beat_end) - beat_start
+                weights[voice_index, beat_index] = overlap / self.beat_duration
         
-        return warnings
+        return weights
     
-    def check_vocal_fatigue(self, chord_analysis):
-        """Check for vocal fatigue from sustained extreme range singing"""
-        warnings = []
+    def vocal_fatigue_candidates(self, grid, previous=None, dirty_beats=()):
+        """Flagged fatigue windows (see fatigue.fatigue_candidates) over a beat grid
         
-        if len(chord_analysis) < 3:  # Need at least 3 beats to check fatigue
-            return warnings
+        grid holds (measure, beat offset, record) for every beat of the piece,
+        where record is the chord record sounding at the beat or None (see
+        rules.VocalFatigueRule). Fatigue windows are counted in these beats.
         
-        # Track pitch history for each voice
-        voice_history = {'treble': [], 'alto': [], 'tenor': [], 'bass': []}
+        With `previous` candidates from a run with the same beats, only windows
+        touching `dirty_beats` (indexes into grid) are redone.
+        """
+        from fatigue import (DEFAULT_WINDOW_BEATS, fatigue_candidates, update_fatigue_candidates,
+                             window_sizes_for_meter)
         
-        # Build pitch history for each voice
-        for analysis in chord_analysis:
-            offset = analysis['offset']
-            measure = analysis['measure']
-            beat = analysis['beat']
-            voice_pitches = self.get_voice_pitches_at_offset(offset)
-            
-            for voice in voice_history.keys():
-                if voice_pitches[voice]:
-                    midi_note = voice_pitches[voice].midi
-                    analysis_midi = midi_note + self.transpose_semitones
-                    voice_history[voice].append({
-                        'midi': midi_note,
-                        'analysis_midi': analysis_midi,
-                        'measure': measure,
-                        'beat': beat,
-                        'pitch': voice_pitches[voice]
-                    })
-                else:
-                    voice_history[voice].append(None)
+        if len(grid) < 3:  # Need at least 3 beats to check fatigue
+            return []
         
-        # Check for fatigue in each voice using sliding window
-        window_size = 8  # 8 beats (2 measures in 4/4)
+        voices, pitch_table = self.build_pitch_table(grid)
+        measures = [measure for measure, _, _ in grid]
+        low_limits = [SACRED_HARP_RANGES[voice]['percentile_10'] for voice in voices]
+        high_limits = [SACRED_HARP_RANGES[voice]['percentile_90'] for voice in voices]
+        weights = self.build_duration_weights(grid) if self.fatigue_duration_weighted else None
+        windows = window_sizes_for_meter(self.beats_per_measure, self.fatigue_windows or (DEFAULT_WINDOW_BEATS,))
+        arguments = (pitch_table, low_limits, high_limits, measures, self.beats_per_measure, windows, weights)
+        
+        if previous is not None:
+            return update_fatigue_candidates(previous, dirty_beats, *arguments)
+        return fatigue_candidates(*arguments)
+    
+    def check_vocal_fatigue(self, candidates):
+        """Check for vocal fatigue from sustained extreme range singing (vocal_fatigue_candidates)"""
+        from fatigue import select_findings
         
-        for voice, history in voice_history.items():
-            if voice not in SACRED_HARP_RANGES:
-                continue
-                
-            ranges = SACRED_HARP_RANGES[voice]
-            reported_ranges = set()  # Track reported ranges to avoid duplicates
-            
-            # Sliding window analysis
-            for i in range(len(history) - window_size + 1):
-                window = history[i:i + window_size]
-                
-                # Count extreme notes in this window
-                extreme_high = 0
-                extreme_low = 0
-                consecutive_high = 0
-                consecutive_low = 0
-                max_consecutive_high = 0
-                max_consecutive_low = 0
-                
-                for note_data in window:
-                    if note_data is None:
-                        consecutive_high = 0
-                        consecutive_low = 0
-                        continue
-                        
-                    analysis_midi = note_data['analysis_midi']
-                    
-                    # Count extreme notes using transposed pitch for analysis
-                    if analysis_midi > ranges['percentile_90']:
-                        extreme_high += 1
-                        consecutive_high += 1
-                        consecutive_low = 0
-                        max_consecutive_high = max(max_consecutive_high, consecutive_high)
-                    elif analysis_midi < ranges['percentile_10']:
-                        extreme_low += 1
-                        consecutive_low += 1
-                        consecutive_high = 0
-                        max_consecutive_low = max(max_consecutive_low, consecutive_low)
-                    else:
-                        consecutive_high = 0
-                        consecutive_low = 0
-                
-                # Generate fatigue warnings (only if not already reported for this range)
-                start_measure = window[0]['measure'] if window[0] else i // self.beats_per_measure + 1
-                end_measure = window[-1]['measure'] if window[-1] else (i + window_size - 1) // self.beats_per_measure + 1
-                range_key = (voice, start_measure, end_measure)
+        warnings = []
+        
+        voices = list(SACRED_HARP_RANGES.keys())
+        findings = select_findings(candidates, len(voices))
+        
+        for voice, voice_findings in zip(voices, findings):
+            for finding in voice_findings:
+                count = f"{finding['count']:g}"
+                bars = f"bars {finding['start_measure']}-{finding['end_measure']}"
+                region = 'top' if finding['extreme'] == 'high' else 'bottom'
                 
-                # Only report the most severe warning for each range
-                if range_key not in reported_ranges:
-                    # Warn about sustained high singing
-                    if extreme_high >= 6:  # 6+ high notes is most severe
-                        warnings.append(f"SUSTAINED FATIGUE: {voice.title()} spends {extreme_high} of {window_size} beats in top 10% range (bars {start_measure}-{end_measure}) - may tire singers")
-                        reported_ranges.add(range_key)
-                    elif extreme_high >= 5:  # 5 high notes is moderate
-                        warnings.append(f"SUSTAINED FATIGUE: {voice.title()} spends {extreme_high} of {window_size} beats in top 10% range (bars {start_measure}-{end_measure}) - may tire singers")
-                        reported_ranges.add(range_key)
-                    elif max_consecutive_high >= 4:  # 4+ consecutive high notes
-                        warnings.append(f"FATIGUE WARNING: {voice.title()} has {max_consecutive_high} consecutive high notes (bars {start_measure}-{end_measure}) - may strain singers")
-                        reported_ranges.add(range_key)
-                    
-                    # Warn about sustained low singing (only if no high warning)
-                    elif extreme_low >= 6:  # 6+ low notes is most severe
-                        warnings.append(f"SUSTAINED FATIGUE: {voice.title()} spends {extreme_low} of {window_size} beats in bottom 10% range (bars {start_measure}-{end_measure}) - may tire singers")
-                        reported_ranges.add(range_key)
-                    elif extreme_low >= 5:  # 5 low notes is moderate
-                        warnings.append(f"SUSTAINED FATIGUE: {voice.title()} spends {extreme_low} of {window_size} beats in bottom 10% range (bars {start_measure}-{end_measure}) - may tire singers")
-                        reported_ranges.add(range_key)
-                    elif max_consecutive_low >= 4:  # 4+ consecutive low notes
-                        warnings.append(f"FATIGUE WARNING: {voice.title()} has {max_consecutive_low} consecutive low notes (bars {start_measure}-{end_measure}) - may strain singers")
-                        reported_ranges.add(range_key)
+                if finding['kind'] == 'sustained':
+                    message = f"SUSTAINED FATIGUE: {voice.title()} spends {count} of {finding['window']} beats in {region} 10% range ({bars}) - may tire singers"
+                else:
+                    message = f"FATIGUE WARNING: {voice.title()} has {count} consecutive {finding['extreme']} notes ({bars}) - may strain singers"
+                warnings.append(Diagnostic('warning', f"fatigue.{finding['kind']}", message,
+                                           finding['start_measure'], voice=voice))
         
         return warnings
     
-    def check_contrary_motion(self, chord_analysis):
-        """Check for proper contrary motion between treble and tenor"""
+    def motion_between(self, previous, current):
+        """True for parallel and False for contrary treble/tenor motion; None unless both voices moved"""
+        current_voices = current['voice_pitches']
+        previous_voices = previous['voice_pitches']
+        
+        if None in (current_voices['treble'], current_voices['tenor'],
+                    previous_voices['treble'], previous_voices['tenor']):
+            return None
+        
+        treble_motion = current_voices['treble'] - previous_voices['treble']
+        tenor_motion = current_voices['tenor'] - previous_voices['tenor']
+        
+        if abs(treble_motion) > 0 and abs(tenor_motion) > 0:  # Both voices moved
+            # Check if motion is in same direction (parallel)
+            return (treble_motion > 0 and tenor_motion > 0) or (treble_motion < 0 and tenor_motion < 0)
+        return None
+    
+    def check_contrary_motion(self, chord_analysis, transitions):
+        """Check for proper contrary motion between treble and tenor
+        
+        transitions holds motion_between for each record and the one before it
+        (None for the first), as collected by rules.ContraryMotionRule.
+        """
         warnings = []
         
         if len(chord_analysis) < 2:
             return warnings
         
-        parallel_motion_count = 0
-        total_motion_count = 0
-        
-        for i in range(1, len(chord_analysis)):
-            current = chord_analysis[i]
-            previous = chord_analysis[i-1]
-            
-            current_voices = self.get_voice_pitches_at_offset(current['offset'])
-            previous_voices = self.get_voice_pitches_at_offset(previous['offset'])
-            
-            if (current_voices['treble'] and current_voices['tenor'] and 
-                previous_voices['treble'] and previous_voices['tenor']):
-                
-                treble_motion = current_voices['treble'].midi - previous_voices['treble'].midi
-                tenor_motion = current_voices['tenor'].midi - previous_voices['tenor'].midi
-                
-                if abs(treble_motion) > 0 and abs(tenor_motion) > 0:  # Both voices moved
-                    total_motion_count += 1
-                    
-                    # Check if motion is in same direction (parallel)
-                    if (treble_motion > 0 and tenor_motion > 0) or (treble_motion < 0 and tenor_motion < 0):
-                        parallel_motion_count += 1
+        moved = [parallel for parallel in transitions if parallel is not None]
+        parallel_motion_count = sum(moved)
+        total_motion_count = len(moved)
         
         # Warn if too much parallel motion
         if total_motion_count > 0:
             parallel_ratio = parallel_motion_count / total_motion_count
             if parallel_ratio > 0.6:  # More than 60% parallel motion
-                warnings.append(f"WARNING: Treble and tenor move in parallel motion {parallel_ratio:.1%} of the time. Sacred Harp prefers contrary motion.")
+                warnings.append(Diagnostic('warning', 'contrary-motion',
+                                           f"WARNING: Treble and tenor move in parallel motion {parallel_ratio:.1%} of the time. Sacred Harp prefers contrary motion."))
         
         return warnings
     
     def log_message(self, message):
-        """Write message to log file with timestamp"""
+        """Log an informational message"""
+        self.log_diagnostic(info(message))
+    
+    def log_diagnostic(self, diagnostic):
+        """Buffer a Diagnostic with its timestamp until flush_diagnostics"""
+        if self.recorded_messages is not None:
+            self.recorded_messages.append(diagnostic)
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with open(self.log_file, 'a') as f:
-            f.write(f"{timestamp}: {message}\n")
+        self.pending_diagnostics.append((timestamp, diagnostic))
+    
+    def new_diagnostics(self):
+        """Yield the diagnostics logged since the last call (for iter_diagnostics)"""
+        while self.streamed_count < len(self.pending_diagnostics):
+            self.streamed_count += 1
+            yield self.pending_diagnostics[self.streamed_count - 1][1]
+    
+    def flush_diagnostics(self):
+        """Write buffered diagnostics to the log sink in one go"""
+        self.streamed_count = 0
+        if not self.pending_diagnostics:
+            return
+        entries, self.pending_diagnostics = self.pending_diagnostics, []
+        with self.stage('logging'):
+            self.diagnostics_sink.write_run(self.run_id, entries,
+                                            {'midi_file': self.midi_file, 'lilypond_file': self.lilypond_file})
+    
+    def result_cache_key(self):
+        """Level 2 cache key: MIDI + .ly content, rules/code version and settings"""
+        if not self.midi_hash:
+            return None
+        settings = (self.midi_file, self.lilypond_file, self.use_music21,
+                    self.fatigue_windows, self.fatigue_duration_weighted)
+        return fingerprint(self.midi_hash, self.lilypond_hash, rules_fingerprint(), settings)
     
     def run_analysis(self):
-        """Run complete harmonic analysis"""
+        """Run complete harmonic analysis, replaying cached results if nothing changed"""
+        for _ in self.iter_diagnostics():
+            pass
+        return self.run_succeeded
+    
+    def iter_diagnostics(self):
+        """Run the analysis, yielding each Diagnostic as soon as its stage produces it
+        
+        Rule findings come out in the order the single pass over the piece
+        reaches them; the log still gets everything in the usual order when the
+        run ends. Closing the generator early (see first_diagnostic) stops the
+        analysis: what was logged so far is written, nothing is cached, and
+        run_succeeded is False. Otherwise run_succeeded tells how the run went.
+        """
+        self.run_id = f"{datetime.now():%Y%m%dT%H%M%S}-{os.urandom(4).hex()}"
+        self.run_succeeded = False
+        if self.profiler:
+            self.profiler.start_run()
+        try:
+            with self.stage('run'):
+                self.run_succeeded = yield from self.run_analysis_buffered()
+        finally:
+            if self.profiler:
+                self.count_run_totals()
+            self.flush_diagnostics()
+            if self.profiler:
+                self.last_profile = self.profiler.finish_run(os.path.basename(self.midi_file))
+    
+    def count_run_totals(self):
+        """Profiling counters read off the finished run: warnings logged and note-index queries"""
+        warnings = sum(1 for _, diagnostic in self.pending_diagnostics if diagnostic.severity != 'info')
+        self.count('warnings', warnings)
+        self.count('stream_queries', sum(part_index.query_count for part_index in self.part_indexes))
+    
+    def first_diagnostic(self, severity):
+        """Run the analysis until a diagnostic at least as severe as `severity`
+        (see diagnostics.SEVERITIES) turns up, and return it; None if there is none"""
+        diagnostics = self.iter_diagnostics()
+        try:
+            for diagnostic in diagnostics:
+                if at_least(diagnostic, severity):
+                    return diagnostic
+        finally:
+            diagnostics.close()
+        return None
+    
+    def run_analysis_buffered(self):
+        """iter_diagnostics without the final flush; returns whether the run succeeded"""
         self.log_message("=== SACRED HARP HARMONIC ANALYSIS START ===")
+        yield from self.new_diagnostics()
+        
+        result_key = None
+        if self.cache:
+            self.midi_hash = file_digest(self.midi_file)
+            result_key = self.result_cache_key()
+            if self.previous_diagnostics is None:
+                self.load_previous_run()
+        
+        self.reanalyzed_measures = None
+        messages = self.cache.get('results', result_key) if result_key else None
+        if messages is not None:
+            for diagnostic in messages:
+                self.log_diagnostic(diagnostic)
+                yield from self.new_diagnostics()
+            success = True
+        else:
+            self.recorded_messages = []
+            try:
+                success = yield from self.analyze_and_log()
+            finally:
+                messages, self.recorded_messages = self.recorded_messages, None
+            
+            # Only successful runs are cached; failures may be a half-written MIDI file
+            if success and result_key:
+                self.cache.put('results', result_key, messages)
         
-        if not self.load_midi():
+        if not success:
+            yield from self.new_diagnostics()
+            return False
+        
+        if self.reanalyzed_measures:
+            changed_count, measure_count = self.reanalyzed_measures
+            self.log_message(f"INCREMENTAL: Re-analyzed {changed_count} of {measure_count} measures")
+        self.report_changes(messages)
+        self.save_previous_run()
+        
+        self.log_message("=== SACRED HARP HARMONIC ANALYSIS END ===")
+        yield from self.new_diagnostics()
+        return True
+    
+    def report_changes(self, messages):
+        """Log which diagnostics are new or resolved since the previous run
+        
+        Diagnostics are matched on their first line, so the source location and
+        context lines after it (which shift whenever the .ly file is edited
+        above them) don't make an unchanged warning look new.
+        """
+        diagnostics = [diagnostic.message.splitlines()[0] for diagnostic in messages
+                       if diagnostic.severity != 'info']
+        
+        if self.previous_diagnostics is not None:
+            previous_diagnostics = [message.splitlines()[0] for message in self.previous_diagnostics]
+            previous = set(previous_diagnostics)
+            current = set(diagnostics)
+            new = [message for message in diagnostics if message not in previous]
+            resolved = [message for message in previous_diagnostics if message not in current]
+            
+            self.log_message(f"CHANGES SINCE LAST RUN: {len(new)} new, {len(resolved)} resolved")
+            for message in new:
+                self.log_message(f"NEW: {message}")
+            for message in resolved:
+                self.log_message(f"RESOLVED: {message}")
+        
+        self.previous_diagnostics = diagnostics
+    
+    def previous_run_key(self):
+        """Cache key for the per-song state kept between runs (see load_previous_run)"""
+        lilypond_path = os.path.abspath(self.lilypond_file) if self.lilypond_file else None
+        return fingerprint('previous-run', os.path.abspath(self.midi_file), lilypond_path, self.use_music21)
+    
+    def load_previous_run(self):
+        """Restore the last run's diagnostics and per-measure state from the on-disk cache"""
+        state = self.cache.get('snapshots', self.previous_run_key())
+        if state:
+            self.previous_diagnostics = state['diagnostics']
+            self.incremental_state = state['incremental']
+    
+    def save_previous_run(self):
+        """Keep this run's diagnostics and per-measure state for the next one"""
+        if self.cache:
+            self.cache.put('snapshots', self.previous_run_key(), {
+                'diagnostics': self.previous_diagnostics,
+                'incremental': self.incremental_state
+            })
+    
+    def incremental_context(self):
+        """Everything besides a measure's notes that its per-segment results depend on"""
+        return (self.key, self.mode, self.tonic_pitch_class, self.beats_per_measure, self.beat_duration,
+                self.total_length, self.transpose_semitones, len(self.part_indexes), self.fatigue_windows, self.fatigue_duration_weighted, rules_fingerprint())
+    
+    def analyze_measures(self, context):
+        """Chord records for every measure
+        
+        Measures whose sampled notes are unchanged since the previous run (with
+        the same context) are reused, along with the per-segment rule findings
+        cached in them. Returns (measures, changed measure numbers).
+        """
+        state = self.incremental_state
+        previous = state['measures'] if state and state['context'] == context else {}
+        
+        measure_length = self.beats_per_measure * self.beat_duration
+        with self.stage('analyze_chords'):
+            measure_segments = self.measure_segments()
+        
+        measures = {}
+        changed = set()
+        for measure_num, start, segments in measure_segments:
+            with self.stage('incremental'):
+                measure_fingerprint = fingerprint(self.measure_fingerprint(start, start + measure_length))
+            measure = previous.get(measure_num)
+            
+            if measure is None or measure['fingerprint'] != measure_fingerprint:
+                with self.stage('analyze_chords'):
+                    records = self.analyze_measure(measure_num, start, segments)
+                measure = {
+                    'fingerprint': measure_fingerprint,
+                    'records': records,
+                    'findings': {}  # Rule name -> findings (filled in by rules.RuleEngine)
+                }
+                changed.add(measure_num)
+            measures[measure_num] = measure
+        
+        self.count('measures', len(measures))
+        self.count('reanalyzed_measures', len(changed))
+        return measures, changed
+    
+    def analyze_and_log(self):
+        """Load the MIDI, run every rule (see rules.py) and log the results
+        
+        A generator (see iter_diagnostics): yields each diagnostic as it is
+        produced and returns whether the analysis succeeded. The rules share
+        one pass over the chord records and beats. Per-segment rules are redone
+        only for measures that changed since the previous run, and fatigue
+        windows only where they touch a changed measure (see analyze_measures).
+        """
+        from rules import RuleEngine
+        
+        loaded = self.load_midi()
+        yield from self.new_diagnostics()
+        if not loaded:
             return False
         
         time_sig_str = f"{self.time_signature.numerator}/{self.time_signature.denominator}" if self.time_signature else "4/4"
         self.log_message(f"Analyzing {self.midi_file} in {self.key} {self.mode}, {time_sig_str} time")
+        self.log_message(f"Key from {self.key_source}")
+        yield from self.new_diagnostics()
         
-        chord_analysis = self.analyze_chords()
+        context = self.incremental_context()
+        measures, changed = self.analyze_measures(context) if self.part_indexes else ({}, set())
+        segment_count = sum(len(measure['records']) for measure in measures.values())
         
-        if not chord_analysis:
-            self.log_message("No chords detected in analysis")
+        if not segment_count:
+            self.log_diagnostic(Diagnostic('error', 'analysis.empty', "No chords detected in analysis"))
+            yield from self.new_diagnostics()
             return False
         
-        # Log chord-by-chord analysis (only problems)
-        for analysis in chord_analysis:
-            measure = analysis['measure']
-            beat = analysis['beat']
-            offset = analysis['offset']
-            roman = analysis['roman']
-            degrees = analysis['scale_degrees']
-            assessment = analysis['assessment']
-            
-            status = assessment['status']
-            message = assessment['message']
-            
-            # Only log problematic chords
-            if status in ['FORBIDDEN', 'WARNING', 'UNKNOWN']:
-                degrees_str = '-'.join(map(str, degrees))
-                log_entry = f"Bar {measure}, Beat {beat}: {roman} ({degrees_str}) - {status}: {message}"
-                
-                # Add fix suggestions for forbidden chords
-                if status == 'FORBIDDEN':
-                    if roman == 'vii°':
-                        log_entry += f"\n→ Fix suggestion: Replace with V chord (sol-si-re) or vi chord (la-do-mi)"
-                    elif roman == 'ii°':
-                        log_entry += f"\n→ Fix suggestion: Replace with iv chord (fa-la-do) or ii chord (re-fa-la)"
-                    elif roman == 'VI' and self.mode == 'minor':
-                        log_entry += f"\n→ Fix suggestion: Use III chord (do-mi-sol) or iv chord (fa-la-do) instead"
-                
-                self.log_message(log_entry)
+        # Rule state from the last run only applies in the same context
+        previous = self.incremental_state
+        if not previous or previous['context'] != context:
+            previous = None
+        else:
+            self.reanalyzed_measures = (len(changed), len(measures))
+        
+        beats = [(measure_num, offset) for measure_num, offsets in self.measure_offsets() for offset in offsets]
+        engine = RuleEngine(self)
+        findings = {rule.name: [] for rule in engine.rules}
+        with self.stage('rules'):
+            for rule, finding in engine.stream(measures, beats, changed if previous else None,
+                                               previous['rules'] if previous else None):
+                if rule.message_prefix:
+                    finding = finding._replace(message=rule.message_prefix + finding.message)
+                findings[rule.name].append(finding)
+                yield finding
+        
+        self.count('beats', len(beats))
+        self.count('segments', segment_count)
+        
+        # Logged rule by rule; they have all been yielded already
+        for rule in engine.rules:
+            for finding in findings[rule.name]:
+                self.log_diagnostic(finding)
+        self.streamed_count = len(self.pending_diagnostics)
+        
+        self.incremental_state = {
+            'context': context,
+            'measures': measures,
+            'rules': engine.states()
+        }
+        return True
+    
+    def chord_log_entry(self, analysis):
+        """Diagnostic for a problematic chord, or None for a good one"""
+        measure = analysis['measure']
+        beat = analysis['beat']
+        roman = analysis['roman']
+        degrees = analysis['scale_degrees']
+        assessment = analysis['assessment']
+        
+        status = assessment['status']
+        message = assessment['message']
+        
+        # Only log problematic chords
+        if status not in ['FORBIDDEN', 'WARNING', 'UNKNOWN']:
+            return None
         
-        # Check for voice leading issues
-        voice_warnings = self.check_voice_leading_issues(chord_analysis)
-        for warning in voice_warnings:
-            self.log_message(f"VOICE LEADING WARNING: {warning}")
+        degrees_str = '-'.join(map(str, degrees))
+        log_entry = f"Bar {measure}, Beat {beat}: {roman} ({degrees_str}) - {status}: {message}"
         
-        # Analyze chord progression
-        progression = [a['roman'] for a in chord_analysis if a['roman'] != 'Unknown']
-        if len(progression) > 1:
-            self.analyze_progression(progression)
+        # Add fix suggestions for forbidden chords
+        if status == 'FORBIDDEN':
+            if roman == 'vii°':
+                log_entry += f"\n→ Fix suggestion: Replace with V chord (sol-si-re) or vi chord (la-do-mi)"
+            elif roman == 'ii°':
+                log_entry += f"\n→ Fix suggestion: Replace with iv chord (fa-la-do) or ii chord (re-fa-la)"
+            elif roman == 'VI' and self.mode == 'minor':
+                log_entry += f"\n→ Fix suggestion: Use III chord (do-mi-sol) or iv chord (fa-la-do) instead"
         
-        self.log_message("=== SACRED HARP HARMONIC ANALYSIS END ===")
-        return True
+        severity = 'forbidden' if status == 'FORBIDDEN' else 'warning'
+        return Diagnostic(severity, f"chord.{status.lower()}", log_entry, measure, beat)
     
     def analyze_progression(self, progression):
-        """Analyze the overall chord progression"""
-        self.log_message(f"PROGRESSION: {' - '.join(progression)}")
-        
-        # Check against known good progressions
-        prog_str = ' - '.join(progression)
-        for good_prog in GOOD_PROGRESSIONS:
-            if ' - '.join(good_prog) in prog_str:
-                self.log_message(f"GOOD: Contains standard Sacred Harp progression: {' - '.join(good_prog)}")
-        
-        # Check for forbidden chord sequences
-        for i, chord in enumerate(progression[:-1]):
-            next_chord = progression[i + 1]
-            if chord == 'vii°':
-                self.log_message(f"ERROR: Forbidden vii° chord found in progression")
-            if chord == 'ii°' and self.mode == 'minor':
-                self.log_message(f"ERROR: Forbidden ii° chord found in minor key")
+        """Diagnostics on the overall chord progression (the labeled beats, in order)
+        
+        Every pattern in the library is matched in one pass over the Roman
+        numerals; occurrences are reported with their bar and beat.
+        """
+        numerals = [a['roman'] for a in progression]
+        diagnostics = [info(f"PROGRESSION: {' - '.join(numerals)}")]
+        
+        matches = progression_matcher().find(numerals, self.mode)
+        
+        # Known good progressions, in library order, with where each starts
+        starts = {}
+        for match in matches:
+            if match.pattern.kind == 'good':
+                starts.setdefault(match.pattern, []).append(progression[match.start])
+        for pattern in PROGRESSION_PATTERNS:
+            if pattern in starts:
+                positions = '; '.join(f"Bar {a['measure']}, Beat {a['beat']}" for a in starts[pattern])
+                diagnostics.append(info(f"GOOD: Contains standard Sacred Harp progression: "
+                                        f"{' - '.join(pattern.tokens)} ({positions})"))
+        
+        # Forbidden chords and sequences, in order of position
+        for match in matches:
+            if match.pattern.kind != 'forbidden':
+                continue
+            pattern = match.pattern
+            first = progression[match.start]
+            what = 'chord' if len(pattern.tokens) == 1 else 'progression'
+            where = 'progression' if pattern.mode == 'any' else f"{pattern.mode} key"
+            diagnostics.append(Diagnostic('forbidden', 'progression.forbidden',
+                                          f"ERROR: Forbidden {' - '.join(pattern.tokens)} {what} found in "
+                                          f"{where} at Bar {first['measure']}, Beat {first['beat']}",
+                                          first['measure'], first['beat']))
+        return diagnostics
 
-def watch_midi_file(midi_file, log_file='harmony.log', lilypond_file=None):
-    """Watch MIDI file for changes and analyze"""
-    import time
-    
-    last_modified = 0
-    analyzer = SacredHarpAnalyzer(midi_file, log_file, lilypond_file)
+def watch_midi_file(midi_file, log_file='harmony.log', lilypond_file=None, use_music21=False,
+                    use_cache=True, profiler=None, fatigue_windows=None, fatigue_duration_weighted=False):
+    """Watch the MIDI (and LilyPond) file for changes and analyze
+
+    A change to the .ly alone reloads the source but isn't analyzed until
+    LilyPond writes the new MIDI: the old MIDI doesn't match the new source.
+    Given a .ly file in place of the MIDI file, only the source is watched and
+    each save is analyzed straight away, without waiting for LilyPond.
+    """
+    from file_watcher import make_watcher
     
-    print(f"Watching {midi_file} for changes...")
-    print(f"Harmony feedback will be logged to {log_file}")
-    if lilypond_file:
-        print(f"LilyPond source locations from {lilypond_file}")
+    analyzer = SacredHarpAnalyzer(midi_file, log_file, lilypond_file, use_music21, use_cache, profiler,
+                                  fatigue_windows, fatigue_duration_weighted)
+    lilypond_file = analyzer.lilypond_file  # The .ly itself when it is analyzed directly
+    watched = [midi_file] + ([lilypond_file] if lilypond_file and lilypond_file != midi_file else [])
     
-    while True:
-        try:
-            if os.path.exists(midi_file):
-                modified = os.path.getmtime(midi_file)
-                if modified > last_modified:
-                    print(f"MIDI file updated, analyzing...")
+    with make_watcher(watched) as watcher:
+        print(f"Watching {', '.join(watched)} for changes ({watcher.kind})...")
+        print(f"Harmony feedback will be logged to {log_file}")
+        if lilypond_file:
+            print(f"LilyPond source locations from {lilypond_file}")
+        
+        changed = {midi_file}  # Analyze once on startup
+        while True:
+            try:
+                if lilypond_file in changed:
+                    analyzer.reload_lilypond_source()
+                if midi_file in changed and os.path.exists(midi_file):
+                    updated = 'LilyPond source' if midi_file == lilypond_file else 'MIDI file'
+                    print(f"{updated} updated, analyzing...")
                     analyzer.run_analysis()
-                    last_modified = modified
-            time.sleep(2)  # Check every 2 seconds
-        except KeyboardInterrupt:
-            print("Stopping watcher...")
-            break
+                elif changed:
+                    print("LilyPond source updated, waiting for the new MIDI file...")
+                changed = watcher.wait_for_changes()
+            except KeyboardInterrupt:
+                print("Stopping watcher...")
+                break
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage:")
-        print("  python sacred_harp_analyzer.py file.midi [output.log] [lilypond_file.ly]")
-        print("  python sacred_harp_analyzer.py --watch file.midi [output.log] [lilypond_file.ly]")
-        print("\nOptional LilyPond file enables precise source location reporting.")
+    # --music21 parses MIDI with music21 instead of the built-in reader
+    # --no-cache skips the on-disk note/result cache
+    # --profile[=FILE] reports stage times and counters (see profiling.py)
+    # --fail-on=SEVERITY stops at the first diagnostic that severe and exits 1
+    # --fatigue-windows=LIST / --fatigue-weighted set the vocal fatigue windows (see fatigue.py)
+    use_music21 = '--music21' in sys.argv
+    use_cache = '--no-cache' not in sys.argv
+    fatigue_duration_weighted = '--fatigue-weighted' in sys.argv
+    profile = [arg for arg in sys.argv if arg == '--profile' or arg.startswith('--profile=')]
+    fail_on_args = [arg for arg in sys.argv if arg.startswith('--fail-on=')]
+    window_args = [arg for arg in sys.argv if arg.startswith('--fatigue-windows=')]
+    argv = [arg for arg in sys.argv
+            if arg not in ['--music21', '--no-cache', '--fatigue-weighted'] + profile + fail_on_args + window_args]
+    
+    fail_on = fail_on_args[-1].partition('=')[2] if fail_on_args else None
+    if fail_on is not None and fail_on not in SEVERITIES[:-1]:
+        print(f"--fail-on must be one of {', '.join(SEVERITIES[:-1])}")
         sys.exit(1)
     
-    if sys.argv[1] == '--watch':
-        midi_file = sys.argv[2] if len(sys.argv) > 2 else 'christian_harmony_song.midi'
-        log_file = sys.argv[3] if len(sys.argv) > 3 else 'harmony.log'
-        lilypond_file = sys.argv[4] if len(sys.argv) > 4 else None
-        watch_midi_file(midi_file, log_file, lilypond_file)
+    fatigue_windows = None
+    if window_args:
+        from fatigue import parse_windows
+        try:
+            fatigue_windows = parse_windows(window_args[-1].partition('=')[2])
+        except ValueError as e:
+            print(f"--fatigue-windows: {e}")
+            sys.exit(1)
+    
+    profiler = None
+    if profile:
+        from profiling import Profiler
+        profiler = Profiler(profile[-1].partition('=')[2] or None)
+    
+    if len(argv) < 2 or argv[1] in ('--help', '-h'):
+        print("Usage:")
+        print("  python sacred_harp_analyzer.py [OPTIONS] [--profile[=FILE]] [--fail-on=SEVERITY] file.midi [output.log] [lilypond_file.ly]")
+        print("  python sacred_harp_analyzer.py [OPTIONS] [--profile[=FILE]] --watch file.midi [output.log] [lilypond_file.ly]")
+        print("  python sacred_harp_analyzer.py [OPTIONS] [--fail-on=SEVERITY] --batch DIRECTORY [report.log] [--workers N]")
+        print("  python sacred_harp_analyzer.py --clear-cache")
+        print("\nOPTIONS: [--music21] [--no-cache] [--fatigue-windows=LIST] [--fatigue-weighted]")
+        print("Optional LilyPond file enables precise source location reporting.")
+        print("Pass a .ly file in place of file.midi to analyze the source directly, without compiling it.")
+        print("--music21 parses MIDI with music21 instead of the built-in reader.")
+        print("--no-cache re-analyzes even if the MIDI and LilyPond files are unchanged.")
+        print("--fatigue-windows=bar,two_bars,phrase checks vocal fatigue over those windows instead of")
+        print("8 beats (numbers are beat counts); --fatigue-weighted counts each beat by how long its note lasts.")
+        print("--profile prints stage times and counters after each run; --profile=FILE also writes")
+        print("a Chrome trace (FILE ending in .json) or a cProfile/pstats dump (any other name).")
+        print(f"--fail-on={'|'.join(SEVERITIES[:-1])} stops at the first diagnostic at least that severe")
+        print("and exits with status 1 (also if the analysis fails); for pre-commit hooks and CI.")
+        print("--batch analyzes every MIDI file under DIRECTORY in parallel (see batch_analysis.py).")
+        sys.exit(0 if len(argv) > 1 else 1)
+    
+    if argv[1] == '--clear-cache':
+        cache = AnalysisCache()
+        removed = cache.clear()
+        print(f"Removed {removed} cache entries from {cache.cache_dir}")
+        return
+    
+    if argv[1] == '--batch':
+        if profile:
+            print("--profile can't be used with --batch (songs are analyzed in worker processes)")
+            sys.exit(1)
+        from batch_analysis import main as batch_main
+        batch_main([sys.argv[0]] + [arg for arg in sys.argv[1:] if arg != '--batch'])
+        return
+    
+    if argv[1] == '--watch':
+        midi_file = argv[2] if len(argv) > 2 else 'christian_harmony_song.midi'
+        log_file = argv[3] if len(argv) > 3 else 'harmony.log'
+        lilypond_file = argv[4] if len(argv) > 4 else None
+        watch_midi_file(midi_file, log_file, lilypond_file, use_music21, use_cache, profiler,
+                        fatigue_windows, fatigue_duration_weighted)
     else:
-        midi_file = sys.argv[1]
-        log_file = sys.argv[2] if len(sys.argv) > 2 else 'harmony.log'
-        lilypond_file = sys.argv[3] if len(sys.argv) > 3 else None
+        midi_file = argv[1]
+        log_file = argv[2] if len(argv) > 2 else 'harmony.log'
+        lilypond_file = argv[3] if len(argv) > 3 else None
+        
+        analyzer = SacredHarpAnalyzer(midi_file, log_file, lilypond_file, use_music21, use_cache, profiler,
+                                      fatigue_windows, fatigue_duration_weighted)
+        if fail_on:
+            found = analyzer.first_diagnostic(fail_on)
+            if found is not None:
+                print(f"FAILED ({found.severity}): {found.message.splitlines()[0]}")
+                sys.exit(1)
+            succeeded = analyzer.run_succeeded
+        else:
+            succeeded = analyzer.run_analysis()
         
-        analyzer = SacredHarpAnalyzer(midi_file, log_file, lilypond_file)
-        if analyzer.run_analysis():
+        if succeeded:
             print(f"Analysis complete. Check {log_file} for results.")
             if lilypond_file:
                 print(f"Source locations from {lilypond_file} included in analysis.")
         else:
             print("Analysis failed.")
+            if fail_on:
+                sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
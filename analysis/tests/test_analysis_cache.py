@@ -0,0 +1,57 @@
+"""
+AnalysisCache storage and eviction
+"""
+
+import os
+import pickle
+
+import pytest
+
+import analysis_cache
+from analysis_cache import AnalysisCache
+
+
+def cache_files(cache):
+    return sorted(name for level in os.listdir(cache.cache_dir)
+                  for name in os.listdir(os.path.join(cache.cache_dir, level)))
+
+
+def test_put_and_get(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    cache.put('notes', 'a', {'part_events': [[(0.0, 1.0, (60,))]]})
+    assert cache.get('notes', 'a') == {'part_events': [[(0.0, 1.0, (60,))]]}
+    assert cache.get('notes', 'b') is None
+    assert cache.get('results', 'a') is None
+
+
+def test_eviction_keeps_the_cache_under_its_limit(tmp_path):
+    cache = AnalysisCache(str(tmp_path), max_bytes=10_000)
+    for number in range(50):
+        cache.put('results', str(number), b'x' * 1000)
+        os.utime(cache.entry_path('results', str(number)), (number, number))
+        assert sum(size for _, size, _ in cache.entries()) <= cache.max_bytes
+
+    # Least recently used go first
+    kept = sorted(int(os.path.basename(path).split('.')[0]) for _, _, path in cache.entries())
+    assert kept == list(range(50 - len(kept), 50))
+
+
+def test_eviction_rescans_for_other_writers(tmp_path, monkeypatch):
+    monkeypatch.setattr(analysis_cache, 'RESCAN_INTERVAL', 5)
+    cache = AnalysisCache(str(tmp_path), max_bytes=10_000)
+    other = AnalysisCache(str(tmp_path), max_bytes=10**9)
+    cache.put('results', 'first', b'')
+    for number in range(30):
+        other.put('results', str(number), b'x' * 1000)
+    for number in range(5):
+        cache.put('results', f"mine{number}", b'')
+    assert sum(size for _, size, _ in cache.entries()) <= cache.max_bytes
+
+
+def test_failed_pickle_leaves_no_temp_file(tmp_path):
+    cache = AnalysisCache(str(tmp_path))
+    cache.put('results', 'good', 1)
+    with pytest.raises((pickle.PicklingError, TypeError, AttributeError)):
+        cache.put('results', 'bad', lambda: None)
+    assert cache_files(cache) == ['good.pickle']
+    assert cache.get('results', 'good') == 1
@@ -0,0 +1,146 @@
+"""
+The precomputed chord tables against the analyzer's original chord labeling
+Every one of the 4096 pitch-class sets is labeled both ways, in both modes
+and from every tonic
+"""
+
+import random
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from chord_table import MASK_COUNT
+from sacred_harp_analyzer import (MAJOR_ROMAN_NUMERALS, MAJOR_SCALE_DEGREES, MINOR_ROMAN_NUMERALS, SACRED_HARP_RULES,
+                                  SacredHarpAnalyzer, chord_table_for_mode)
+
+
+class OriginalLabeler:
+    """The analyzer's chord labeling before the tables: every beat's pitches
+    reduced to scale degrees and matched against the chord patterns"""
+
+    def __init__(self, mode, tonic_pitch_class):
+        self.mode = mode
+        self.tonic_pitch_class = tonic_pitch_class
+
+    def identify_sacred_harp_chord(self, pitches):
+        if not pitches:
+            return None, []
+
+        pitch_classes = [p % 12 for p in pitches]
+        unique_pitch_classes = sorted(list(set(pitch_classes)))
+        pitch_class_counts = Counter(pitch_classes)
+
+        scale_degrees = []
+        for pc in unique_pitch_classes:
+            transposed_pc = (pc - self.tonic_pitch_class) % 12
+            if transposed_pc in MAJOR_SCALE_DEGREES:
+                scale_degrees.append(MAJOR_SCALE_DEGREES[transposed_pc])
+
+        scale_degrees = sorted(list(set(scale_degrees)))
+
+        if not scale_degrees:
+            return "Unknown", unique_pitch_classes
+
+        chord_root, roman_numeral = self.determine_chord_root_and_roman(scale_degrees)
+
+        return roman_numeral, scale_degrees
+
+    def determine_chord_root_and_roman(self, scale_degrees):
+        if not scale_degrees:
+            return None, "Unknown"
+
+        scale_set = set(scale_degrees)
+
+        if scale_set == {1, 3, 5}:
+            return 1, 'I'
+        elif scale_set == {6, 1, 3}:
+            return 6, 'vi'
+        elif scale_set == {5, 7, 2}:
+            return 5, 'V'
+        elif scale_set == {4, 6, 1}:
+            return 4, 'IV'
+        elif scale_set == {2, 4, 6}:
+            return 2, 'ii'
+        elif scale_set == {3, 5, 7}:
+            return 3, 'iii'
+        elif scale_set == {7, 2, 4}:
+            return 7, 'vii°'
+
+        elif scale_set == {1, 5}:
+            return 1, 'I'
+        elif scale_set == {1, 3}:
+            return 1, 'I'
+        elif scale_set == {6, 3}:
+            return 6, 'vi'
+        elif scale_set == {5, 7}:
+            return 5, 'V'
+        elif scale_set == {5, 2}:
+            return 5, 'V'
+
+        elif len(scale_degrees) == 1:
+            degree = scale_degrees[0]
+            if self.mode == 'major':
+                return degree, MAJOR_ROMAN_NUMERALS.get(degree, f"?{degree}")
+            else:
+                return degree, MINOR_ROMAN_NUMERALS.get(degree, f"?{degree}")
+
+        else:
+            root_degree = min(scale_degrees)
+            if self.mode == 'major':
+                return root_degree, MAJOR_ROMAN_NUMERALS.get(root_degree, f"?{root_degree}")
+            else:
+                return root_degree, MINOR_ROMAN_NUMERALS.get(root_degree, f"?{root_degree}")
+
+    def assess_chord(self, roman_numeral):
+        rules = SACRED_HARP_RULES.get(self.mode, SACRED_HARP_RULES['major'])
+
+        if roman_numeral in rules['forbidden']:
+            return {'status': 'FORBIDDEN', 'message': f'{roman_numeral} chord FORBIDDEN in Sacred Harp style'}
+        elif roman_numeral in rules['common']:
+            return {'status': 'GOOD', 'message': f'{roman_numeral} chord - excellent choice for Sacred Harp'}
+        elif roman_numeral in rules['quite_common']:
+            return {'status': 'OK', 'message': f'{roman_numeral} chord - good Sacred Harp choice'}
+        elif roman_numeral in rules['rare']:
+            return {'status': 'WARNING', 'message': f'{roman_numeral} chord - use sparingly in Sacred Harp'}
+        else:
+            return {'status': 'UNKNOWN', 'message': f'{roman_numeral} chord - check Sacred Harp style guide'}
+
+
+def mask_pitches(mask, tonic_pitch_class):
+    """Voiced pitches for a tonic-relative mask, spread over octaves with the lowest doubled"""
+    pitches = [48 + tonic_pitch_class + interval + 12 * (interval % 3)
+               for interval in range(12) if mask >> interval & 1]
+    return pitches + pitches[:1]
+
+
+@pytest.mark.parametrize('mode', ['major', 'minor'])
+def test_table_matches_original_labeling(mode):
+    table = chord_table_for_mode(mode)
+    for tonic_pitch_class in range(12):
+        original = OriginalLabeler(mode, tonic_pitch_class)
+        analyzer = SimpleNamespace(mode=mode, tonic_pitch_class=tonic_pitch_class)
+        for mask in range(MASK_COUNT):
+            roman_numeral, scale_degrees = original.identify_sacred_harp_chord(
+                mask_pitches(mask, tonic_pitch_class))
+            assert SacredHarpAnalyzer.label_chord(analyzer, mask) == (roman_numeral, scale_degrees)
+
+            entry = table[mask]
+            if roman_numeral is None:
+                assert entry is None
+                continue
+            assert entry.assessment == original.assess_chord(roman_numeral)
+            if entry.scale_degrees is not None:
+                assert entry.root == original.determine_chord_root_and_roman(scale_degrees)[0]
+
+
+@pytest.mark.parametrize('mode', ['major', 'minor'])
+def test_lookup_many_matches_single_lookups(mode):
+    table = chord_table_for_mode(mode)
+    assert table.lookup_many(range(MASK_COUNT)) == [table[mask] for mask in range(MASK_COUNT)]
+
+    generator = random.Random(0)
+    masks = [generator.randrange(MASK_COUNT) for _ in range(1000)]
+    assert table.lookup_many(np.array(masks)) == [table[mask] for mask in masks]
+    assert table.lookup_many([]) == []
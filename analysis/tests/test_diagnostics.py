@@ -0,0 +1,111 @@
+"""
+Diagnostic sinks: what a run writes is what reading the log gives back
+"""
+
+import json
+import os
+import sqlite3
+
+from diagnostics import Diagnostic, JsonLinesSink, RotatingFileSink, SqliteSink, info, latest_run, read_index
+
+
+def run_entries(number):
+    """(timestamp, Diagnostic) entries of one run, with fractional beats and empty fields"""
+    timestamp = f"2025-08-01 12:00:{number:02d}"
+    return [
+        (timestamp, info(f"=== Run {number} ===")),
+        (timestamp, Diagnostic('warning', 'voice_leading', f"Bar {number}, Beat 2.5: Bass leaps a 9th",
+                               number, 2.5, 'bass', 43, 90 + number)),
+        (timestamp, Diagnostic('forbidden', 'chord', f"Bar {number}, Beat 1: vii° chord FORBIDDEN",
+                               number, 1, None, None, 91 + number)),
+        (timestamp, Diagnostic('critical', 'range', "Ténor too high: A5", number, 3.333, 'tenor', 81, None)),
+    ]
+
+
+def text_of(entries):
+    return ''.join(f"{timestamp}: {diagnostic.message}\n" for timestamp, diagnostic in entries)
+
+
+def test_jsonl_round_trip(tmp_path):
+    path = str(tmp_path / 'harmony.jsonl')
+    sink = JsonLinesSink(path)
+    for number in range(3):
+        sink.write_run(f"run{number}", run_entries(number))
+
+    with open(path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+    assert [(record.pop('run_id'), record.pop('timestamp'), Diagnostic(**record)) for record in records] == [
+        (f"run{number}", timestamp, diagnostic)
+        for number in range(3) for timestamp, diagnostic in run_entries(number)]
+
+    latest = [json.loads(line) for line in latest_run(path).splitlines()]
+    assert {record['run_id'] for record in latest} == {'run2'}
+
+
+def test_sqlite_round_trip(tmp_path):
+    path = str(tmp_path / 'harmony.db')
+    sink = SqliteSink(path, max_runs=2)
+    for number in range(3):
+        sink.write_run(f"run{number}", run_entries(number), {'midi_file': 'song.midi', 'lilypond_file': 'song.ly'})
+
+    connection = sqlite3.connect(path)
+    try:
+        runs = connection.execute("SELECT run_id, started, midi_file, lilypond_file FROM runs ORDER BY seq").fetchall()
+        rows = connection.execute(f"SELECT run_id, timestamp, {', '.join(Diagnostic._fields)} FROM diagnostics "
+                                  "ORDER BY run_id, position").fetchall()
+        beat_types = connection.execute("SELECT DISTINCT typeof(beat) FROM diagnostics").fetchall()
+    finally:
+        connection.close()
+
+    # Only the newest max_runs are kept
+    assert runs == [(f"run{number}", run_entries(number)[0][0], 'song.midi', 'song.ly') for number in (1, 2)]
+    assert [(run_id, timestamp, Diagnostic(*fields)) for run_id, timestamp, *fields in rows] == [
+        (f"run{number}", timestamp, diagnostic)
+        for number in (1, 2) for timestamp, diagnostic in run_entries(number)]
+    assert set(beat_types) == {('real',), ('null',)}
+
+    assert latest_run(path) == text_of(run_entries(2))
+
+
+def test_rotation_keeps_every_indexed_run_readable(tmp_path):
+    path = str(tmp_path / 'harmony.log')
+    run_size = len(text_of(run_entries(0)).encode('utf-8'))
+    sink = RotatingFileSink(path, max_bytes=3 * run_size, backups=2)
+    for number in range(20):
+        sink.write_run(f"run{number}", run_entries(number))
+        assert latest_run(path) == text_of(run_entries(number))
+
+    assert sorted(os.listdir(tmp_path)) == ['harmony.log', 'harmony.log.1', 'harmony.log.2', 'harmony.log.index']
+    for name in ('harmony.log', 'harmony.log.1', 'harmony.log.2'):
+        assert os.path.getsize(tmp_path / name) <= sink.max_bytes
+
+    # The index covers exactly the runs still on disk, oldest first, each readable at its offset
+    entries = read_index(sink.index_path)
+    numbers = [int(entry['run_id'][3:]) for entry in entries]
+    assert numbers == list(range(20 - len(entries), 20))
+    with_backups = ''
+    for name in ('harmony.log.2', 'harmony.log.1', 'harmony.log'):
+        with open(tmp_path / name, encoding='utf-8') as f:
+            with_backups += f.read()
+    assert with_backups == ''.join(text_of(run_entries(number)) for number in numbers)
+    for number, entry in zip(numbers, entries):
+        with open(tmp_path / entry['file'], 'rb') as f:
+            f.seek(entry['offset'])
+            assert f.read(entry['length']).decode('utf-8') == text_of(run_entries(number))
+
+
+def test_index_entry(tmp_path):
+    path = str(tmp_path / 'harmony.log')
+    sink = RotatingFileSink(path)
+    sink.write_run('run0', run_entries(0), {'midi_file': 'song.midi'})
+    sink.write_run('run1', [], {'midi_file': 'song.midi'})
+    sink.write_run('run2', run_entries(2), {'midi_file': 'song.midi'})
+
+    first, second = read_index(sink.index_path)
+    assert first == {'run_id': 'run0', 'started': run_entries(0)[0][0], 'file': 'harmony.log', 'offset': 0,
+                     'length': len(text_of(run_entries(0)).encode('utf-8')),
+                     'counts': {'critical': 1, 'forbidden': 1, 'warning': 1, 'info': 1}, 'midi_file': 'song.midi'}
+    assert second['run_id'] == 'run2'
+    assert second['offset'] == first['length']
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == text_of(run_entries(0)) + text_of(run_entries(2))
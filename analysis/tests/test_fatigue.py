@@ -0,0 +1,124 @@
+"""
+The vectorized fatigue engine against the analyzer's original per-window loop
+"""
+
+import random
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from fatigue import (DEFAULT_WINDOW_BEATS, fatigue_candidates, select_findings, update_fatigue_candidates,
+                     window_sums)
+from range_tables import SACRED_HARP_RANGES
+
+VOICES = list(SACRED_HARP_RANGES)
+LOW_LIMITS = [SACRED_HARP_RANGES[voice]['percentile_10'] for voice in VOICES]
+HIGH_LIMITS = [SACRED_HARP_RANGES[voice]['percentile_90'] for voice in VOICES]
+
+
+def original_loop(pitch_table, measures, beats_per_measure, window_size=DEFAULT_WINDOW_BEATS):
+    """Findings as the analyzer computed them before the engine: every window
+    of every voice counted note by note, the most severe one kept per bar range"""
+    findings = []
+    for voice_index, voice in enumerate(VOICES):
+        ranges = SACRED_HARP_RANGES[voice]
+        history = [None if np.isnan(pitch) else (pitch, measure)
+                   for pitch, measure in zip(pitch_table[voice_index], measures)]
+        reported_ranges = set()
+
+        for i in range(len(history) - window_size + 1):
+            window = history[i:i + window_size]
+            extreme_high = extreme_low = 0
+            consecutive_high = consecutive_low = 0
+            max_consecutive_high = max_consecutive_low = 0
+
+            for note_data in window:
+                if note_data is None:
+                    consecutive_high = consecutive_low = 0
+                    continue
+                if note_data[0] > ranges['percentile_90']:
+                    extreme_high += 1
+                    consecutive_high += 1
+                    consecutive_low = 0
+                    max_consecutive_high = max(max_consecutive_high, consecutive_high)
+                elif note_data[0] < ranges['percentile_10']:
+                    extreme_low += 1
+                    consecutive_low += 1
+                    consecutive_high = 0
+                    max_consecutive_low = max(max_consecutive_low, consecutive_low)
+                else:
+                    consecutive_high = consecutive_low = 0
+
+            start_measure = window[0][1] if window[0] else i // beats_per_measure + 1
+            end_measure = window[-1][1] if window[-1] else (i + window_size - 1) // beats_per_measure + 1
+            if (start_measure, end_measure) in reported_ranges:
+                continue
+
+            if extreme_high >= 5:
+                finding = ('sustained', 'high', extreme_high)
+            elif max_consecutive_high >= 4:
+                finding = ('consecutive', 'high', max_consecutive_high)
+            elif extreme_low >= 5:
+                finding = ('sustained', 'low', extreme_low)
+            elif max_consecutive_low >= 4:
+                finding = ('consecutive', 'low', max_consecutive_low)
+            else:
+                continue
+            reported_ranges.add((start_measure, end_measure))
+            findings.append((voice_index,) + finding + (start_measure, end_measure))
+    return findings
+
+
+def random_piece(seed, beats=64, beats_per_measure=4):
+    """A voices x beats pitch table wandering across each voice's range, with rests"""
+    generator = random.Random(seed)
+    pitch_table = np.full((len(VOICES), beats), np.nan)
+    for voice_index in range(len(VOICES)):
+        pitch = (LOW_LIMITS[voice_index] + HIGH_LIMITS[voice_index]) / 2
+        for beat in range(beats):
+            pitch = min(max(pitch + generator.choice([-3, -2, -1, 0, 1, 2, 3]), LOW_LIMITS[voice_index] - 4),
+                        HIGH_LIMITS[voice_index] + 4)
+            if generator.random() > 0.1:
+                pitch_table[voice_index, beat] = round(pitch)
+    measures = [beat // beats_per_measure + 1 for beat in range(beats)]
+    return pitch_table, measures
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_engine_matches_original_loop(seed):
+    pitch_table, measures = random_piece(seed)
+    candidates = fatigue_candidates(pitch_table, LOW_LIMITS, HIGH_LIMITS, measures, 4)
+    findings = [(voice, finding['kind'], finding['extreme'], finding['count'],
+                 finding['start_measure'], finding['end_measure'])
+                for voice, voice_findings in enumerate(select_findings(candidates, len(VOICES)))
+                for finding in voice_findings]
+    assert findings == original_loop(pitch_table, measures, 4)
+
+
+def test_window_sums_are_exact():
+    generator = random.Random(0)
+    weights = [[Fraction(generator.randint(0, 12), generator.choice([6, 12, 18, 24])) for _ in range(50)]
+               for _ in range(len(VOICES))]
+    sums = window_sums(np.array(weights, dtype=float), 8)
+    expected = [[float(sum(row[start:start + 8])) for start in range(len(row) - 7)] for row in weights]
+    assert sums.tolist() == expected
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_update_matches_full_run(seed):
+    # Weighted, several windows: redoing the dirty windows gives exactly the full result
+    generator = random.Random(seed)
+    pitch_table, measures = random_piece(seed)
+    weights = np.array([[generator.randint(1, 12) / 12 for _ in measures] for _ in VOICES])
+    windows = (4, 8, 16)
+    previous = fatigue_candidates(pitch_table, LOW_LIMITS, HIGH_LIMITS, measures, 4, windows, weights)
+
+    dirty_beats = generator.sample(range(len(measures)), 3)
+    for beat in dirty_beats:
+        pitch_table[:, beat] += generator.choice([-12, 12])
+        weights[:, beat] = generator.randint(1, 12) / 12
+
+    updated = update_fatigue_candidates(previous, dirty_beats, pitch_table, LOW_LIMITS, HIGH_LIMITS,
+                                        measures, 4, windows, weights)
+    assert updated == fatigue_candidates(pitch_table, LOW_LIMITS, HIGH_LIMITS, measures, 4, windows, weights)
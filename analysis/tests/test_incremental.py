@@ -0,0 +1,53 @@
+"""
+Incremental re-analysis against a full run
+After an edit, re-running the same analyzer reuses the measures whose notes
+didn't change; what it logs must be exactly what a fresh --no-cache run logs
+"""
+
+import os
+import shutil
+
+import pytest
+
+from sacred_harp_analyzer import SacredHarpAnalyzer
+
+SONG = os.path.join(os.path.dirname(__file__), '..', '..', 'compositions', 'bevois-29-7-25', 'bevois.ly')
+MEASURES = 16
+
+# Lines only an incremental run logs
+INCREMENTAL_REPORT = ('INCREMENTAL: ', 'CHANGES SINCE LAST RUN: ', 'NEW: ', 'RESOLVED: ')
+
+
+def diagnostics(analyzer):
+    return [diagnostic for diagnostic in analyzer.iter_diagnostics()
+            if not diagnostic.message.startswith(INCREMENTAL_REPORT)]
+
+
+def edit_line(path, line_number, old, new):
+    with open(path, encoding='utf-8') as f:
+        lines = f.readlines()
+    assert old in lines[line_number - 1]
+    lines[line_number - 1] = lines[line_number - 1].replace(old, new, 1)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+
+
+@pytest.mark.parametrize('line_number, old, new, reanalyzed', [
+    (93, 'la2 la4', 'la2 sol4', 1),           # One note of one measure
+    (93, 'la2 la4', 'la2 la4 % edited', 0),   # Source only: the context lines change
+    (5, '\n', '\n% A comment line\n', 0),     # Every later note moves down a line
+], ids=['note', 'comment', 'new-line'])
+def test_incremental_run_matches_full_run(tmp_path, line_number, old, new, reanalyzed):
+    song = str(tmp_path / 'bevois.ly')
+    shutil.copy(SONG, song)
+
+    analyzer = SacredHarpAnalyzer(song, str(tmp_path / 'incremental.log'), use_cache=False)
+    assert analyzer.run_analysis()
+
+    edit_line(song, line_number, old, new)
+    analyzer.reload_lilypond_source()
+    incremental = diagnostics(analyzer)
+    assert analyzer.reanalyzed_measures == (reanalyzed, MEASURES)
+
+    full = SacredHarpAnalyzer(song, str(tmp_path / 'full.log'), use_cache=False)
+    assert incremental == diagnostics(full)
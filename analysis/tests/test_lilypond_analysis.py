@@ -0,0 +1,46 @@
+"""
+Analyzing a .ly directly against analyzing its compiled MIDI, for every composition
+Both must find the same key, meter and diagnostics (sources mapped to the same lines)
+"""
+
+import glob
+import os
+
+import pytest
+
+from sacred_harp_analyzer import SacredHarpAnalyzer
+
+COMPOSITIONS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'compositions')
+
+# song.midi was compiled from an earlier song.ly, in another key; the .ly has since
+# been reset to the empty template, so the two can't agree until it is recompiled
+STALE_MIDI = {'re-derrick-5-8-25/song.midi': "song.midi is stale against song.ly (its key differs)"}
+
+
+def song_params():
+    params = []
+    for midi_file in sorted(glob.glob(os.path.join(COMPOSITIONS_DIR, '*', '*.midi'))):
+        name = os.path.relpath(midi_file, COMPOSITIONS_DIR).replace(os.sep, '/')
+        marks = [pytest.mark.xfail(reason=STALE_MIDI[name], strict=True)] if name in STALE_MIDI else []
+        params.append(pytest.param(midi_file, id=name, marks=marks))
+    return params
+
+
+def analyze(path, log_file, lilypond_file=None):
+    analyzer = SacredHarpAnalyzer(path, str(log_file), lilypond_file, use_cache=False)
+    # 'run' lines name the input file; everything else must match exactly
+    diagnostics = [diagnostic for diagnostic in analyzer.iter_diagnostics() if diagnostic.rule != 'run']
+    assert analyzer.run_succeeded
+    return analyzer, diagnostics
+
+
+@pytest.mark.parametrize('midi_file', song_params())
+def test_lilypond_analysis_matches_midi(midi_file, tmp_path):
+    lilypond_file = os.path.splitext(midi_file)[0] + '.ly'
+
+    from_midi, midi_diagnostics = analyze(midi_file, tmp_path / 'midi.log', lilypond_file)
+    from_source, source_diagnostics = analyze(lilypond_file, tmp_path / 'source.log')
+
+    assert (from_source.key, from_source.mode) == (from_midi.key, from_midi.mode)
+    assert from_source.time_signature == from_midi.time_signature
+    assert source_diagnostics == midi_diagnostics
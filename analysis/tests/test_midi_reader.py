@@ -0,0 +1,55 @@
+"""
+The built-in MIDI reader against music21 on every composition
+Both paths must give the analyzer the same notes, meter and key signature
+"""
+
+import glob
+import os
+
+import music21
+import pytest
+
+from midi_reader import KeySignature, TimeSignature, read_midi
+from note_index import PartIndex
+
+COMPOSITIONS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'compositions')
+MIDI_FILES = sorted(glob.glob(os.path.join(COMPOSITIONS_DIR, '*', '*.midi')))
+
+
+@pytest.fixture(params=MIDI_FILES, ids=os.path.basename)
+def midi_file(request):
+    return request.param
+
+
+def test_part_events_match_music21(midi_file):
+    midi_data = read_midi(midi_file)
+    score = music21.converter.parse(midi_file)
+    parts = score.parts if score.parts else [score]
+
+    native = [PartIndex(midi_data.part_events(track)) for track in midi_data.note_tracks()]
+    expected = [PartIndex.from_part(part) for part in parts]
+
+    assert len(native) == len(expected)
+    for native_index, expected_index in zip(native, expected):
+        assert native_index.onsets == expected_index.onsets
+        assert native_index.releases == expected_index.releases
+        assert native_index.pitches == expected_index.pitches
+
+
+def test_meter_and_key_match_music21(midi_file):
+    midi_data = read_midi(midi_file)
+    score = music21.converter.parse(midi_file)
+
+    time_sigs = midi_data.meta_events('time_signature')
+    expected_time_sigs = score.flatten().getElementsByClass(music21.meter.TimeSignature)
+    assert bool(time_sigs) == bool(expected_time_sigs)
+    if time_sigs:
+        assert time_sigs[0].value == TimeSignature(expected_time_sigs[0].numerator,
+                                                   expected_time_sigs[0].denominator)
+
+    key_sigs = midi_data.meta_events('key_signature')
+    expected_key_sigs = score.flatten().getElementsByClass(music21.key.KeySignature)
+    assert bool(key_sigs) == bool(expected_key_sigs)
+    if key_sigs:
+        assert key_sigs[0].value == KeySignature(expected_key_sigs[0].sharps,
+                                                 getattr(expected_key_sigs[0], 'mode', 'major'))
@@ -0,0 +1,67 @@
+"""
+ProgressionMatcher against a linear scan of the pattern library
+Every pattern is tried at every position of a progression, the way the
+analyzer checked progressions before the matcher
+"""
+
+import random
+
+import pytest
+
+from progression_matcher import Match, Pattern, ProgressionMatcher, load_patterns
+
+MAJOR_NUMERALS = ('I', 'ii', 'iii', 'IV', 'V', 'vi', 'vii°')
+MINOR_NUMERALS = ('i', 'ii°', 'III', 'iv', 'v', 'VI', 'VII')
+
+
+def linear_scan(patterns, tokens, mode=None):
+    """Every (pattern, start, end) occurrence, by end position"""
+    matches = []
+    for end in range(1, len(tokens) + 1):
+        for pattern in patterns:
+            if mode is not None and pattern.mode not in ('any', mode):
+                continue
+            start = end - len(pattern.tokens)
+            if start >= 0 and tuple(tokens[start:end]) == pattern.tokens:
+                matches.append(Match(pattern, start, end))
+    return matches
+
+
+def in_order(matches):
+    """Matches by end position; the order of those ending together is left open"""
+    assert [match.end for match in matches] == sorted(match.end for match in matches)
+    return sorted(matches, key=lambda match: (match.end, match.start, match.pattern.line))
+
+
+def random_progressions(numerals, count=200, seed=0):
+    generator = random.Random(seed)
+    return [[generator.choice(numerals) for _ in range(generator.randint(0, 40))] for _ in range(count)]
+
+
+@pytest.mark.parametrize('mode', [None, 'major', 'minor'])
+def test_library_matches_linear_scan(mode):
+    patterns = load_patterns()
+    matcher = ProgressionMatcher(patterns)
+    for tokens in random_progressions(MAJOR_NUMERALS + MINOR_NUMERALS):
+        assert in_order(matcher.find(tokens, mode)) == in_order(linear_scan(patterns, tokens, mode))
+
+
+def test_overlapping_patterns_match_linear_scan():
+    # Patterns that are prefixes, suffixes and infixes of one another exercise the failure links
+    patterns = [Pattern('good', 'any', tuple(tokens.split()), number)
+                for number, tokens in enumerate(['I', 'I IV', 'IV V I', 'V I', 'I IV V I', 'I I I', 'vi V'], 1)]
+    matcher = ProgressionMatcher(patterns)
+    for tokens in random_progressions(('I', 'IV', 'V', 'vi'), count=500, seed=1):
+        assert in_order(matcher.find(tokens)) == in_order(linear_scan(patterns, tokens))
+
+
+@pytest.mark.parametrize('mode, numerals', [('major', MAJOR_NUMERALS), ('minor', MINOR_NUMERALS)])
+def test_forbidden_chords_match_original_rules(mode, numerals):
+    # The analyzer used to flag vii° anywhere and ii° in minor keys, chord by chord
+    matcher = ProgressionMatcher(load_patterns())
+    for tokens in random_progressions(numerals, seed=2):
+        forbidden = [(match.start, match.pattern.tokens) for match in matcher.find(tokens, mode)
+                     if match.pattern.kind == 'forbidden']
+        expected = [(i, (chord,)) for i, chord in enumerate(tokens)
+                    if chord == 'vii°' or (chord == 'ii°' and mode == 'minor')]
+        assert forbidden == expected
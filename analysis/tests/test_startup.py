@@ -0,0 +1,95 @@
+"""
+Startup-time budget for the analyzer CLI
+Runs common commands under `python -X importtime` and fails if their
+import time goes over budget or they load modules they shouldn't
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+ANALYSIS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+TEMPLATE_MIDI = os.path.join(ANALYSIS_DIR, '..', 'templates', 'template.midi')
+
+RUNS = 10
+
+# Import-time budgets in milliseconds (fastest of RUNS, interpreter startup excluded;
+# the fastest run is the one least disturbed by whatever else the machine is doing)
+# 'forbidden' lists modules the command must not import at all
+STARTUP_BUDGETS = {
+    'help': {
+        'code': "import sys; sys.argv = ['sacred_harp_analyzer.py', '--help']\n"
+                "import sacred_harp_analyzer\n"
+                "try:\n    sacred_harp_analyzer.main()\nexcept SystemExit:\n    pass",
+        'budget_ms': 30,
+        'forbidden': ['numpy', 'music21']
+    },
+    'range_tables': {
+        'code': "from sacred_harp_analyzer import SACRED_HARP_RANGES, SACRED_HARP_RULES",
+        'budget_ms': 30,
+        'forbidden': ['numpy', 'music21']
+    },
+    'analyze': {
+        # --no-cache so the full (uncached) analysis path is what gets measured
+        'code': "import sys; sys.argv = ['sacred_harp_analyzer.py', '--no-cache', {midi!r}, {log!r}]\n"
+                "import sacred_harp_analyzer\n"
+                "sacred_harp_analyzer.main()",
+        'budget_ms': 250,
+        'forbidden': ['music21']
+    }
+}
+
+
+def parse_importtime(stderr):
+    """Return (total ms of imports after interpreter startup, set of imported modules)"""
+    total_us = 0
+    modules = set()
+    after_site = False
+
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # "import time:  self_us | cumulative_us | <indent>module"
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        modules.add(module.split('.')[0])
+
+        top_level = not name[1:].startswith(' ')
+        if top_level and after_site:
+            total_us += int(cumulative_us)
+        if top_level and module == 'site':
+            after_site = True
+
+    return total_us / 1000, modules
+
+
+def measure(command, runs):
+    """Run one budget command `runs` times; return (fastest ms, modules imported)"""
+    timings = []
+    modules = set()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        code = command['code'].format(midi=TEMPLATE_MIDI, log=os.path.join(tmp, 'harmony.log'))
+        for _ in range(runs):
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                    cwd=ANALYSIS_DIR, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Command failed:\n{result.stderr.splitlines()[-1]}")
+            elapsed, imported = parse_importtime(result.stderr)
+            timings.append(elapsed)
+            modules |= imported
+
+    return min(timings), modules
+
+
+@pytest.mark.parametrize('name', STARTUP_BUDGETS)
+def test_startup_budget(name):
+    command = STARTUP_BUDGETS[name]
+    elapsed, modules = measure(command, RUNS)
+
+    loaded = sorted(set(command['forbidden']) & modules)
+    assert not loaded, f"{name} imports forbidden modules: {', '.join(loaded)}"
+    assert elapsed <= command['budget_ms'], f"{name}: {elapsed:.1f} ms (budget {command['budget_ms']} ms)"
@@ -28,6 +28,24 @@ else
     exit 1
 fi
 
+ANALYSIS_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)/analysis"
+
+# Run analysis/compile_orchestrator.py (compiles through the content-hash build cache)
+run_orchestrator() {
+    if command -v uv &> /dev/null; then
+        uv run --project "$ANALYSIS_DIR" "$ANALYSIS_DIR/compile_orchestrator.py" "$@"
+    else
+        python3 "$ANALYSIS_DIR/compile_orchestrator.py" "$@"
+    fi
+}
+
+# On Linux, --all is handled by the Python orchestrator: parallel compiles,
+# then analysis of each new MIDI file
+if [[ "$WATCH_ALL" == true && "$(uname)" == "Linux" ]]; then
+    run_orchestrator --all .
+    exit $?
+fi
+
 # Check if fswatch is installed
 if ! command -v fswatch &> /dev/null; then
     echo "Error: fswatch is not installed"
@@ -68,8 +86,8 @@ compile_ly() {
     local file="$1"
     local pdf_file="${file%.ly}.pdf"
     
-    # Run lilypond
-    if lilypond "$file"; then
+    # Run lilypond, or restore the PDF and MIDI if this content was built before
+    if run_orchestrator --once --no-analysis "$file"; then
         # Open/reload PDF in Preview
         if [[ -f "$pdf_file" ]]; then
             local full_pdf_path="$(pwd)/$pdf_file"
@@ -183,16 +201,16 @@ initial_setup() {
         for ly_file in *.ly; do
             if [[ -f "$ly_file" ]]; then
                 local pdf_file="${ly_file%.ly}.pdf"
-                if [[ ! -f "$pdf_file" ]]; then
-                    echo "Compiling $ly_file for the first time..."
+                if [[ ! -f "$pdf_file" || "$ly_file" -nt "$pdf_file" ]]; then
+                    echo "Compiling $ly_file..."
                     compile_ly "$ly_file"
                 fi
             fi
         done
     else
         local pdf_file="${TARGET_FILE%.ly}.pdf"
-        if [[ ! -f "$pdf_file" ]]; then
-            echo "Compiling $TARGET_FILE for the first time..."
+        if [[ ! -f "$pdf_file" || "$TARGET_FILE" -nt "$pdf_file" ]]; then
+            echo "Compiling $TARGET_FILE..."
             compile_ly "$TARGET_FILE"
         fi
     fi